@@ -1,69 +1,285 @@
+import time
+import asyncio
 import logging
 import random
 import pytz
+import config
 from datetime import datetime
 from typing import List, Tuple
-from riotapi import MatchListApi, MatchApi, SummonerApi, RitoPlsError
+from riotapi import MatchListApi, MatchApi, SummonerApi, RitoPlsError, RateLimitedError, check_region
 from riotdata import ChampionData
 from rediscache import RedisCache
-from utils import map_key, LogMixin
+from matchrecord import project_match, to_record, is_current, champion_ids
+import matchrecord as mr
+from metrics import metrics
+from utils import LogMixin, run_sync
 
-class GameAnalyzer(LogMixin):
+RANKED_QUEUES = {420, 440}
 
-    def __init__(self, summoner_name):
-        self.summoner_name = summoner_name
+class AsyncGameAnalyzer(LogMixin):
+    '''
+    Fetch and analysis pipeline of one summoner. Lookups are coroutines,
+    run them on the process event loop, see utils.run_async. GameAnalyzer
+    wraps them for threaded callers.
+    '''
 
-    def analyze_last_game(self, raw=False):
-        match_data = self._get_last_game()
-        analyzer = PlayerAnalyzer(self.summoner_name, match_data)
-        return analyzer.analyze(raw)
+    def __init__(self, summoner_name, region=None):
+        self.summoner_name = summoner_name
+        self.region = check_region(region)
+        region = self.region
 
-    def _get_last_game(self):
         # Initialize apis
-        champions = ChampionData()
-
-        summoner_api = SummonerApi()
-        match_api = MatchApi()
-
-        summoners = RedisCache('summoners_', summoner_api.get)
-        matches = RedisCache('matches_', match_api.get)
+        self.champions = ChampionData()
+        self.match_api = MatchApi(region)
+
+        # summoner names, account and game ids are only unique within a region.
+        # ttls and memory budgets come from config.CACHE_POLICIES
+        self.summoners = RedisCache(
+            f'summoners_{region}_', SummonerApi(region).get_async,
+            local_ttl=config.LOCAL_CACHE_SUMMONER_TTL,
+            negative_ttl=config.NEGATIVE_TTL_SUMMONER, negative_error=RitoPlsError)
+        self.match_lists = RedisCache(
+            f'matchlists_{region}_', MatchListApi(region).get_game_list_async,
+            negative_ttl=config.NEGATIVE_TTL_MATCH_LIST, negative_error=RitoPlsError)
+        self.matches = RedisCache(
+            f'matches_{region}_', self._fetch_match,
+            negative_ttl=config.NEGATIVE_TTL_MATCH, negative_error=RitoPlsError)
+        self.results = RedisCache(f'results_{region}_', self._analyze_result)
+        # per (match, summoner) scores for history. filled in batches, never fetched one by one
+        self.scores = RedisCache(f'scores_{region}_', None)
+
+    async def analyze_last_game(self, raw=False):
+        result = await self.get_last_result()
+        if raw:
+            return PlayerAnalyzer.raw_result(result)
+        return PlayerAnalyzer.render(self.summoner_name, result)
+
+    async def get_last_result(self) -> dict:
+        '''
+        Score of the last game. Cached by latest game id so repeated
+        requests skip fetching and analyzing the match.
+        '''
+        game_ids = await self.get_game_ids(fresh=True)
+        if not game_ids:
+            raise RitoPlsError(f'No games for {self.summoner_name} found')
+        return await self.get_result(game_ids[0])
+
+    async def get_result(self, game_id) -> dict:
+        '''
+        Score of the summoner in game_id. Failures are not cached, a match
+        riot does not serve yet is fetched again on the next request.
+        '''
+        return await self.results.get(self.result_key(game_id))
+
+    def result_key(self, game_id) -> str:
+        return f'{self.summoner_name}_{game_id}_v{PlayerAnalyzer.version}'
 
+    @staticmethod
+    def result_game_id(key: str) -> int:
+        # names may contain underscores, the game id is the second to last part
+        return int(key.rsplit('_', 2)[1])
+
+    def score_key(self, game_id) -> str:
+        return f'{game_id}_{self.summoner_name}_v{PlayerAnalyzer.version}'
+
+    async def analyze_history(self, count: int) -> List[dict]:
+        '''
+        Scores of last count ranked games, newest first. Scores are memoized
+        per match so only new games are analyzed. Missing matches are
+        fetched concurrently.
+        '''
+        game_ids = (await self.get_game_ids(RANKED_QUEUES, fresh=True))[:count]
+        keys = {game_id: self.score_key(game_id) for game_id in game_ids}
+        cached = await self.scores.peek_many(keys.values())
+        missing = [game_id for game_id in game_ids if keys[game_id] not in cached]
+
+        if missing:
+            self.logger.debug('Analyzing %s new games of %s', len(missing), self.summoner_name)
+            fetched = await asyncio.gather(*map(self.get_match, missing), return_exceptions=True)
+            records = self._usable_records(missing, fetched)
+            champions = await self._get_champions(set().union(*map(champion_ids, records)))
+            new_scores = self._score_records(records, champions, keys, await self.account_id())
+            await self.scores.set_many(new_scores)
+            cached.update(new_scores)
+        return [cached[keys[game_id]] for game_id in game_ids if keys[game_id] in cached]
+
+    def _usable_records(self, game_ids: list, fetched: list) -> list:
+        '''
+        Drop matches that failed to load. Rate limiting aborts the whole history.
+        '''
+        records = []
+        for game_id, record in zip(game_ids, fetched):
+            if isinstance(record, RateLimitedError):
+                raise record
+            if isinstance(record, Exception):
+                self.logger.warning('Skipping game %s: %s', game_id, record)
+                continue
+            records.append(record)
+        return records
+
+    def _score_records(self, records: list, champions: dict, keys: dict, account_id=None) -> dict:
+        '''
+        Scores of the summoner in records. Records the summoner can not be found in are skipped.
+        '''
+        scores = {}
+        for record in records:
+            try:
+                result = PlayerAnalyzer(self.summoner_name, record, champions, account_id).score()
+            except ValueError as exc:
+                self.logger.warning('Skipping game %s: %s', record['gameId'], exc)
+                continue
+            result['gameId'] = record['gameId']
+            scores[keys[record['gameId']]] = result
+        return scores
+
+    async def _analyze_result(self, key) -> dict:
+        record = await self.get_match(self.result_game_id(key))
+        champions = await self._get_champions(champion_ids(record))
+        return PlayerAnalyzer(self.summoner_name, record, champions, await self.account_id()).score()
+
+    async def account_id(self) -> str:
+        # matches are searched by account id, names in older matches may be from before a rename
+        return (await self.summoners.get(self.summoner_name))['accountId']
+
+    async def get_game_ids(self, queues=None, fresh=False) -> List[int]:
+        '''
+        Game ids of the summoner, newest first. With fresh a cached match
+        list older than config.MATCH_LIST_FRESH is fetched again, lookups
+        of other summoners invalidate it only when they see a newer game.
+        '''
         # get account id
-        summmoner_data = summoners[self.summoner_name]
-        account_id = summmoner_data['accountId']
+        account_id = await self.account_id()
 
         # get last games 
-        match_list = MatchListApi().get(account_id)['matches']
-        game_ids = [match['gameId'] for match in match_list]
+        match_list = await self.match_lists.get(account_id)
+        if fresh and time.time() - match_list.get('fetched', 0) > config.MATCH_LIST_FRESH:
+            self.logger.debug('Match list of %s is not fresh. fetching again', self.summoner_name)
+            await self.match_lists.invalidate(account_id)
+            match_list = await self.match_lists.get(account_id)
+        return self.filter_game_ids(match_list, queues)
 
-        for game_id in game_ids:
+    @staticmethod
+    def filter_game_ids(match_list: dict, queues=None) -> List[int]:
+        return [match['gameId'] for match in match_list['matches'] if queues is None or match['queue'] in queues]
+
+    async def _fetch_match(self, game_id) -> dict:
+        # only the projected record is stored, not the full payload
+        record = project_match(await self.match_api.get_async(game_id))
+        await self._invalidate_match_lists(self.match_lists, record)
+        return record
+
+    async def get_match(self, game_id) -> dict:
+        match = await self.matches.get(game_id)
+        if not is_current(match):
             try:
-                match = matches[game_id]
-                map_key(match, 'championId', lambda i: champions.get(i, i))
-                return match                
-            except RitoPlsError:
-                continue
-        raise RitoPlsError(f'No games for {self.summoner_name} found')
+                # cached before projection. store the slim record instead
+                match = to_record(match)
+            except ValueError:
+                # written with another record layout, treat it as a miss
+                match = await self._fetch_match(game_id)
+            await self.matches.set_many({game_id: match})
+        return match
+
+    async def _get_champions(self, ids) -> dict:
+        # table is in process memory, redis is only asked when its version may have changed
+        return await asyncio.get_running_loop().run_in_executor(None, self.champions.get_many, ids)
+
+    async def _invalidate_match_lists(self, match_lists: RedisCache, record: dict) -> None:
+        '''
+        Drop cached match lists of participants that do not know about this game yet
+        '''
+        stale = self.stale_match_lists(await match_lists.peek_many(self.participant_accounts(record)), record)
+        if stale:
+            self.logger.debug('Game %s is newer than match lists of %s', record['gameId'], stale)
+            await match_lists.invalidate(*stale)
+
+    @staticmethod
+    def participant_accounts(record: dict) -> List[str]:
+        return [row[mr.ACCOUNT_ID] for row in record['participants'] if row[mr.ACCOUNT_ID]]
+
+    @staticmethod
+    def stale_match_lists(match_lists: dict, record: dict) -> List[str]:
+        '''
+        Accounts whose cached match list is older than record and misses it
+        '''
+        stale = []
+        for account_id, match_list in match_lists.items():
+            known = match_list['matches']
+            latest = (known[0].get('timestamp') or 0) if known else 0
+            if latest < record['gameCreation'] and all(m['gameId'] != record['gameId'] for m in known):
+                stale.append(account_id)
+        return stale
+
+
+async def gather_last_results(names: list, region=None, concurrency=None) -> list:
+    '''
+    Last game results of all names, looked up concurrently. At most
+    concurrency (config.FETCH_CONCURRENCY) lookups run at a time. Failed
+    lookups are returned as exceptions.
+    '''
+    semaphore = asyncio.Semaphore(concurrency or config.FETCH_CONCURRENCY)
+
+    async def last_result(name):
+        async with semaphore:
+            return await AsyncGameAnalyzer(name, region).get_last_result()
+
+    return await asyncio.gather(*map(last_result, names), return_exceptions=True)
+
+
+class GameAnalyzer(LogMixin):
+    '''
+    Blocking wrapper of AsyncGameAnalyzer for threaded callers. Lookups
+    run on the process event loop while the calling thread waits.
+    '''
+
+    def __init__(self, summoner_name, region=None):
+        self.analyzer = AsyncGameAnalyzer(summoner_name, region)
+        self.summoner_name = summoner_name
+        self.region = self.analyzer.region
+
+    def analyze_last_game(self, raw=False):
+        return run_sync(self.analyzer.analyze_last_game(raw))
+
+    def get_last_result(self) -> dict:
+        return run_sync(self.analyzer.get_last_result())
+
+    def analyze_history(self, count: int) -> List[dict]:
+        return run_sync(self.analyzer.analyze_history(count))
+
+    def get_game_ids(self, queues=None, fresh=False) -> List[int]:
+        return run_sync(self.analyzer.get_game_ids(queues, fresh))
+
+    def get_match(self, game_id) -> dict:
+        return run_sync(self.analyzer.get_match(game_id))
+
+def _row_field(index):
+    return property(lambda self: self.row[index])
 
 class Player(LogMixin):
+    '''
+    Read only view over a participant row of a match record
+    '''
+    __slots__ = ('row', 'champion', 'champion_tags')
     dog_champs = {'Evelynn', 'Talon', 'Master Yi', 'Twitch'}
 
-    def __init__(self, source: dict):
-        self.pid = source['participantId']
-        self.kills = source['stats']['kills']
-        self.assists = source['stats']['assists']
-        self.deaths = source['stats']['deaths']
-        self.win = source['stats']['win']
-        self.largest_multikill = source['stats']['largestMultiKill']
-        self.team = source['teamId']
-        self.gold = source['stats']['goldEarned']
-        self.lane = source['timeline']['lane']
-        self.role = source['timeline']['role']
-        self.summoner_name = source['summoner_name']
-        
+    pid = _row_field(mr.PID)
+    summoner_name = _row_field(mr.SUMMONER_NAME)
+    account_id = _row_field(mr.ACCOUNT_ID)
+    team = _row_field(mr.TEAM)
+    lane = _row_field(mr.LANE)
+    role = _row_field(mr.ROLE)
+    kills = _row_field(mr.KILLS)
+    deaths = _row_field(mr.DEATHS)
+    assists = _row_field(mr.ASSISTS)
+    win = _row_field(mr.WIN)
+    largest_multikill = _row_field(mr.MULTIKILL)
+    gold = _row_field(mr.GOLD)
+
+    def __init__(self, row: list, champion: dict = None):
+        self.row = row
         try:
-            self.champion = source['championId']['name']
-            self.champion_tags = set(source['championId']['tags'])
+            self.champion = champion['name']
+            self.champion_tags = set(champion['tags'])
         except (KeyError, TypeError):
             self.champion = 'Unknown'
             self.champion_tags = set()
@@ -101,38 +317,36 @@ class Player(LogMixin):
 
 
 class PlayerAnalyzer(LogMixin):
+    # bump when scoring changes so cached results are not reused
+    version = 2
     ok_threshold = -10
     good_threshold = 50
+    bad_game_strs = ['{} had a rough last game:']
+    neutral_game_strs = ['{} had ok last game:']
+    good_game_strs = ['{} had a good last game:']
 
-    def __init__(self, summoner_name, game):
+    def __init__(self, summoner_name, game, champions=None, account_id=None):
         self.game = game
         self.gameStarted = datetime.fromtimestamp(game['gameCreation']/1000).replace(tzinfo=pytz.UTC)
         self.gameStarted_str = self.gameStarted.strftime('%Y-%m-%d %H:%M:%S UTC') 
-        self.move_summoner_names(self.game)
-        self.players = self.parse_players(self.game)
+        self.players = self.parse_players(self.game, champions or {})
         self.summoner_name = summoner_name
-        self.player = self.get_player(summoner_name)
+        self.player = self.get_player(summoner_name, account_id)
         self.home_team, self.enemy_team = self.divide_to_teams()
-        self.bad_game_strs = [f'{self.summoner_name} had a rough last game:']
-        self.neutral_game_strs = [f'{self.summoner_name} had ok last game:']
-        self.good_game_strs = [f'{self.summoner_name} had a good last game:']
 
-    @staticmethod
-    def move_summoner_names(game: dict) -> None:
-        name_id_map = {}
-        for player in game['participantIdentities']:
-            pid = player['participantId']
-            name = player['player']['summonerName']
-            name_id_map[pid] = name
-
-        for participant in game['participants']:
-            participant['summoner_name'] = name_id_map[participant['participantId']]
-
-    def parse_players(self, game: dict) -> List[Player]:
-        return [Player(participant) for participant in game['participants']]
+    def parse_players(self, game: dict, champions: dict) -> List[Player]:
+        return [Player(row, champions.get(row[mr.CHAMPION])) for row in game['participants']]
 
 
-    def get_player(self, name) -> Player:
+    def get_player(self, name, account_id=None) -> Player:
+        '''
+        Find player by account id, which survives renames. Summoner name is
+        used when account id is not given or not in the record.
+        '''
+        if account_id is not None:
+            for player in self.players:
+                if player.account_id == account_id:
+                    return player
         for player in self.players:
             if player.summoner_name == name:
                 return player
@@ -147,6 +361,19 @@ class PlayerAnalyzer(LogMixin):
         return home_team, enemy_team
 
     def analyze(self, raw=False):
+        result = self.score()
+        if raw:
+            return self.raw_result(result)
+        return self.render(self.summoner_name, result)
+
+    def score(self) -> dict:
+        '''
+        Score the player. Result is plain data so it can be cached and rendered later.
+        '''
+        with metrics.timer('tiltbot_analysis_seconds'):
+            return self._score()
+
+    def _score(self) -> dict:
         score = 0
         positives = []
         negatives = []
@@ -209,28 +436,113 @@ class PlayerAnalyzer(LogMixin):
         score += 1*self.player.assists
         score -= 4*self.player.deaths
 
-        temp = self._calculate_temperature(score)
-        if raw:
-            stats = f"{self.player.kills}/{self.player.deaths}/{self.player.assists}"
-            return (temp, stats, negatives, positives)
-        if score < self.ok_threshold:
-            return self._format_response(random.choice(self.bad_game_strs), temp, negatives)
-        if score < self.good_threshold:
-            return self._format_response(random.choice(self.neutral_game_strs), temp, negatives + positives)
-        return self._format_response(random.choice(self.good_game_strs), temp, positives)
+        return {
+            'score': score,
+            'temp': self._calculate_temperature(score),
+            'stats': f"{self.player.kills}/{self.player.deaths}/{self.player.assists}",
+            'negatives': negatives,
+            'positives': positives,
+            'played': self.gameStarted_str,
+            'win': self.player.win,
+        }
+
+    @staticmethod
+    def raw_result(result: dict) -> tuple:
+        return (result['temp'], result['stats'], result['negatives'], result['positives'])
+
+    @classmethod
+    def render(cls, summoner_name: str, result: dict) -> str:
+        score = result['score']
+        if score < cls.ok_threshold:
+            header, bulletpoints = random.choice(cls.bad_game_strs), result['negatives']
+        elif score < cls.good_threshold:
+            header, bulletpoints = random.choice(cls.neutral_game_strs), result['negatives'] + result['positives']
+        else:
+            header, bulletpoints = random.choice(cls.good_game_strs), result['positives']
+        return cls._format_response(header.format(summoner_name), result['temp'], bulletpoints, result['played'])
 
+    @staticmethod
+    def render_summary(summoner_name: str, result: dict) -> str:
+        '''
+        One line summary for combined responses
+        '''
+        return f"{summoner_name}: {result['temp']}°C ({result['stats']}, played {result['played']})"
 
-    def _format_response(self, header, temp, bulletpoints):
+    @staticmethod
+    def _format_response(header, temp, bulletpoints, played):
         tag = "```"
         bullet_str = ''
         for bp in bulletpoints:
             bullet_str+= f'    - {bp}\n'
-        return f'{tag}markdown\n{header}\nTemperature: {temp}°C\nPlayed:{self.gameStarted_str}\n{bullet_str}{tag}'
+        return f'{tag}markdown\n{header}\nTemperature: {temp}°C\nPlayed:{played}\n{bullet_str}{tag}'
 
     @staticmethod
     def _calculate_temperature(score: int)-> int:
         return int(10 + (max(0, 5 - score/10))**2)
 
+class HistoryAnalyzer:
+    '''
+    Summary of scores from AsyncGameAnalyzer.analyze_history
+    '''
+    trend_threshold = 5
+
+    def __init__(self, summoner_name: str, results: List[dict]):
+        self.summoner_name = summoner_name
+        self.results = results
+        self.temps = [result['temp'] for result in results]
+
+    def streak(self) -> Tuple[bool, int]:
+        '''
+        Current win (True) or loss (False) streak and its length
+        '''
+        if not self.results:
+            return False, 0
+        win = self.results[0]['win']
+        length = 0
+        for result in self.results:
+            if result['win'] != win:
+                break
+            length += 1
+        return win, length
+
+    def trend(self) -> float:
+        '''
+        Least squares slope of temperature per game, oldest to newest
+        '''
+        temps = self.temps[::-1]
+        n = len(temps)
+        if n < 2:
+            return 0.0
+        mean_x = (n - 1) / 2
+        mean_y = sum(temps) / n
+        covariance = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(temps))
+        variance = sum((x - mean_x) ** 2 for x in range(n))
+        return covariance / variance
+
+    def render(self) -> str:
+        tag = "```"
+        if not self.results:
+            return f'{tag}markdown\nNo ranked games found for {self.summoner_name}\n{tag}'
+        slope = self.trend()
+        if slope > self.trend_threshold:
+            trend = 'heating up'
+        elif slope < -self.trend_threshold:
+            trend = 'cooling down'
+        else:
+            trend = 'stable'
+        win, length = self.streak()
+        streak = f"{length} {'win' if win else 'loss'}{'' if length == 1 else ('s' if win else 'es')}"
+        games = ''
+        for result in self.results:
+            outcome = 'W' if result['win'] else 'L'
+            games += f"    - {result['played']} {outcome} {result['stats']} {result['temp']}°C\n"
+        average = sum(self.temps) / len(self.temps)
+        return (f'{tag}markdown\n{self.summoner_name} last {len(self.results)} ranked games:\n'
+                f'Temperature now: {self.temps[0]}°C, average {average:.0f}°C\n'
+                f'Trend: {trend} ({slope:+.1f}°C per game)\n'
+                f'Streak: {streak}\n{games}{tag}')
+
+
 if __name__ == '__main__':
     FORMAT = '%(asctime)-15s %(filename)15s:%(lineno)3d %(levelname)-8s %(message)s'
     logging.basicConfig(format=FORMAT)
@@ -0,0 +1,144 @@
+'''
+Vectorized scoring of many match records for benchmarks and offline
+analysis. numpy is a development requirement, the bot does not import
+this module.
+'''
+from typing import List
+import numpy as np
+import matchrecord as mr
+from analytics import Player
+from utils import LogMixin
+
+# champion flag bits
+KNOWN = 1
+ASSASSIN = 2
+SUPPORT = 4
+DOG_NAME = 8
+
+
+def champion_flags(champion) -> int:
+    try:
+        name, tags = champion['name'], champion['tags']
+    except (KeyError, TypeError):
+        return 0
+    flags = KNOWN
+    if 'Assassin' in tags:
+        flags |= ASSASSIN
+    if 'Support' in tags:
+        flags |= SUPPORT
+    if name in Player.dog_champs:
+        flags |= DOG_NAME
+    return flags
+
+
+class MatchBatch(LogMixin):
+    '''
+    Columnar view of many match records. Every column has shape
+    (matches, max participants). Missing participants are masked out.
+    '''
+
+    def __init__(self, records: List[dict], champions: dict):
+        self.game_ids = [record['gameId'] for record in records]
+        width = max((len(record['participants']) for record in records), default=0)
+        shape = (len(records), width)
+        self.valid = np.zeros(shape, dtype=bool)
+        self.kills = np.zeros(shape, dtype=np.int64)
+        self.deaths = np.zeros(shape, dtype=np.int64)
+        self.assists = np.zeros(shape, dtype=np.int64)
+        self.win = np.zeros(shape, dtype=bool)
+        self.multikill = np.zeros(shape, dtype=np.int64)
+        self.team = np.zeros(shape, dtype=np.int64)
+        self.duo_support = np.zeros(shape, dtype=bool)
+        self.flags = np.zeros(shape, dtype=np.int64)
+        self.names = [[None] * width for _ in records]
+        self.account_ids = [[None] * width for _ in records]
+
+        flag_cache = {}
+        for m, record in enumerate(records):
+            for p, row in enumerate(record['participants']):
+                champion_id = row[mr.CHAMPION]
+                if champion_id not in flag_cache:
+                    flag_cache[champion_id] = champion_flags(champions.get(champion_id))
+                self.valid[m, p] = True
+                self.kills[m, p] = row[mr.KILLS]
+                self.deaths[m, p] = row[mr.DEATHS]
+                self.assists[m, p] = row[mr.ASSISTS]
+                self.win[m, p] = row[mr.WIN]
+                self.multikill[m, p] = row[mr.MULTIKILL]
+                self.team[m, p] = row[mr.TEAM]
+                self.duo_support[m, p] = row[mr.ROLE] == 'DUO_SUPPORT'
+                self.flags[m, p] = flag_cache[champion_id]
+                self.names[m][p] = row[mr.SUMMONER_NAME]
+                self.account_ids[m][p] = row[mr.ACCOUNT_ID]
+
+    def scores(self) -> np.ndarray:
+        '''
+        Score of every participant as if they were the analyzed player.
+        Same rules as PlayerAnalyzer.score.
+        '''
+        kd = self.kills / (self.deaths + 0.00000001)
+        was_fed = (kd > 2) & (self.kills > 5)
+        died_alot = (kd < 0.8) & (self.deaths > 7)
+        inted = (kd < 0.15) & (self.deaths > 7)
+        known = (self.flags & KNOWN) != 0
+        dog = ((self.flags & ASSASSIN) != 0) | ((self.flags & DOG_NAME) != 0)
+        troll_support = known & self.duo_support & ((self.flags & SUPPORT) == 0)
+
+        # pairs[m, i, j]: participant j of match m relative to analyzed participant i
+        both = self.valid[:, :, None] & self.valid[:, None, :]
+        same_team = both & (self.team[:, :, None] == self.team[:, None, :])
+        enemy = both & ~same_team
+        others = ~np.eye(self.valid.shape[1], dtype=bool)[None, :, :]
+
+        enemy_dogs = (enemy & dog[:, None, :]).sum(axis=2)
+        enemy_fed_dogs = (enemy & (dog & was_fed)[:, None, :]).sum(axis=2)
+        troll_supports = (same_team & troll_support[:, None, :]).any(axis=2)
+        inting_teammates = (same_team & others & inted[:, None, :]).sum(axis=2)
+
+        score = np.where(self.win, 30, -30)
+        score += np.where(self.multikill > 2, self.multikill * 9, 0)
+        score += np.where(was_fed, 19, 0)
+        score -= np.where(died_alot, 22, 0)
+        score -= enemy_dogs * 11
+        score -= enemy_fed_dogs * 21
+        score -= np.where(troll_supports, 23, 0)
+        score -= inting_teammates * 24
+        score += 3 * self.kills + self.assists - 4 * self.deaths
+        return np.where(self.valid, score, 0)
+
+    @staticmethod
+    def temperatures(scores: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized PlayerAnalyzer._calculate_temperature
+        '''
+        return np.floor(10 + np.maximum(0, 5 - scores / 10) ** 2).astype(np.int64)
+
+    def index_of(self, summoner_names: List[str], account_ids: List[str] = None) -> np.ndarray:
+        '''
+        Participant index of given summoner in each match, -1 if missing.
+        Like PlayerAnalyzer.get_player account ids are matched first, they
+        survive renames.
+        '''
+        account_ids = account_ids or [None] * len(summoner_names)
+        index = []
+        for m, (name, account_id) in enumerate(zip(summoner_names, account_ids)):
+            if account_id is not None and account_id in self.account_ids[m]:
+                index.append(self.account_ids[m].index(account_id))
+            elif name in self.names[m]:
+                index.append(self.names[m].index(name))
+            else:
+                index.append(-1)
+        return np.array(index, dtype=np.int64)
+
+
+def score_summoners(records: List[dict], champions: dict, summoner_names: List[str], account_ids: List[str] = None):
+    '''
+    Score and temperature of summoner_names[i], or account_ids[i], in records[i]
+    '''
+    batch = MatchBatch(records, champions)
+    index = batch.index_of(summoner_names, account_ids)
+    if (index < 0).any():
+        missing = [name for name, i in zip(summoner_names, index) if i < 0]
+        raise ValueError(f'{missing} not found in summoner names')
+    scores = batch.scores()[np.arange(len(records)), index]
+    return scores, batch.temperatures(scores)
@@ -0,0 +1,46 @@
+'''
+Compare scalar PlayerAnalyzer against vectorized batch scoring.
+
+usage: python -m benchmarks.batchscoring [matches]
+
+numpy is a development requirement, see requirements-dev.txt.
+'''
+import sys
+import time
+from analytics import PlayerAnalyzer
+from batchscoring import MatchBatch
+from matchrecord import project_match
+from benchmarks.exampledata import load_example_match, EXAMPLE_CHAMPIONS
+
+
+def main(matches=2000):
+    champions = {champ_id: {'name': name, 'tags': tags} for champ_id, name, tags in EXAMPLE_CHAMPIONS}
+    # leave one champion unknown to cover that path too
+    champions.pop(EXAMPLE_CHAMPIONS[-1][0])
+    records = [project_match(load_example_match(game_id, seed=game_id)) for game_id in range(matches)]
+    players = sum(len(record['participants']) for record in records)
+
+    start = time.perf_counter()
+    expected = []
+    for record in records:
+        for row in record['participants']:
+            result = PlayerAnalyzer(row[1], record, champions).score()
+            expected.append((result['score'], result['temp']))
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = MatchBatch(records, champions)
+    load = time.perf_counter() - start
+    scores = batch.scores()
+    temps = batch.temperatures(scores)
+    vectorized = time.perf_counter() - start
+
+    got = list(zip(scores[batch.valid].tolist(), temps[batch.valid].tolist()))
+    assert got == expected, 'batch scores differ from PlayerAnalyzer'
+    print(f'{matches} matches, {players} players. results identical')
+    print(f'scalar      {scalar:8.3f}s {players / scalar:12.0f} players/s')
+    print(f'batch       {vectorized:8.3f}s {players / vectorized:12.0f} players/s (load {load:.3f}s)')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,362 @@
+'''
+End to end benchmark of the /temp hot path.
+
+Starts a throwaway redis-server, a local stub serving riot responses built
+from exampledata/ and capturing telegram sendMessage calls, then replays
+webhook updates through tgbot.app. Latency is measured from webhook post
+to the captured sendMessage. The outgoing telegram rate limit is lifted
+so it does not cap the measured throughput.
+
+usage:
+    python -m benchmarks.e2e [--requests N] [--summoners N] [--workers N]
+    python -m benchmarks.e2e --compare OLD.json NEW.json
+
+Results are written to benchmarks/results/<commit>.json.
+'''
+import os
+import re
+import sys
+import json
+import logging
+import time
+import zlib
+import shutil
+import argparse
+import itertools
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+from benchmarks.exampledata import load_example_match, example_champion_file
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+GAMES_PER_SUMMONER = 3
+
+
+class StubState:
+    '''
+    Shared state of the stub server: captured telegram messages and
+    optional rate limit enforcement.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.riot_calls = 0
+        self.throttled = 0
+        self.rate_limit = None
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def reset(self, rate_limit=None):
+        with self.lock:
+            self.sent = {}
+            self.riot_calls = 0
+            self.throttled = 0
+            self.rate_limit = rate_limit
+            self.window_start = time.monotonic()
+            self.window_count = 0
+
+    def take_riot_call(self):
+        '''
+        Count riot call. Returns (allowed, used count in window)
+        '''
+        with self.lock:
+            self.riot_calls += 1
+            if self.rate_limit is None:
+                return True, self.riot_calls
+            amount, window = self.rate_limit
+            now = time.monotonic()
+            if now - self.window_start >= window:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            if self.window_count > amount:
+                self.throttled += 1
+                return False, self.window_count
+            return True, self.window_count
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    routes = [
+        (re.compile(r'/lol/summoner/v4/summoners/by-name/(?P<arg>[^/?]+)'), 'summoner'),
+        (re.compile(r'/lol/match/v4/matchlists/by-account/(?P<arg>[^/?]+)'), 'match_list'),
+        (re.compile(r'/lol/match/v4/matches/(?P<arg>\d+)'), 'match'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        received = time.perf_counter()
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length).decode('utf-8'))
+        with self.state.lock:
+            self.state.sent[body['chat_id']] = received
+        self._reply(200, {'ok': True})
+
+    def do_GET(self):
+        path = unquote(self.path.split('?', 1)[0])
+        for pattern, kind in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                break
+        else:
+            return self._reply(404, {'status': {'status_code': 404}})
+
+        allowed, used = self.state.take_riot_call()
+        headers = {}
+        if self.state.rate_limit is not None:
+            amount, window = self.state.rate_limit
+            headers['X-App-Rate-Limit'] = f'{amount}:{window}'
+            headers['X-App-Rate-Limit-Count'] = f'{used}:{window}'
+        if not allowed:
+            headers.update({'Retry-After': '1', 'X-Rate-Limit-Type': 'application'})
+            return self._reply(429, {'status': {'status_code': 429}}, headers)
+        self._reply(200, getattr(self, kind)(match.group('arg')), headers)
+
+    @staticmethod
+    def summoner(name):
+        return {'id': f'sid-{name}', 'accountId': f'acc-{name}', 'name': name}
+
+    @staticmethod
+    def _game_ids(name):
+        base = (zlib.crc32(name.encode('utf-8')) % 10 ** 6) * 10
+        return [base + i for i in range(GAMES_PER_SUMMONER, 0, -1)]
+
+    def match_list(self, account_id):
+        name = account_id[len('acc-'):]
+        return {'matches': [
+            {'gameId': game_id, 'queue': 420, 'timestamp': 1530207766914 + game_id}
+            for game_id in self._game_ids(name)
+        ]}
+
+    def match(self, game_id):
+        game_id = int(game_id)
+        match = load_example_match(game_id, seed=game_id)
+        name = NAMES_BY_GAME.get(game_id)
+        if name is not None:
+            player = match['participantIdentities'][0]['player']
+            player['summonerName'] = name
+            player['currentAccountId'] = f'acc-{name}'
+        return match
+
+
+NAMES_BY_GAME = {}
+
+
+class Environment:
+    '''
+    Throwaway redis, key files and stub server. Sets environment so that
+    tgbot talks only to them.
+    '''
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.tmpdir = tempfile.mkdtemp(prefix='tiltbot-bench-')
+        self.socket = os.path.join(self.tmpdir, 'redis.sock')
+        self.redis_process = None
+        self.server = None
+        self.state = StubState()
+
+    def __enter__(self):
+        redis_server = shutil.which('redis-server')
+        if redis_server is None:
+            raise SystemExit('redis-server binary is needed for the benchmark')
+        self.redis_process = subprocess.Popen(
+            [redis_server, '--port', '0', '--unixsocket', self.socket,
+             '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            if os.path.exists(self.socket):
+                break
+            time.sleep(0.05)
+
+        StubHandler.state = self.state
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+        keys = {'ritoapi.key': 'bench', 'tgapi.key': 'bench', 'hook.key': 'hook'}
+        for name, value in keys.items():
+            with open(os.path.join(self.tmpdir, name), 'w') as f:
+                f.write(value)
+        os.environ.update({
+            'TILTBOT_REDIS_SOCKET': self.socket,
+            'TILTBOT_RIOT_API_URL': url,
+            'TILTBOT_TELEGRAM_API_URL': url,
+            'TILTBOT_RIOT_KEY_FILE': os.path.join(self.tmpdir, 'ritoapi.key'),
+            'TILTBOT_TELEGRAM_KEY_FILE': os.path.join(self.tmpdir, 'tgapi.key'),
+            'TILTBOT_HOOK_KEY_FILE': os.path.join(self.tmpdir, 'hook.key'),
+            'TILTBOT_INPROCESS_WORKERS': '1',
+            'TILTBOT_WORKERS': str(self.workers),
+            # outgoing telegram limit would cap replies at ~27/s and hide the hot path
+            'TILTBOT_TELEGRAM_RATE_LIMIT': '1000000:1',
+        })
+        return self
+
+    def __exit__(self, *exc):
+        if self.server is not None:
+            self.server.shutdown()
+        if self.redis_process is not None:
+            self.redis_process.terminate()
+            self.redis_process.wait()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+CHAT_IDS = itertools.count(1)
+
+
+def replay(client, state, names, requests, timeout=120):
+    '''
+    Post requests webhook updates as fast as possible and wait for replies
+    '''
+    sent_at = {}
+    start = time.perf_counter()
+    for i in range(requests):
+        # new chat for every request so per chat send limits of earlier scenarios do not apply
+        chat_id = next(CHAT_IDS)
+        update = {
+            'update_id': int(time.time() * 1000) * 1000 + i,
+            'message': {
+                'message_id': i, 'from': {'id': 1}, 'chat': {'id': chat_id},
+                'text': f'/temp {names[i % len(names)]}',
+            },
+        }
+        sent_at[chat_id] = time.perf_counter()
+        client.post('/tgbot/hook/', json=update)
+    deadline = time.monotonic() + timeout
+    while len(state.sent) < requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with state.lock:
+        received = dict(state.sent)
+    latencies = [received[chat_id] - sent_at[chat_id] for chat_id in received]
+    elapsed = max(received.values(), default=start) - start
+    return {
+        'requests': requests,
+        'completed': len(received),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'throughput_rps': round(len(received) / elapsed, 2) if elapsed else None,
+        'riot_calls': state.riot_calls,
+        'riot_429s': state.throttled,
+    }
+
+
+def run(requests, summoners, workers):
+    names = [f'Bench Summoner {i}' for i in range(summoners)]
+    for name in names:
+        for game_id in StubHandler._game_ids(name):
+            NAMES_BY_GAME[game_id] = name
+
+    with Environment(workers) as env:
+        # imported here so configuration from environment is picked up
+        from localcache import invalidate_all
+        from rediscache import get_redis
+        from riotdata import ChampionData
+        import tgbot
+        logging.getLogger('TiltBot').setLevel(logging.WARNING)
+
+        champion_file = os.path.join(env.tmpdir, 'champion.json')
+        with open(champion_file, 'w') as f:
+            json.dump(example_champion_file(), f)
+
+        def reset(rate_limit=None):
+            get_redis().flushdb()
+            invalidate_all()
+            ChampionData.from_file(champion_file)
+            env.state.reset(rate_limit)
+
+        app = tgbot.create_app(start_services=True)
+        client = app.test_client()
+        scenarios = {}
+        reset()
+        scenarios['cold'] = replay(client, env.state, names, requests)
+        env.state.reset()
+        scenarios['warm'] = replay(client, env.state, names, requests)
+        reset(rate_limit=(max(2, summoners // 2), 1))
+        scenarios['rate_limited'] = replay(client, env.state, names, requests)
+        app.extensions['tiltbot_services'].stop()
+    return scenarios
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_scenarios(scenarios):
+    print(f'{"scenario":<14}{"done":>8}{"p50 ms":>10}{"p99 ms":>10}{"req/s":>10}{"riot":>8}{"429s":>7}')
+    for name, result in scenarios.items():
+        print(f'{name:<14}{result["completed"]:>8}{result["p50_ms"] or 0:>10}{result["p99_ms"] or 0:>10}'
+              f'{result["throughput_rps"] or 0:>10}{result["riot_calls"]:>8}{result["riot_429s"]:>7}')
+
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print(f'{old["commit"]} -> {new["commit"]}')
+    print(f'{"scenario":<14}{"metric":<16}{"old":>10}{"new":>10}{"change":>9}')
+    for scenario, result in new['scenarios'].items():
+        for metric in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            before = old['scenarios'].get(scenario, {}).get(metric)
+            after = result.get(metric)
+            change = f'{(after - before) / before * 100:+.1f}%' if before and after else '-'
+            print(f'{scenario:<14}{metric:<16}{before or "-":>10}{after or "-":>10}{change:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--summoners', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        return compare(*args.compare)
+
+    scenarios = run(args.requests, args.summoners, args.workers)
+    print_scenarios(scenarios)
+    commit = git_commit()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{commit}.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'date': datetime.utcnow().isoformat(),
+            'args': vars(args),
+            'scenarios': scenarios,
+        }, f, indent=4)
+    print(f'results written to {path}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import os
+import copy
+import json
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'exampledata')
+MATCH_DIR = os.path.join(EXAMPLE_DIR, 'matchresponse')
+
+# champions used to fill example participants. (id, name, tags)
+EXAMPLE_CHAMPIONS = [
+    (127, 'Lissandra', ['Mage']),
+    (245, 'Ekko', ['Assassin', 'Fighter']),
+    (117, 'Lulu', ['Support', 'Mage']),
+    (110, 'Varus', ['Marksman', 'Mage']),
+    (28, 'Evelynn', ['Assassin', 'Mage']),
+    (11, 'Master Yi', ['Assassin', 'Fighter']),
+    (412, 'Thresh', ['Support', 'Fighter']),
+    (22, 'Ashe', ['Marksman', 'Support']),
+    (91, 'Talon', ['Assassin']),
+    (99, 'Lux', ['Mage', 'Support']),
+]
+
+
+def _load(name):
+    with open(os.path.join(MATCH_DIR, name)) as f:
+        return json.load(f)
+
+def load_example_match(game_id=None, seed=0) -> dict:
+    '''
+    Build a full match-v4 payload from the split example responses. The
+    single example participant is cloned to ten players with varied stats.
+    '''
+    match = _load('matchapi_response.json')
+    participant = _load('individual_stats.json')['participants'][0]
+    identities = _load('summoner_info.json')['participantIdentities']
+    match.update(_load('teamstats.json'))
+    if game_id is not None:
+        match['gameId'] = game_id
+    roles = ['SOLO', 'NONE', 'DUO_CARRY', 'DUO_SUPPORT', 'SOLO']
+    participants = []
+    for i in range(10):
+        pid = i + 1
+        item = copy.deepcopy(participant)
+        item['participantId'] = pid
+        item['stats']['participantId'] = pid
+        item['timeline']['participantId'] = pid
+        item['teamId'] = 100 if pid <= 5 else 200
+        item['championId'] = EXAMPLE_CHAMPIONS[(i + seed) % len(EXAMPLE_CHAMPIONS)][0]
+        item['timeline']['role'] = roles[i % 5]
+        item['stats']['win'] = (pid > 5) == bool(seed % 2)
+        item['stats']['kills'] = (i * 7 + seed * 3) % 15
+        item['stats']['deaths'] = (i * 5 + seed) % 13
+        item['stats']['assists'] = (i * 3 + seed * 5) % 20
+        item['stats']['largestMultiKill'] = (i + seed) % 5
+        participants.append(item)
+    match['participants'] = participants
+    match['participantIdentities'] = copy.deepcopy(identities[:10])
+    for i, identity in enumerate(match['participantIdentities']):
+        identity['participantId'] = i + 1
+    return match
+
+def example_champion_file() -> dict:
+    '''
+    Data dragon style champion.json for the example champions
+    '''
+    return {
+        'type': 'champion',
+        'version': '8.13.1',
+        'data': {
+            name.replace(' ', ''): {'key': str(champ_id), 'name': name, 'tags': tags}
+            for champ_id, name, tags in EXAMPLE_CHAMPIONS
+        },
+    }
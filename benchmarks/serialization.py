@@ -0,0 +1,37 @@
+'''
+Compare cache value formats on the example match and its projected record.
+
+usage: python -m benchmarks.serialization [rounds]
+'''
+import sys
+import time
+import serializers
+from benchmarks.exampledata import load_example_match
+from matchrecord import project_match
+
+
+def bench(serializer, item, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        data = serializers.dumps(item, serializer)
+    encode = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        serializers.loads(data)
+    decode = (time.perf_counter() - start) / rounds
+    assert serializers.loads(data) == item
+    return len(data), encode, decode
+
+
+def main(rounds=2000):
+    match = load_example_match()
+    items = [('full', match), ('record', project_match(match))]
+    print(f'{"item":<8}{"format":<15}{"bytes":>8}{"encode us":>12}{"decode us":>12}')
+    for item_name, item in items:
+        for name, serializer in serializers.SERIALIZERS.items():
+            size, encode, decode = bench(serializer, item, rounds)
+            print(f'{item_name:<8}{name:<15}{size:>8}{encode * 1e6:>12.1f}{decode * 1e6:>12.1f}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,348 @@
+'''
+Per namespace ttl and memory budget of RedisCache. The namespace is the
+first part of a cache prefix, so summoners_euw_ and summoners_na_ share
+one policy.
+
+Every stored value is accounted in redis: its size in a hash, its expiry
+time in a sorted set and the namespace total in cache_usage. When a
+namespace goes over budget the keys expiring next are deleted until it
+is back under low_watermark of the budget. Index entries of keys redis
+already expired are dropped on the way, so short lived negative markers
+stop counting against the budget when they expire.
+'''
+import sys
+import time
+import threading
+from collections import Counter
+from typing import List, Tuple
+import config
+from metrics import metrics
+from utils import LogMixin
+
+
+USAGE_KEY = 'cache_usage'
+STATS_KEY = 'cache_stats'
+
+# index score of keys without ttl, they are evicted after all others
+FOREVER_MS = 100 * 365 * 24 * 3600 * 1000
+
+# Store value and account its size. Sizes count key and value bytes, not
+# redis overhead.
+# KEYS: value key, namespace index, namespace sizes, usage hash
+# ARGV: value, ttl_ms (0 keeps it forever), now_ms, namespace
+SET_SCRIPT = '''
+local size = string.len(KEYS[1]) + string.len(ARGV[1])
+local old = tonumber(redis.call('HGET', KEYS[3], KEYS[1])) or 0
+local ttl = tonumber(ARGV[2])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+    ttl = %(forever)d
+end
+redis.call('HSET', KEYS[3], KEYS[1], size)
+redis.call('ZADD', KEYS[2], tonumber(ARGV[3]) + ttl, KEYS[1])
+return redis.call('HINCRBY', KEYS[4], ARGV[4], size - old)
+''' % {'forever': FOREVER_MS}
+
+# Delete keys and their accounting.
+# KEYS: namespace index, namespace sizes, usage hash. ARGV: namespace, keys to delete
+FORGET_SCRIPT = '''
+local freed = 0
+for i = 2, #ARGV do
+    redis.call('DEL', ARGV[i])
+    freed = freed + (tonumber(redis.call('HGET', KEYS[2], ARGV[i])) or 0)
+    redis.call('HDEL', KEYS[2], ARGV[i])
+    redis.call('ZREM', KEYS[1], ARGV[i])
+end
+return redis.call('HINCRBY', KEYS[3], ARGV[1], 0 - freed)
+'''
+
+# Drop keys expiring next while their expiry time has passed or the
+# namespace is over target bytes (-1 for no target). At most limit keys.
+# Keys past their index score that still live, eg. indexed by write time
+# before, are scored again with their remaining ttl instead.
+# Returns {deleted live keys, dropped expired ones, bytes left, rescored keys}.
+# KEYS: namespace index, namespace sizes, usage hash
+# ARGV: namespace, now_ms, target, limit
+EVICT_SCRIPT = '''
+local usage = tonumber(redis.call('HGET', KEYS[3], ARGV[1])) or 0
+local now = tonumber(ARGV[2])
+local target = tonumber(ARGV[3])
+local evicted, expired, rescored = 0, 0, 0
+while evicted + expired + rescored < tonumber(ARGV[4]) do
+    local head = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if #head == 0 then break end
+    local key = head[1]
+    local over = target >= 0 and usage > target
+    if tonumber(head[2]) >= now and not over then break end
+    local remaining = redis.call('PTTL', key)
+    if remaining ~= -2 and not over then
+        if remaining < 0 then remaining = %(forever)d end
+        redis.call('ZADD', KEYS[1], now + remaining, key)
+        rescored = rescored + 1
+    else
+        if redis.call('DEL', key) == 1 then
+            evicted = evicted + 1
+        else
+            expired = expired + 1
+        end
+        usage = usage - (tonumber(redis.call('HGET', KEYS[2], key)) or 0)
+        redis.call('HDEL', KEYS[2], key)
+        redis.call('ZREM', KEYS[1], key)
+    end
+end
+redis.call('HSET', KEYS[3], ARGV[1], usage)
+return {evicted, expired, usage, rescored}
+''' % {'forever': FOREVER_MS}
+
+# Account keys stored before accounting and give ones without ttl the
+# namespace ttl.
+# KEYS: namespace index, namespace sizes, usage hash
+# ARGV: namespace, ttl_ms (0 keeps keys forever), now_ms, keys to adopt
+ADOPT_SCRIPT = '''
+local ttl = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local added = 0
+for i = 4, #ARGV do
+    local key = ARGV[i]
+    if redis.call('HEXISTS', KEYS[2], key) == 0 and redis.call('TYPE', key).ok == 'string' then
+        local size = string.len(key) + redis.call('STRLEN', key)
+        local remaining = redis.call('PTTL', key)
+        if remaining < 0 and ttl > 0 then
+            redis.call('PEXPIRE', key, ttl)
+            remaining = ttl
+        elseif remaining < 0 then
+            remaining = %(forever)d
+        end
+        redis.call('HSET', KEYS[2], key, size)
+        redis.call('ZADD', KEYS[1], now + remaining, key)
+        added = added + size
+    end
+end
+return redis.call('HINCRBY', KEYS[3], ARGV[1], added)
+''' % {'forever': FOREVER_MS}
+
+
+class CachePolicy(LogMixin):
+    '''
+    Ttl and memory budget of one namespace. Builds the keys and args of
+    the accounting scripts for RedisCache and the maintenance functions.
+    '''
+    # evict down to this share of the budget so eviction does not run on every write
+    low_watermark = 0.9
+    # keys dropped per script call, keeps redis responsive
+    evict_batch = 200
+
+    def __init__(self, namespace: str, ttl=None, max_bytes=0):
+        self.namespace = namespace
+        self.ttl = ttl or None
+        self.max_bytes = max_bytes
+        self.index_key = f'cache_index_{namespace}'
+        self.sizes_key = f'cache_sizes_{namespace}'
+
+    def set_call(self, redis_key: str, raw: bytes, ttl=None) -> Tuple[list, list]:
+        ttl_ms = int(ttl * 1000) if ttl else 0
+        return ([redis_key, self.index_key, self.sizes_key, USAGE_KEY],
+                [raw, ttl_ms, int(time.time() * 1000), self.namespace])
+
+    def forget_call(self, redis_keys: list) -> Tuple[list, list]:
+        return [self.index_key, self.sizes_key, USAGE_KEY], [self.namespace] + list(redis_keys)
+
+    def over_budget(self, usage: int) -> bool:
+        return bool(self.max_bytes) and usage > self.max_bytes
+
+    def evict_call(self, trim_only=False) -> Tuple[list, list]:
+        '''
+        Evict to the low watermark, or with trim_only just drop expired entries
+        '''
+        target = -1 if trim_only or not self.max_bytes else int(self.max_bytes * self.low_watermark)
+        return ([self.index_key, self.sizes_key, USAGE_KEY],
+                [self.namespace, int(time.time() * 1000), target, self.evict_batch])
+
+    def evicted(self, result) -> int:
+        '''
+        Record EVICT_SCRIPT result. Returns bytes left in namespace.
+        '''
+        evicted, expired, usage, _ = (int(value) for value in result)
+        if evicted:
+            self.logger.info('Evicted %s keys from cache %s, %s bytes left', evicted, self.namespace, usage)
+            metrics.inc('tiltbot_cache_evictions_total', value=evicted, namespace=self.namespace)
+        return usage
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def namespace_of(prefix: str) -> str:
+    return prefix.split('_', 1)[0]
+
+def get_policy(prefix: str) -> CachePolicy:
+    '''
+    Policy of the namespace of a cache prefix. Namespaces missing from
+    config.CACHE_POLICIES are accounted but get no default ttl or budget.
+    '''
+    namespace = namespace_of(prefix)
+    with _policies_lock:
+        if namespace not in _policies:
+            ttl, max_mb = config.CACHE_POLICIES.get(namespace, (0, 0))
+            _policies[namespace] = CachePolicy(namespace, ttl, max_mb * 1024 * 1024)
+        return _policies[namespace]
+
+
+class CacheStats(LogMixin):
+    '''
+    Cache request counts per namespace and result. Counted in process and
+    added to a redis hash every flush_interval seconds, so the report
+    covers all processes without a redis write per request. Counts are
+    recorded on the event loop, so due flushes run in a background thread.
+    '''
+
+    def __init__(self, redis, flush_interval=None):
+        self.redis = redis
+        self.flush_interval = config.CACHE_STATS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._counts = Counter()
+        self._flushed = time.monotonic()
+        self._flushing = False
+        self._lock = threading.Lock()
+        # held while counts are written so flush returns only after earlier ones are in redis
+        self._flush_lock = threading.Lock()
+
+    def record(self, namespace: str, result: str) -> None:
+        with self._lock:
+            self._counts[f'{namespace}:{result}'] += 1
+            if self._flushing or time.monotonic() - self._flushed < self.flush_interval:
+                return
+            self._flushing = True
+        threading.Thread(target=self._flush_in_background, name='cache-stats-flush', daemon=True).start()
+
+    def _flush_in_background(self) -> None:
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+                self._flushed = time.monotonic()
+            if not counts:
+                return
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for field, count in counts.items():
+                    pipe.hincrby(STATS_KEY, field, count)
+                pipe.execute()
+            except Exception:
+                self.logger.exception('Flushing cache stats failed')
+
+
+def trim_expired(redis, namespaces=None) -> None:
+    '''
+    Drop accounting of keys redis has expired
+    '''
+    for namespace in namespaces or config.CACHE_POLICIES:
+        policy = get_policy(namespace)
+        keys, args = policy.evict_call(trim_only=True)
+        while True:
+            evicted, expired, _, rescored = redis.eval(EVICT_SCRIPT, len(keys), *(keys + args))
+            if int(expired) + int(evicted) + int(rescored) < policy.evict_batch:
+                break
+
+
+def adopt_existing(redis, namespaces=None, batch=500) -> None:
+    '''
+    Account and expire cache keys written before cache policies existed
+    '''
+    for namespace in namespaces or config.CACHE_POLICIES:
+        policy = get_policy(namespace)
+        keys = [policy.index_key, policy.sizes_key, USAGE_KEY]
+        ttl_ms = int(policy.ttl * 1000) if policy.ttl else 0
+        cursor = '0'
+        while True:
+            cursor, found = redis.scan(cursor, match=f'{namespace}_*', count=batch)
+            if found:
+                args = [namespace, ttl_ms, int(time.time() * 1000)] + [key.decode('utf-8') for key in found]
+                redis.eval(ADOPT_SCRIPT, len(keys), *(keys + args))
+            if int(cursor) == 0:
+                break
+        policy.logger.info('Adopted cache keys of namespace %s', namespace)
+
+
+def namespace_usage(redis) -> dict:
+    '''
+    namespace -> (keys, bytes) of accounted namespaces
+    '''
+    usage = {namespace.decode('utf-8'): int(size) for namespace, size in redis.hgetall(USAGE_KEY).items()}
+    pipe = redis.pipeline(transaction=False)
+    for namespace in usage:
+        pipe.zcard(get_policy(namespace).index_key)
+    return {namespace: (keys, usage[namespace]) for namespace, keys in zip(usage, pipe.execute())}
+
+
+def cache_report(redis) -> List[dict]:
+    '''
+    Keys, bytes, budget and hit rate of every namespace
+    '''
+    trim_expired(redis)
+    counts = {field.decode('utf-8'): int(count) for field, count in redis.hgetall(STATS_KEY).items()}
+    report = []
+    for namespace, (keys, size) in sorted(namespace_usage(redis).items()):
+        policy = get_policy(namespace)
+        hits = counts.get(f'{namespace}:hit', 0) + counts.get(f'{namespace}:local', 0)
+        misses = counts.get(f'{namespace}:miss', 0)
+        report.append({
+            'namespace': namespace,
+            'keys': keys,
+            'bytes': size,
+            'max_bytes': policy.max_bytes,
+            'ttl': policy.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        })
+    return report
+
+
+def _size(size: int) -> str:
+    for unit in ('', 'K', 'M'):
+        if size < 1024:
+            return f'{size:.0f}{unit}'
+        size /= 1024
+    return f'{size:.1f}G'
+
+
+def _duration(seconds) -> str:
+    for unit, length in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= length:
+            return f'{seconds / length:.0f}{unit}'
+    return f'{seconds:.0f}s'
+
+
+def render_report(report: List[dict], info: dict) -> str:
+    lines = [f'{"namespace":<12}{"keys":>9}{"size":>8}{"budget":>8}{"ttl":>6}{"hit %":>7}']
+    for row in report:
+        budget = _size(row['max_bytes']) if row['max_bytes'] else '-'
+        ttl = _duration(row['ttl']) if row['ttl'] else '-'
+        hit_rate = f'{row["hit_rate"] * 100:.0f}' if row['hit_rate'] is not None else '-'
+        lines.append(
+            f'{row["namespace"]:<12}{row["keys"]:>9}{_size(row["bytes"]):>8}{budget:>8}{ttl:>6}{hit_rate:>7}')
+    hits, misses = info.get('keyspace_hits', 0), info.get('keyspace_misses', 0)
+    redis_hit_rate = f'{hits / (hits + misses) * 100:.0f}%' if hits + misses else '-'
+    lines.append(
+        f'redis: {info.get("used_memory_human", "?")} used, {redis_hit_rate} keyspace hits, '
+        f'{info.get("evicted_keys", 0)} evicted by redis')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # python cachepolicy.py [adopt] [db]
+    from rediscache import get_redis
+    args = sys.argv[1:]
+    adopt = bool(args) and args[0] == 'adopt'
+    redis = get_redis(*[int(arg) for arg in args[adopt:]])
+    if adopt:
+        adopt_existing(redis)
+    print(render_report(cache_report(redis), redis.info()))
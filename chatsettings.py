@@ -0,0 +1,55 @@
+import json
+import config
+from rediscache import get_redis
+from utils import LogMixin
+
+
+class ChatSettings(LogMixin):
+    '''
+    Per chat settings stored in a redis hash
+    '''
+    prefix = 'chat_'
+    max_roster_size = 10
+
+    def __init__(self, chat_id: int, db=0):
+        self.chat_id = chat_id
+        self.redis = get_redis(db)
+        self.key = f'{self.prefix}{chat_id}'
+
+    def _get(self, field: str, default=None):
+        value = self.redis.hget(self.key, field)
+        if value is None:
+            return default
+        return json.loads(value.decode('utf-8'))
+
+    def _set(self, field: str, value) -> None:
+        self.redis.hset(self.key, field, json.dumps(value))
+
+    def get_roster(self) -> list:
+        return self._get('roster', [])
+
+    def set_roster(self, names: list) -> list:
+        # keep order, drop duplicates
+        roster = list(dict.fromkeys(name for name in names if name))[:self.max_roster_size]
+        self._set('roster', roster)
+        return roster
+
+    def get_region(self) -> str:
+        return self._get('region', config.DEFAULT_REGION)
+
+    def set_region(self, region: str) -> None:
+        self._set('region', region)
+
+    def get_autopush(self) -> bool:
+        return self._get('autopush', False)
+
+    def set_autopush(self, enabled: bool) -> None:
+        self._set('autopush', enabled)
+
+    def get_watchlist(self) -> list:
+        return self._get('watchlist', [])
+
+    def set_watchlist(self, names: list) -> list:
+        watchlist = list(dict.fromkeys(name for name in names if name))[:config.WATCH_MAX_PER_CHAT]
+        self._set('watchlist', watchlist)
+        return watchlist
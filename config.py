@@ -0,0 +1,129 @@
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return default if value in (None, '') else int(value)
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return default if value in (None, '') else float(value)
+
+def env_str(name: str, default: str) -> str:
+    return os.environ.get(name) or default
+
+
+# external services and key files
+REDIS_SOCKET = env_str('TILTBOT_REDIS_SOCKET', '/tmp/redis.sock')
+# {platform} is replaced with platform id of the region
+RIOT_API_URL = env_str('TILTBOT_RIOT_API_URL', 'https://{platform}.api.riotgames.com')
+TELEGRAM_API_URL = env_str('TILTBOT_TELEGRAM_API_URL', 'https://api.telegram.org')
+RIOT_KEY_FILE = env_str('TILTBOT_RIOT_KEY_FILE', '/keys/ritoapi.key')
+TELEGRAM_KEY_FILE = env_str('TILTBOT_TELEGRAM_KEY_FILE', '/keys/tgapi.key')
+HOOK_KEY_FILE = env_str('TILTBOT_HOOK_KEY_FILE', 'keys/hook.key')
+
+# riot regions as region:platform pairs. region is what users type
+RIOT_REGIONS = dict(
+    pair.split(':', 1) for pair in
+    env_str('TILTBOT_RIOT_REGIONS', 'euw:euw1,eune:eun1,na:na1,kr:kr').split(','))
+DEFAULT_REGION = env_str('TILTBOT_DEFAULT_REGION', 'euw')
+
+# http client
+HTTP_CONNECT_TIMEOUT = env_float('TILTBOT_HTTP_CONNECT_TIMEOUT', 3.05)
+HTTP_READ_TIMEOUT = env_float('TILTBOT_HTTP_READ_TIMEOUT', 10)
+HTTP_POOL_SIZE = env_int('TILTBOT_HTTP_POOL_SIZE', 10)
+
+# riot api rate limiting
+RIOT_APP_RATE_LIMIT = env_str('TILTBOT_RIOT_APP_RATE_LIMIT', '20:1,100:120')
+RATE_LIMIT_SAFETY_FACTOR = env_float('TILTBOT_RATE_LIMIT_SAFETY_FACTOR', 0.9)
+RATE_LIMIT_MAX_BACKOFF = env_int('TILTBOT_RATE_LIMIT_MAX_BACKOFF', 60)
+RATE_LIMIT_MAX_WAIT = env_float('TILTBOT_RATE_LIMIT_MAX_WAIT', 15)
+
+# connections of the event loop running riot lookups, see utils.EventLoopThread
+ASYNC_HTTP_POOL_SIZE = env_int('TILTBOT_ASYNC_HTTP_POOL_SIZE', 100)
+ASYNC_REDIS_POOL_SIZE = env_int('TILTBOT_ASYNC_REDIS_POOL_SIZE', 20)
+
+# in-process cache tier
+LOCAL_CACHE_ENABLED = env_int('TILTBOT_LOCAL_CACHE', 1) == 1
+LOCAL_CACHE_SUMMONER_TTL = env_int('TILTBOT_LOCAL_CACHE_SUMMONER_TTL', 300)
+
+# champion data. data dragon champion.json is reloaded when it changes
+CHAMPION_FILE = env_str('TILTBOT_CHAMPION_FILE', 'data/champion.json')
+CHAMPION_REFRESH_INTERVAL = env_int('TILTBOT_CHAMPION_REFRESH_INTERVAL', 600)
+CHAMPION_CHECK_INTERVAL = env_int('TILTBOT_CHAMPION_CHECK_INTERVAL', 60)
+
+# cache value format. see serializers.SERIALIZERS
+CACHE_FORMAT = env_str('TILTBOT_CACHE_FORMAT', 'zlib-json')
+
+# cache ttls in seconds
+MATCH_LIST_TTL = env_int('TILTBOT_MATCH_LIST_TTL', 120)
+# /temp and /tilt refetch a cached match list older than this, it may miss the newest game
+MATCH_LIST_FRESH = env_int('TILTBOT_MATCH_LIST_FRESH', 30)
+RESULT_TTL = env_int('TILTBOT_RESULT_TTL', 7 * 24 * 3600)
+# summoners refresh daily so renamed accounts are found again
+SUMMONER_TTL = env_int('TILTBOT_SUMMONER_TTL', 24 * 3600)
+MATCH_TTL = env_int('TILTBOT_MATCH_TTL', 14 * 24 * 3600)
+NEGATIVE_TTL_SUMMONER = env_int('TILTBOT_NEGATIVE_TTL_SUMMONER', 600)
+NEGATIVE_TTL_MATCH_LIST = env_int('TILTBOT_NEGATIVE_TTL_MATCH_LIST', 300)
+# match lists show ended games before match-v4 serves them. a 404 for a
+# listed game is cached briefly so /temp and the watcher retry soon
+NEGATIVE_TTL_MATCH = env_int('TILTBOT_NEGATIVE_TTL_MATCH', 30)
+
+# redis cache namespaces: (ttl seconds, memory budget megabytes). 0 means
+# no expiry or no budget. see cachepolicy.py
+CACHE_POLICIES = {
+    'summoners': (SUMMONER_TTL, env_int('TILTBOT_CACHE_SUMMONERS_MAX_MB', 32)),
+    'matchlists': (MATCH_LIST_TTL, env_int('TILTBOT_CACHE_MATCHLISTS_MAX_MB', 32)),
+    'matches': (MATCH_TTL, env_int('TILTBOT_CACHE_MATCHES_MAX_MB', 256)),
+    'results': (RESULT_TTL, env_int('TILTBOT_CACHE_RESULTS_MAX_MB', 32)),
+    'scores': (RESULT_TTL, env_int('TILTBOT_CACHE_SCORES_MAX_MB', 64)),
+}
+# seconds between flushes of cache hit counts to redis
+CACHE_STATS_FLUSH_INTERVAL = env_int('TILTBOT_CACHE_STATS_FLUSH_INTERVAL', 10)
+# chats allowed to use admin commands like /cache, comma separated
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in env_str('TILTBOT_ADMIN_CHAT_IDS', '').split(',') if chat_id.strip()}
+
+# web serving. see gunicorn.conf.py
+WEB_BIND = env_str('TILTBOT_WEB_BIND', '0.0.0.0:5000')
+WEB_WORKERS = env_int('TILTBOT_WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1)
+WEB_THREADS = env_int('TILTBOT_WEB_THREADS', 4)
+WEB_TIMEOUT = env_int('TILTBOT_WEB_TIMEOUT', 30)
+# seconds to let in-flight commands finish on shutdown
+SHUTDOWN_TIMEOUT = env_int('TILTBOT_SHUTDOWN_TIMEOUT', 25)
+
+# update processing. 'webhook' or 'polling' (getUpdates, see tgpoller.py)
+UPDATE_MODE = env_str('TILTBOT_UPDATE_MODE', 'webhook')
+POLL_TIMEOUT = env_int('TILTBOT_POLL_TIMEOUT', 25)
+POLL_LIMIT = env_int('TILTBOT_POLL_LIMIT', 100)
+WORKERS = env_int('TILTBOT_WORKERS', 4)
+INPROCESS_WORKERS = env_int('TILTBOT_INPROCESS_WORKERS', 1) == 1
+# commands with riot lookups in flight per process. workers wait for a free slot
+MAX_PENDING_COMMANDS = env_int('TILTBOT_MAX_PENDING_COMMANDS', 200)
+UPDATE_DEDUP_TTL = env_int('TILTBOT_UPDATE_DEDUP_TTL', 24 * 3600)
+
+# /tilt history
+TILT_HISTORY_DEFAULT = env_int('TILTBOT_TILT_HISTORY_DEFAULT', 10)
+TILT_HISTORY_MAX = env_int('TILTBOT_TILT_HISTORY_MAX', 20)
+# summoner lookups of one multi-name /temp running at a time
+FETCH_CONCURRENCY = env_int('TILTBOT_FETCH_CONCURRENCY', 4)
+
+# outgoing telegram messages
+TELEGRAM_SENDERS = env_int('TILTBOT_TELEGRAM_SENDERS', 4)
+TELEGRAM_RATE_LIMIT = env_str('TILTBOT_TELEGRAM_RATE_LIMIT', '30:1')
+TELEGRAM_CHAT_INTERVAL = env_float('TILTBOT_TELEGRAM_CHAT_INTERVAL', 1)
+TELEGRAM_GROUP_INTERVAL = env_float('TILTBOT_TELEGRAM_GROUP_INTERVAL', 3)
+TELEGRAM_MAX_ATTEMPTS = env_int('TILTBOT_TELEGRAM_MAX_ATTEMPTS', 5)
+TELEGRAM_POLL_INTERVAL = env_float('TILTBOT_TELEGRAM_POLL_INTERVAL', 0.2)
+
+# live game watcher
+WATCHER_ENABLED = env_int('TILTBOT_WATCHER', 0) == 1
+WATCH_BATCH_SIZE = env_int('TILTBOT_WATCH_BATCH_SIZE', 5)
+WATCH_IDLE_INTERVAL = env_int('TILTBOT_WATCH_IDLE_INTERVAL', 120)
+WATCH_MAX_IDLE_INTERVAL = env_int('TILTBOT_WATCH_MAX_IDLE_INTERVAL', 900)
+WATCH_INGAME_INTERVAL = env_int('TILTBOT_WATCH_INGAME_INTERVAL', 60)
+WATCH_MAX_PER_CHAT = env_int('TILTBOT_WATCH_MAX_PER_CHAT', 10)
+
+# instrumentation
+METRICS_ENABLED = env_int('TILTBOT_METRICS', 1) == 1
+PROFILE_SAMPLE_RATE = env_float('TILTBOT_PROFILE_SAMPLE_RATE', 0)
+PROFILE_DIR = env_str('TILTBOT_PROFILE_DIR', '/tmp/tiltbot-profiles')
@@ -0,0 +1,37 @@
+'''
+Production serving: gunicorn -c gunicorn.conf.py
+
+App and champion data are loaded once in the master and shared with
+forked workers. Update workers and the watcher are started in every web
+worker after fork, unless TILTBOT_INPROCESS_WORKERS=0 and separate
+worker.py processes are used. On SIGTERM workers stop taking requests
+and drain commands in progress before exiting.
+
+Metrics are kept per worker, samples carry a worker label. See metrics.Metrics.
+'''
+# gunicorn reads module level names as settings and 'config' is one of them
+import config as tiltbot_config
+
+wsgi_app = 'tgbot:create_app(start_services=False)'
+preload_app = True
+bind = tiltbot_config.WEB_BIND
+workers = tiltbot_config.WEB_WORKERS
+worker_class = 'gthread'
+threads = tiltbot_config.WEB_THREADS
+timeout = tiltbot_config.WEB_TIMEOUT
+# leave room for the background services to drain after requests finish
+graceful_timeout = tiltbot_config.SHUTDOWN_TIMEOUT + 5
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    if tiltbot_config.INPROCESS_WORKERS:
+        from worker import BackgroundServices
+        worker.tiltbot_services = BackgroundServices()
+        worker.tiltbot_services.start()
+
+
+def worker_exit(server, worker):
+    services = getattr(worker, 'tiltbot_services', None)
+    if services is not None:
+        services.stop(tiltbot_config.SHUTDOWN_TIMEOUT)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+import config
+from utils import LogMixin, on_event_loop_stop
+
+
+class HttpClient(LogMixin):
+    '''
+    Thread safe keep-alive http client. One pooled session is kept per host
+    so connections to the telegram api are reused between requests. Riot
+    apis are called from the event loop with get_async_session.
+    '''
+
+    def __init__(self, connect_timeout=None, read_timeout=None, pool_size=None):
+        self.timeout = (
+            connect_timeout or config.HTTP_CONNECT_TIMEOUT,
+            read_timeout or config.HTTP_READ_TIMEOUT,
+        )
+        self.default_pool_size = pool_size or config.HTTP_POOL_SIZE
+        self.host_pool_sizes = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def set_pool_size(self, host: str, pool_size: int) -> None:
+        '''
+        Set connection pool size for host. Must be called before first
+        request to the host.
+        '''
+        self.host_pool_sizes[host] = pool_size
+
+    def session(self, url: str) -> requests.Session:
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = self._create_session(host)
+                    self._sessions[host] = session
+        return session
+
+    def _create_session(self, host: str) -> requests.Session:
+        pool_size = self.host_pool_sizes.get(host, self.default_pool_size)
+        self.logger.debug('Creating http session for %s with pool size %s', host, pool_size)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url: str, params=None, **kwargs) -> requests.Response:
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+http_client = HttpClient()
+
+
+# asyncio sessions belong to the event loop that opened them
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+def get_async_session(url: str):
+    '''
+    aiohttp session of the running event loop for the host of url. Keeps
+    connections to every riot region alive separately.
+    '''
+    sessions = _async_sessions.setdefault(asyncio.get_running_loop(), {})
+    host = urlsplit(url).netloc
+    session = sessions.get(host)
+    if session is None:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.ASYNC_HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=config.HTTP_CONNECT_TIMEOUT, sock_read=config.HTTP_READ_TIMEOUT))
+        sessions[host] = session
+    return session
+
+
+async def close_async_sessions() -> None:
+    for session in _async_sessions.pop(asyncio.get_running_loop(), {}).values():
+        await session.close()
+
+on_event_loop_stop(close_async_sessions)
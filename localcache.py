@@ -0,0 +1,88 @@
+import time
+import threading
+from collections import OrderedDict
+import config
+
+
+MISSING = object()
+
+
+class LocalCache:
+    '''
+    Bounded in-process LRU cache with ttl. Values are shared between
+    callers and must not be mutated.
+    '''
+
+    def __init__(self, namespace: str, max_size=1000, ttl=60):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=MISSING) -> None:
+        '''
+        Drop key from cache or everything if key is not given
+        '''
+        with self._lock:
+            if key is MISSING:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_local_cache(namespace: str, max_size=1000, ttl=60):
+    '''
+    Return shared local cache for namespace or None if local caching is
+    disabled. First caller decides size and ttl.
+    '''
+    if not config.LOCAL_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = LocalCache(namespace, max_size, ttl)
+        return _caches[namespace]
+
+def local_cache_stats() -> dict:
+    return {namespace: cache.stats() for namespace, cache in _caches.items()}
+
+def invalidate_all() -> None:
+    for cache in list(_caches.values()):
+        cache.invalidate()
@@ -0,0 +1,66 @@
+from operator import itemgetter
+
+# Bump when layout of the record changes. Records of other versions are fetched again.
+MATCH_RECORD_VERSION = 1
+
+# participant row layout
+PARTICIPANT_FIELDS = (
+    'participantId', 'summonerName', 'accountId', 'teamId', 'championId', 'lane', 'role',
+    'kills', 'deaths', 'assists', 'win', 'largestMultiKill', 'goldEarned',
+)
+(PID, SUMMONER_NAME, ACCOUNT_ID, TEAM, CHAMPION, LANE, ROLE,
+ KILLS, DEATHS, ASSISTS, WIN, MULTIKILL, GOLD) = range(len(PARTICIPANT_FIELDS))
+
+
+def project_match(match: dict) -> dict:
+    '''
+    Project full match-v4 payload to the compact record analyzers use.
+    Participants are stored as rows in PARTICIPANT_FIELDS order.
+    '''
+    identities = {
+        identity['participantId']: identity['player']
+        for identity in match['participantIdentities']
+    }
+    rows = []
+    for participant in match['participants']:
+        stats = participant['stats']
+        timeline = participant.get('timeline', {})
+        player = identities.get(participant['participantId'], {})
+        rows.append([
+            participant['participantId'],
+            player.get('summonerName'),
+            player.get('currentAccountId', player.get('accountId')),
+            participant['teamId'],
+            participant['championId'],
+            timeline.get('lane'),
+            timeline.get('role'),
+            stats['kills'],
+            stats['deaths'],
+            stats['assists'],
+            stats['win'],
+            stats['largestMultiKill'],
+            stats['goldEarned'],
+        ])
+    return {
+        'v': MATCH_RECORD_VERSION,
+        'gameId': match['gameId'],
+        'gameCreation': match['gameCreation'],
+        'queueId': match.get('queueId'),
+        'participants': rows,
+    }
+
+def is_current(value: dict) -> bool:
+    return value.get('v') == MATCH_RECORD_VERSION
+
+def to_record(value: dict) -> dict:
+    '''
+    Return value as current record. Accepts full payloads cached before projection.
+    '''
+    if is_current(value):
+        return value
+    if 'participantIdentities' in value:
+        return project_match(value)
+    raise ValueError(f'Can not convert match record version {value.get("v")}')
+
+def champion_ids(record: dict) -> set:
+    return set(map(itemgetter(CHAMPION), record['participants']))
@@ -0,0 +1,212 @@
+import os
+import time
+import random
+import types
+import cProfile
+import threading
+from contextlib import contextmanager
+import config
+from utils import LogMixin
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics(LogMixin):
+    '''
+    Minimal in-process counters and histograms rendered in prometheus text
+    format. Every process keeps its own numbers and labels its samples with
+    worker="<pid>". Under gunicorn a scrape is answered by whichever worker
+    takes the request, so aggregate with sum without (worker) and expect
+    series of a worker to only move when that worker was scraped. When
+    disabled all recording calls return right away.
+    '''
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value=1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def timer(self, name: str, **labels):
+        '''
+        Context manager observing duration of the block
+        '''
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def register_collector(self, collector) -> None:
+        '''
+        collector() returns list of (name, labels dict, value) gauges read at render time
+        '''
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _format_labels(labels) -> str:
+        if not labels:
+            return ''
+        pairs = ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels)
+        return '{' + pairs + '}'
+
+    def render(self) -> str:
+        lines = []
+        # forked workers inherit the registry, read pid at render time
+        worker = (('worker', os.getpid()),)
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        gauges = []
+        for collector in self._collectors:
+            try:
+                gauges.extend((name, tuple(sorted(labels.items())), value) for name, labels, value in collector())
+            except Exception as exc:
+                self.logger.error('Metrics collector failed: %s', exc)
+        # samples of one metric have to follow its TYPE line
+        gauges.sort(key=lambda gauge: gauge[0])
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                lines.append(f'# TYPE {name} counter')
+                previous = name
+            lines.append(f'{name}{self._format_labels(labels + worker)} {value}')
+        for (name, labels), (counts, count, total) in histograms:
+            if name != previous:
+                lines.append(f'# TYPE {name} histogram')
+                previous = name
+            labels = labels + worker
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = labels + (('le', bound),)
+                lines.append(f'{name}_bucket{self._format_labels(bucket_labels)} {bucket_count}')
+            lines.append(f'{name}_bucket{self._format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_count{self._format_labels(labels)} {count}')
+            lines.append(f'{name}_sum{self._format_labels(labels)} {total}')
+        for name, labels, value in gauges:
+            if name != previous:
+                lines.append(f'# TYPE {name} gauge')
+                previous = name
+            lines.append(f'{name}{self._format_labels(labels + worker)} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(config.METRICS_ENABLED)
+
+
+def _sampled() -> bool:
+    return config.PROFILE_SAMPLE_RATE > 0 and random.random() < config.PROFILE_SAMPLE_RATE
+
+
+def _dump_profile(profile: cProfile.Profile, name: str) -> None:
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    filename = f'{name}-{os.getpid()}-{int(time.time() * 1000)}.prof'
+    profile.dump_stats(os.path.join(config.PROFILE_DIR, filename))
+
+
+@contextmanager
+def sampled_profile(name: str):
+    '''
+    Profile a sampled fraction of blocks with cProfile and dump the stats
+    to PROFILE_DIR. Does nothing when PROFILE_SAMPLE_RATE is 0. Only the
+    calling thread is profiled, wrap coroutines handed to the event loop
+    with sampled_coroutine_profile.
+    '''
+    if not _sampled():
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        _dump_profile(profile, name)
+
+
+def sampled_coroutine_profile(name: str, coro):
+    '''
+    Profile a sampled fraction of coroutines like sampled_profile. The
+    profiler runs only while coro itself runs on the loop, not while other
+    coroutines run in between its awaits.
+    '''
+    if not _sampled():
+        return coro
+
+    async def profiled():
+        profile = cProfile.Profile()
+        try:
+            return await _profile_steps(coro, profile)
+        finally:
+            _dump_profile(profile, name)
+
+    return profiled()
+
+
+@types.coroutine
+def _profile_steps(coro, profile: cProfile.Profile):
+    # drive coro like the task does, with the profiler on during each step
+    value, error = None, None
+    while True:
+        profile.enable()
+        try:
+            if error is None:
+                yielded = coro.send(value)
+            else:
+                yielded = coro.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+        try:
+            value, error = (yield yielded), None
+        except BaseException as exc:
+            value, error = None, exc
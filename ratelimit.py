@@ -0,0 +1,231 @@
+import time
+import asyncio
+import threading
+from typing import List, Tuple
+import config
+from rediscache import get_async_redis, AsyncScript
+from utils import LogMixin
+
+
+class RateLimitExceeded(RuntimeError):
+    pass
+
+
+# Takes one token from every bucket or none of them. Returns 0 on success,
+# otherwise milliseconds until all buckets and blocks allow a request.
+# KEYS: bucket keys followed by block keys
+# ARGV: now_ms, bucket count, then capacity and window_ms per bucket
+ACQUIRE_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local nbuckets = tonumber(ARGV[2])
+local wait = 0
+for i = nbuckets + 1, #KEYS do
+    local ttl = redis.call('PTTL', KEYS[i])
+    if ttl > wait then wait = ttl end
+end
+local tokens = {}
+for i = 1, nbuckets do
+    local capacity = tonumber(ARGV[1 + 2*i])
+    local rate = capacity / tonumber(ARGV[2 + 2*i])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local current = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    current = math.min(capacity, current + math.max(0, now - ts) * rate)
+    tokens[i] = current
+    if current < 1 then
+        local need = math.ceil((1 - current) / rate)
+        if need > wait then wait = need end
+    end
+end
+if wait > 0 then return wait end
+for i = 1, nbuckets do
+    redis.call('HMSET', KEYS[i], 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], 2 * tonumber(ARGV[2 + 2*i]))
+end
+return 0
+'''
+
+# Lowers bucket to what riot reports as remaining for the window.
+# KEYS: bucket key. ARGV: now_ms, capacity, window_ms, used count
+SYNC_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local window = tonumber(ARGV[3])
+local remaining = capacity - tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local current = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+current = math.min(capacity, current + math.max(0, now - ts) * capacity / window)
+if remaining < current then
+    redis.call('HMSET', KEYS[1], 'tokens', remaining, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], 2 * window)
+end
+return 0
+'''
+
+
+def parse_rate_header(value: str) -> List[Tuple[int, int]]:
+    '''
+    Parse riot rate limit header like "20:1,100:120" to [(20, 1), (100, 120)]
+    '''
+    pairs = []
+    for part in (value or '').split(','):
+        if ':' not in part:
+            continue
+        amount, window = part.split(':', 1)
+        pairs.append((int(amount), int(window)))
+    return pairs
+
+
+class RateLimiter(LogMixin):
+    '''
+    Token bucket rate limiter with state in redis so that all worker
+    processes share the same budget. Each scope (eg. riot app or a single
+    api method) has one bucket per time window. Limits are learned from
+    response headers and stored in redis as well.
+
+    Methods are coroutines, waiting for a token suspends only the calling
+    coroutine. Threaded callers wrap them in utils.run_sync.
+    '''
+    prefix = 'ratelimit_'
+    limits_refresh_interval = 10
+
+    def __init__(self, default_limits=None, db=0):
+        self.db = db
+        self.default_limits = default_limits or {}
+        self.safety_factor = config.RATE_LIMIT_SAFETY_FACTOR
+        self.max_backoff = config.RATE_LIMIT_MAX_BACKOFF
+        self._acquire = AsyncScript(ACQUIRE_SCRIPT)
+        self._sync = AsyncScript(SYNC_SCRIPT)
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _bucket_key(self, scope: str, window: int) -> str:
+        return f'{self.prefix}{scope}_{window}'
+
+    def _block_key(self, scope: str) -> str:
+        return f'{self.prefix}blocked_{scope}'
+
+    def _limits_key(self, scope: str) -> str:
+        return f'{self.prefix}limits_{scope}'
+
+    def _backoff_key(self, scope: str) -> str:
+        return f'{self.prefix}backoff_{scope}'
+
+    def _cached_limits(self, scope: str):
+        cached = self._limits.get(scope)
+        if cached is not None and time.monotonic() - cached[0] < self.limits_refresh_interval:
+            return cached[1]
+        return None
+
+    def _cache_limits(self, scope: str, header) -> List[Tuple[int, int]]:
+        '''
+        Cache limits read from redis. None means no limits learned yet.
+        '''
+        if header is None:
+            header = self.default_limits.get(scope, '')
+        elif isinstance(header, bytes):
+            header = header.decode('utf-8')
+        limits = parse_rate_header(header)
+        with self._lock:
+            self._limits[scope] = (time.monotonic(), limits)
+        return limits
+
+    async def get_limits(self, scope: str) -> List[Tuple[int, int]]:
+        limits = self._cached_limits(scope)
+        if limits is None:
+            redis = await get_async_redis(self.db)
+            limits = self._cache_limits(scope, await redis.get(self._limits_key(scope)))
+        return limits
+
+    def _acquire_call(self, scopes: List[str], limits: dict) -> Tuple[list, list]:
+        '''
+        Keys and args of ACQUIRE_SCRIPT for scopes with given limits
+        '''
+        keys = []
+        args = [int(time.time() * 1000), 0]
+        for scope in scopes:
+            for amount, window in limits[scope]:
+                keys.append(self._bucket_key(scope, window))
+                args += [max(1, int(amount * self.safety_factor)), window * 1000]
+        args[1] = len(keys)
+        keys += [self._block_key(scope) for scope in scopes]
+        return keys, args
+
+    def _sync_calls(self, scope: str, limits: List[Tuple[int, int]], count_header: str) -> list:
+        '''
+        Keys and args of SYNC_SCRIPT for every window riot reported a count for
+        '''
+        counts = dict((window, count) for count, window in parse_rate_header(count_header))
+        now = int(time.time() * 1000)
+        calls = []
+        for amount, window in limits:
+            if window in counts:
+                capacity = max(1, int(amount * self.safety_factor))
+                calls.append(([self._bucket_key(scope, window)], [now, capacity, window * 1000, counts[window]]))
+        return calls
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_backoff, 2 ** (attempt - 1))
+
+    async def try_acquire(self, scopes: List[str]) -> float:
+        '''
+        Take a token from all scopes. Return 0 if succeeded or seconds to
+        wait before trying again.
+        '''
+        keys, args = self._acquire_call(scopes, {scope: await self.get_limits(scope) for scope in scopes})
+        return int(await self._acquire(await get_async_redis(self.db), keys, args)) / 1000
+
+    async def acquire(self, scopes: List[str], max_wait: float) -> None:
+        '''
+        Wait until a token is available in all scopes. Raises
+        RateLimitExceeded instead of waiting longer than max_wait seconds.
+        '''
+        waited = 0
+        while True:
+            wait = await self.try_acquire(scopes)
+            if wait <= 0:
+                return
+            if waited + wait > max_wait:
+                raise RateLimitExceeded(f'Rate limit for {scopes} frees up in {wait:.1f} seconds')
+            self.logger.debug('Rate limit for %s reached. waiting %.2f seconds', scopes, wait)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def update(self, scope: str, limit_header: str, count_header: str) -> None:
+        '''
+        Store limits reported by api and correct buckets with reported usage.
+        '''
+        if not limit_header:
+            return
+        redis = await get_async_redis(self.db)
+        limits = parse_rate_header(limit_header)
+        if limits != await self.get_limits(scope):
+            self.logger.info('Rate limits for %s changed to %s', scope, limit_header)
+            await redis.set(self._limits_key(scope), limit_header)
+            with self._lock:
+                self._limits[scope] = (time.monotonic(), limits)
+        for keys, args in self._sync_calls(scope, limits, count_header):
+            await self._sync(redis, keys, args)
+
+    async def block(self, scope: str, retry_after=None) -> float:
+        '''
+        Block scope for retry_after seconds. Without retry_after use
+        exponential backoff shared between processes. Returns block time.
+        '''
+        redis = await get_async_redis(self.db)
+        if retry_after is None:
+            backoff_key = self._backoff_key(scope)
+            attempt = await redis.incr(backoff_key)
+            await redis.expire(backoff_key, self.max_backoff * 2)
+            retry_after = self._backoff(attempt)
+        await redis.set(self._block_key(scope), 1, pexpire=max(1, int(retry_after * 1000)))
+        return retry_after
+
+
+_limiters = {}
+
+def get_rate_limiter(name: str, default_limits=None) -> RateLimiter:
+    if name not in _limiters:
+        _limiters[name] = RateLimiter(default_limits)
+    return _limiters[name]
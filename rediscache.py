@@ -1,45 +1,355 @@
-import json
 import redis
+import aioredis
+import config
+import asyncio
+import hashlib
 import logging
-import base64
+import serializers
+import threading
+import time
+import uuid
+import weakref
+from cachepolicy import get_policy, CacheStats, SET_SCRIPT, FORGET_SCRIPT, EVICT_SCRIPT
+from localcache import get_local_cache, MISSING
+from metrics import metrics
+from utils import on_event_loop_stop, run_sync
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_redis(db=0) -> redis.Redis:
+    '''
+    Return redis client backed by process wide connection pool for given db.
+    Clients are cheap, connections are shared.
+    '''
+    pool = _pools.get(db)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db)
+            if pool is None:
+                pool = redis.ConnectionPool(
+                    connection_class=redis.UnixDomainSocketConnection,
+                    path=config.REDIS_SOCKET,
+                    db=db)
+                _pools[db] = pool
+    return redis.Redis(connection_pool=pool)
+
+
+# asyncio pools belong to the event loop that opened them
+_async_pools = weakref.WeakKeyDictionary()
+_async_pools_locks = weakref.WeakKeyDictionary()
+
+
+async def get_async_redis(db=0):
+    '''
+    aioredis client backed by a connection pool of the running event loop
+    '''
+    loop = asyncio.get_running_loop()
+    pools = _async_pools.setdefault(loop, {})
+    pool = pools.get(db)
+    if pool is None:
+        async with _async_pools_locks.setdefault(loop, asyncio.Lock()):
+            pool = pools.get(db)
+            if pool is None:
+                pool = await aioredis.create_redis_pool(
+                    config.REDIS_SOCKET, db=db, maxsize=config.ASYNC_REDIS_POOL_SIZE)
+                pools[db] = pool
+    return pool
+
+
+async def close_async_redis() -> None:
+    for pool in _async_pools.pop(asyncio.get_running_loop(), {}).values():
+        pool.close()
+        await pool.wait_closed()
+
+on_event_loop_stop(close_async_redis)
+
+
+class AsyncScript:
+    '''
+    Lua script run with EVALSHA and loaded on NOSCRIPT, like redis-py register_script
+    '''
+
+    def __init__(self, script: str):
+        self.script = script
+        self.sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+    async def __call__(self, redis, keys=(), args=()):
+        try:
+            return await redis.evalsha(self.sha, keys=list(keys), args=list(args))
+        except aioredis.ReplyError as exc:
+            if not str(exc).startswith('NOSCRIPT'):
+                raise
+        return await redis.eval(self.script, keys=list(keys), args=list(args))
+
+
+_stats = {}
+
+def get_cache_stats(db=0) -> CacheStats:
+    if db not in _stats:
+        with _pools_lock:
+            if db not in _stats:
+                _stats[db] = CacheStats(get_redis(db))
+    return _stats[db]
+
+
+# delete lock only if we still own it
+RELEASE_LOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
 
 
 class SerializerMixin:
 
     @staticmethod
     def _serialize(item):
-        return base64.b64encode(json.dumps(item).encode('utf-8'))
+        return serializers.dumps(item)
     @staticmethod
     def _deserialize(item):
-        return json.loads(base64.b64decode(item).decode('utf-8'))
+        return serializers.loads(item)
+
+    def _migrate(self, redis_key, raw, value) -> None:
+        '''
+        Rewrite value stored in an old format with the current one. Keeps ttl.
+        For unaccounted keys like RiotData, RedisCache migrates through its
+        accounting script.
+        '''
+        if not serializers.is_outdated(raw):
+            return
+        self.logger.debug('Migrating "%s" to %s format', redis_key, serializers.get_serializer().name)
+        ttl = self.redis.pttl(redis_key)
+        self.redis.set(redis_key, self._serialize(value), px=ttl or None, xx=True)
 
 
 class RedisCache(SerializerMixin):
-    def __init__(self, prefix, get_value, expire_time=None, db=0):
+    '''
+    Read through cache of get_value results. Methods are coroutines and
+    get_value has to be a coroutine function, use `await cache.get(key)`.
+    Threaded callers use `cache[key]`, which blocks on the process event loop.
+    '''
+    # how long a fetcher may hold the lock and how often waiters check for result
+    lock_timeout = 30
+    poll_interval = 0.05
+    negative_marker = '__negative__'
+
+    def __init__(self, prefix, get_value, expire_time=None, db=0, local_ttl=None, local_size=1000,
+                 negative_ttl=None, negative_error=LookupError):
         self.logger = logging.getLogger('TiltBot')
-        self.redis = redis.Redis(unix_socket_path='/tmp/redis.sock', db=db)
+        self.db = db
         self.prefix = prefix
         self.get_value = get_value
-        self.expire_time = expire_time
+        # ttl and memory budget of the namespace, see cachepolicy.py
+        self.policy = get_policy(prefix)
+        self.expire_time = expire_time if expire_time is not None else self.policy.ttl
+        self.stats = get_cache_stats(db)
+        # permanent failures (exceptions with truthy `permanent` attribute) are
+        # remembered for negative_ttl seconds and raised again as negative_error
+        self.negative_ttl = negative_ttl
+        self.negative_error = negative_error
+        self._release_lock = AsyncScript(RELEASE_LOCK_SCRIPT)
+        self._account_set = AsyncScript(SET_SCRIPT)
+        self._forget = AsyncScript(FORGET_SCRIPT)
+        self._evict = AsyncScript(EVICT_SCRIPT)
+        # optional in-process tier. values from it are shared, do not mutate them
+        self.local = None
+        if local_ttl is not None:
+            self.local = get_local_cache(f'{prefix}{db}', local_size, local_ttl)
 
     def __getitem__(self, key):
+        return run_sync(self.get(key))
+
+    async def get(self, key):
+        with metrics.timer('tiltbot_cache_get_seconds', prefix=self.prefix):
+            return await self._get(key)
+
+    async def _get(self, key):
         str_key = str(key)
-        value = self.redis.get(self.prefix + str_key)
+        if self.local is not None:
+            value = self.local.get(str_key)
+            if value is not MISSING:
+                self._count('local')
+                return value
+        redis = await get_async_redis(self.db)
+        value = await redis.get(self.prefix + str_key)
         # Fetch value if it does not exist
         if value is None:
-            self.logger.info('key "%s" not in cache. fetching..', key)
-            value = self.get_value(key)
-            self._set_key(str_key, value)
-            return value
-        
-        self.logger.debug('Using cached value for key "%s%s"', self.prefix, key)
-        value = self._deserialize(value)
+            self._count('miss')
+            value = await self._fetch(key, str_key)
+        else:
+            self._count('hit')
+            self.logger.debug('Using cached value for key "%s%s"', self.prefix, key)
+            value = await self._load(self.prefix + str_key, value)
+        if self.local is not None:
+            self.local.set(str_key, value)
+        return value
+
+    async def get_many(self, keys) -> dict:
+        '''
+        Return dict of key -> value for all keys. Cached values are read in
+        one round trip, missing ones are fetched concurrently.
+        '''
+        values = {}
+        remaining = []
+        for key in keys:
+            value = MISSING if self.local is None else self.local.get(str(key))
+            if value is MISSING:
+                remaining.append(key)
+            else:
+                values[key] = value
+        if not remaining:
+            return values
+        redis = await get_async_redis(self.db)
+        raw_values = await redis.mget(*[self.prefix + str(key) for key in remaining])
+        missing = []
+        for key, raw in zip(remaining, raw_values):
+            if raw is not None:
+                values[key] = await self._load(self.prefix + str(key), raw)
+            else:
+                missing.append(key)
+        fetched = await asyncio.gather(*[self._fetch(key, str(key)) for key in missing])
+        values.update(zip(missing, fetched))
+        if self.local is not None:
+            for key in remaining:
+                self.local.set(str(key), values[key])
+        return values
+
+    async def peek_many(self, keys) -> dict:
+        '''
+        Return cached values for keys without fetching missing ones
+        '''
+        keys = list(keys)
+        if not keys:
+            return {}
+        redis = await get_async_redis(self.db)
+        return self._peeked(keys, await redis.mget(*[self.prefix + str(key) for key in keys]))
+
+    def _peeked(self, keys, raw_values) -> dict:
+        values = {}
+        for key, raw in zip(keys, raw_values):
+            if raw is None:
+                continue
+            value = self._deserialize(raw)
+            if not self._is_negative(value):
+                values[key] = value
+        return values
+
+    async def invalidate(self, *keys) -> None:
+        if not keys:
+            return
+        forget_keys, args = self.policy.forget_call([self.prefix + str(key) for key in keys])
+        await self._forget(await get_async_redis(self.db), forget_keys, args)
+        if self.local is not None:
+            for key in keys:
+                self.local.invalidate(str(key))
+
+    def _count(self, result: str) -> None:
+        metrics.inc('tiltbot_cache_requests_total', prefix=self.prefix, result=result)
+        self.stats.record(self.policy.namespace, result)
+
+    def _is_negative(self, value) -> bool:
+        return isinstance(value, dict) and self.negative_marker in value
+
+    def _decode(self, redis_key, raw):
+        value = self._deserialize(raw)
+        if self._is_negative(value):
+            self.logger.debug('Cached failure for key "%s"', redis_key)
+            error = self.negative_error(value[self.negative_marker])
+            error.status_code = value.get('status_code')
+            raise error
         return value
 
-    def _set_key(self, key, value):
-        redis_key = self.prefix + key
-        if self.expire_time is not None:
-            return self.redis.setex(redis_key, self._serialize(value), self.expire_time)
-        return self.redis.set(redis_key, self._serialize(value))
-        
-   
\ No newline at end of file
+    async def _load(self, redis_key, raw):
+        value = self._decode(redis_key, raw)
+        if serializers.is_outdated(raw):
+            self.logger.debug('Migrating "%s" to %s format', redis_key, serializers.get_serializer().name)
+            redis = await get_async_redis(self.db)
+            ttl = await redis.pttl(redis_key)
+            # -2 expired meanwhile, -1 stored without ttl
+            if ttl != -2:
+                usage = await self._set_raw(
+                    redis, redis_key[len(self.prefix):], self._serialize(value), ttl / 1000 if ttl > 0 else None)
+                await self._check_budget(redis, usage)
+        return value
+
+    def _negative_marker(self, key, exc):
+        '''
+        Serialized marker to cache for a failed fetch or None if failure should not be cached
+        '''
+        if not self.negative_ttl or not getattr(exc, 'permanent', False):
+            return None
+        self.logger.info('Caching failure for key "%s%s": %s', self.prefix, key, exc)
+        return self._serialize({self.negative_marker: str(exc), 'status_code': getattr(exc, 'status_code', None)})
+
+    async def _get_value(self, redis, key, str_key):
+        try:
+            value = await self.get_value(key)
+        except Exception as exc:
+            marker = self._negative_marker(key, exc)
+            if marker is not None:
+                await self._check_budget(redis, await self._set_raw(redis, str_key, marker, self.negative_ttl))
+            raise
+        await self._check_budget(redis, await self._set_key(redis, str_key, value))
+        return value
+
+    async def _fetch(self, key, str_key):
+        '''
+        Fetch missing value so that only one caller across all coroutines and
+        processes calls get_value for the key. Others wait for its result.
+        '''
+        redis = await get_async_redis(self.db)
+        redis_key = self.prefix + str_key
+        lock_key = f'lock_{redis_key}'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            locked = await redis.set(
+                lock_key, token, pexpire=int(self.lock_timeout * 1000), exist=redis.SET_IF_NOT_EXIST)
+            if locked:
+                try:
+                    # value may have been stored right before we got the lock
+                    value = await redis.get(redis_key)
+                    if value is not None:
+                        return await self._load(redis_key, value)
+                    self.logger.info('key "%s" not in cache. fetching..', key)
+                    return await self._get_value(redis, key, str_key)
+                finally:
+                    await self._release_lock(redis, [lock_key], [token])
+
+            await asyncio.sleep(self.poll_interval)
+            value = await redis.get(redis_key)
+            if value is not None:
+                self.logger.debug('Got value for key "%s" fetched by another worker', redis_key)
+                return await self._load(redis_key, value)
+            if time.monotonic() > deadline:
+                self.logger.warning('Waiting for key "%s" timed out. fetching..', redis_key)
+                return await self._get_value(redis, key, str_key)
+
+    async def set_many(self, items: dict) -> None:
+        if not items:
+            return
+        redis = await get_async_redis(self.db)
+        usages = await asyncio.gather(*[self._set_key(redis, str(key), value) for key, value in items.items()])
+        await self._check_budget(redis, max(usages))
+        if self.local is not None:
+            for key, value in items.items():
+                self.local.set(str(key), value)
+
+    async def _set_raw(self, redis, key, raw, ttl):
+        '''
+        Store serialized value with size accounting. Returns bytes used by the namespace.
+        '''
+        keys, args = self.policy.set_call(self.prefix + key, raw, ttl)
+        return await self._account_set(redis, keys, args)
+
+    async def _set_key(self, redis, key, value):
+        return await self._set_raw(redis, key, self._serialize(value), self.expire_time)
+
+    async def _check_budget(self, redis, usage) -> None:
+        if self.policy.over_budget(int(usage)):
+            keys, args = self.policy.evict_call()
+            self.policy.evicted(await self._evict(redis, keys, args))
@@ -1,84 +1,216 @@
 import json
-import logging
 import time
-import requests
-from rediscache import RedisCache
-from riotdata import ChampionData
-from utils import map_key, pretty_print, LogMixin
+import asyncio
+import threading
+import logging
+import aiohttp
+import config
+from httpclient import get_async_session
+from metrics import metrics
+from ratelimit import get_rate_limiter, RateLimitExceeded
+from utils import map_key, pretty_print, LogMixin, run_sync
 
 
 class RitoPlsError(RuntimeError):
+    # responses that will not change by asking again
+    permanent_status_codes = {400, 404, 422}
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def permanent(self) -> bool:
+        return self.status_code in self.permanent_status_codes
+
+class RateLimitedError(RitoPlsError):
+    pass
+
+class UnknownRegionError(ValueError):
     pass
 
+
+def check_region(region=None) -> str:
+    '''
+    Return region or the default one. Raises UnknownRegionError for regions not in config.RIOT_REGIONS.
+    '''
+    region = (region or config.DEFAULT_REGION).lower()
+    if region not in config.RIOT_REGIONS:
+        raise UnknownRegionError(f'Unknown region {region}. Known regions: {", ".join(config.RIOT_REGIONS)}')
+    return region
+
+
+def riot_app_scope(region: str) -> str:
+    return f'riot_app_{region}'
+
+
+_api_key = None
+_api_key_lock = threading.Lock()
+
+def riot_api_key() -> str:
+    '''
+    Riot api key from config.RIOT_KEY_FILE, read once per process
+    '''
+    global _api_key
+    with _api_key_lock:
+        if _api_key is None:
+            with open(config.RIOT_KEY_FILE) as f:
+                _api_key = f.read().strip()
+        return _api_key
+
+
 class RiotApi(LogMixin):
-    api_url = None
+    '''
+    asyncio client of one riot api. Rate limit waits and 429 backoffs
+    suspend only the calling coroutine. get blocks on the process event
+    loop for threaded callers, coroutines await get_async.
+    '''
+    # path under the regional api host
+    api_path = None
+    # error statuses that are normal answers of this api, raised without logging an error
+    expected_status_codes = frozenset()
 
-    def __init__(self):
-        self.api_token = self._load_api_key()
-        self.backoff = 1
-        self.max_backoff = 60
+    def __init__(self, region=None):
+        self.region = check_region(region)
+        platform = config.RIOT_REGIONS[self.region]
+        # every region has its own host and so its own connection pool
+        self.api_url = config.RIOT_API_URL.format(platform=platform) + self.api_path
+        self.api_token = riot_api_key()
         self.max_rate_limit_retries = 10
+        self.max_wait = config.RATE_LIMIT_MAX_WAIT
+        self.rate_limiter = get_rate_limiter(
+            'riot', {riot_app_scope(region): config.RIOT_APP_RATE_LIMIT for region in config.RIOT_REGIONS})
+
+    @property
+    def app_scope(self) -> str:
+        # riot limits are per region so load in one never throttles another
+        return riot_app_scope(self.region)
 
+    @property
+    def endpoint(self) -> str:
+        return self.__class__.__name__
+
+    @property
+    def method_scope(self) -> str:
+        return f'riot_{self.region}_{self.endpoint}'
 
     @staticmethod
     def _decode_response(resp : bytes) -> dict:
         return json.loads(resp.decode('utf8'))
     
-    def get(self, main_param : str, attempt=0) -> dict:
+    def get(self, main_param : str) -> dict:
+        return run_sync(self.get_async(main_param))
+
+    async def get_async(self, main_param : str) -> dict:
         self.logger.debug('Requesting %s from %s', main_param, self.api_url)
-        resp = requests.get(
-            f'{self.api_url}{main_param}',
-            self.get_query_params(),
-            headers={'X-Riot-Token': self.api_token})
-
-        # ratelimit hit try again after some time!
-        if resp.status_code == 429: 
-            self.logger.warning('Rate limit hit with %s!', self.__class__)
-            for head, val in resp.headers.items():
-                if 'Rate' in head:
-                    self.logger.debug('Header %s: %s', head, val)
-            backoff_time = self._get_backoff_time(resp)
-            self.logger.warning('Sleeping for %s seconds', backoff_time)
-            time.sleep(backoff_time)
-            if attempt + 1 < self.max_rate_limit_retries: 
-                return self.get(main_param, attempt + 1)
-            raise RitoPlsError('Max ratelimit retries exeeded')
+        for _ in range(self.max_rate_limit_retries):
+            status_code, headers, content = await self._request(main_param)
+            if status_code != 429:
+                break
+            # ratelimit hit. block the offending scope for every worker and try again
+            scope = self._rate_limited_scope(headers)
+            backoff_time = await self.rate_limiter.block(scope, self._get_retry_after(headers))
+            self.logger.warning('Blocked %s for %s seconds', scope, backoff_time)
+        else:
+            raise RateLimitedError('Max ratelimit retries exeeded')
+        return self._check_response(status_code, content)
 
-        # we got some error. lets quit
+    def _rate_limited_scope(self, headers) -> str:
+        '''
+        Scope to block after a 429 with given headers
+        '''
+        self.logger.warning('Rate limit hit with %s!', self.__class__)
+        metrics.inc('tiltbot_riot_429_total', endpoint=self.endpoint, region=self.region)
+        for head, val in headers.items():
+            if 'Rate' in head:
+                self.logger.debug('Header %s: %s', head, val)
+        if headers.get('X-Rate-Limit-Type') == 'application':
+            return self.app_scope
+        return self.method_scope
 
-        if resp.status_code not in range(200, 300):
-            self.logger.error("error with request code %s: %s", resp.status_code, resp.content)
-            raise RitoPlsError(f'Getting data with {self.__class__} failed with status code {resp.status_code}')
+    def _check_response(self, status_code: int, content: bytes) -> dict:
+        # we got some error. lets quit
+        if status_code not in range(200, 300):
+            if status_code in self.expected_status_codes:
+                self.logger.debug("%s answered %s", self.endpoint, status_code)
+            else:
+                self.logger.error("error with request code %s: %s", status_code, content)
+            raise RitoPlsError(
+                f'Getting data with {self.__class__} failed with status code {status_code}',
+                status_code)
         # all ok. proceed to decode response
-        return self._decode_response(resp.content)
+        return self._decode_response(content)
 
-    def _load_api_key(self):
-        with open('/keys/ritoapi.key') as f:
-            return f.read().strip()
-    
-    def _get_backoff_time(self, resp) -> int:
+    async def _request(self, main_param : str):
+        '''
+        Make one request. Returns (status code, headers, body).
+        '''
+        endpoint = self.endpoint
+        region = self.region
         try:
-            return int(resp.headers['Retry-After'])
+            with metrics.timer('tiltbot_riot_rate_limit_wait_seconds', endpoint=endpoint, region=region):
+                await self.rate_limiter.acquire([self.app_scope, self.method_scope], self.max_wait)
+        except RateLimitExceeded as exc:
+            metrics.inc('tiltbot_riot_rate_limited_total', endpoint=endpoint, region=region)
+            raise RateLimitedError(str(exc)) from exc
+        try:
+            with metrics.timer('tiltbot_riot_request_seconds', endpoint=endpoint, region=region):
+                async with get_async_session(self.api_url).get(
+                        f'{self.api_url}{main_param}',
+                        params=self.get_query_params(),
+                        headers={'X-Riot-Token': self.api_token}) as resp:
+                    content = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            self.logger.error('Request to %s failed: %s', self.api_url, exc)
+            metrics.inc('tiltbot_riot_responses_total', endpoint=endpoint, region=region, status='error')
+            raise RitoPlsError(f'Getting data with {self.__class__} failed: {exc!r}') from exc
+        metrics.inc('tiltbot_riot_responses_total', endpoint=endpoint, region=region, status=resp.status)
+        headers = resp.headers
+        await self.rate_limiter.update(
+            self.app_scope, headers.get('X-App-Rate-Limit'), headers.get('X-App-Rate-Limit-Count'))
+        await self.rate_limiter.update(
+            self.method_scope, headers.get('X-Method-Rate-Limit'), headers.get('X-Method-Rate-Limit-Count'))
+        return resp.status, headers, content
+
+    def _get_retry_after(self, headers):
+        try:
+            return int(headers['Retry-After'])
         except (KeyError, ValueError):
             self.logger.info('Could not get backoff time from headers. using exponential')
-            backoff = self.backoff
-            self.backoff = min(self.max_backoff, self.backoff*2)
-            return backoff
+            return None
     
     def get_query_params(self):
         return {}
 
 class SummonerApi(RiotApi):
-    api_url = 'https://euw1.api.riotgames.com/lol/summoner/v4/summoners/by-name/'
+    api_path = '/lol/summoner/v4/summoners/by-name/'
 
 class MatchListApi(RiotApi):
-    api_url = 'https://euw1.api.riotgames.com/lol/match/v4/matchlists/by-account/'
+    api_path = '/lol/match/v4/matchlists/by-account/'
 
     def get_query_params(self):
         return [('queue', 400), ('queue', 420), ('queue', 440)]
 
+    def get_game_list(self, account_id: str) -> dict:
+        return run_sync(self.get_game_list_async(account_id))
+
+    async def get_game_list_async(self, account_id: str) -> dict:
+        '''
+        Match list with only the fields needed to pick games and the time it was fetched
+        '''
+        return self.slim_game_list(await self.get_async(account_id))
+
+    @staticmethod
+    def slim_game_list(match_list: dict) -> dict:
+        return {'fetched': time.time(), 'matches': [
+            {'gameId': match['gameId'], 'queue': match.get('queue'), 'timestamp': match.get('timestamp')}
+            for match in match_list['matches']
+        ]}
+
 class MatchApi(RiotApi):
-    api_url = 'https://euw1.api.riotgames.com/lol/match/v4/matches/'
+    api_path = '/lol/match/v4/matches/'
 
-class ChampionApi(RiotApi):
-    api_url = 'https://euw1.api.riotgames.com/lol/static-data/v4/champions/'
\ No newline at end of file
+class SpectatorApi(RiotApi):
+    api_path = '/lol/spectator/v4/active-games/by-summoner/'
+    # summoner is not in a game
+    expected_status_codes = frozenset({404})
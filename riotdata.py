@@ -1,14 +1,37 @@
+import os
 import json
-import redis
-from rediscache import SerializerMixin
+import time
+import threading
+import config
+from localcache import get_local_cache, MISSING
+from metrics import metrics
+from rediscache import SerializerMixin, get_redis
 from utils import LogMixin
 
 class RiotData(LogMixin, SerializerMixin):
 
     redis_prefix = 'riot_data'
+    # seconds to keep values in process memory. None disables local tier
+    local_ttl = None
+    local_size = 1000
 
     def __init__(self, db=0):
-        self.redis = redis.Redis(unix_socket_path='/tmp/redis.sock', db=db)
+        self.db = db
+        self.redis = get_redis(db)
+        self.local = None
+        if self.local_ttl is not None:
+            self.local = get_local_cache(f'{self.redis_prefix}_{db}', self.local_size, self.local_ttl)
+
+    @classmethod
+    def invalidate(cls, db=0) -> None:
+        '''
+        Drop locally cached data of this process. Call after data in redis changes.
+        '''
+        if cls.local_ttl is None:
+            return
+        local = get_local_cache(f'{cls.redis_prefix}_{db}', cls.local_size, cls.local_ttl)
+        if local is not None:
+            local.invalidate()
 
 
     @classmethod
@@ -18,20 +41,55 @@ class RiotData(LogMixin, SerializerMixin):
             data = json.loads(f.read())
         uploadable_data = instance._process_file_data(data)
         instance._upload_data(uploadable_data)
+        cls.invalidate()
         return instance
 
+    @classmethod
+    def preload(cls, db=0) -> int:
+        '''
+        Copy all data of this prefix from redis to process memory so
+        forked workers start warm. Returns number of preloaded keys.
+        '''
+        instance = cls(db)
+        if instance.local is None:
+            return 0
+        redis_keys = list(instance.redis.scan_iter(f'{cls.redis_prefix}_*'))
+        if not redis_keys:
+            return 0
+        for redis_key, raw in zip(redis_keys, instance.redis.mget(redis_keys)):
+            if raw is not None:
+                redis_key = redis_key.decode('utf-8') if isinstance(redis_key, bytes) else redis_key
+                instance.local.set(redis_key, instance._deserialize(raw))
+        return len(redis_keys)
+
     def _process_file_data(self, data):
         return data
 
     
     def __getitem__(self, key):
+        with metrics.timer('tiltbot_cache_get_seconds', prefix=self.redis_prefix):
+            return self._getitem(key)
+
+    def _getitem(self, key):
         redis_key = self.get_redis_key(key)
-        value = self.redis.get(redis_key)
+        value = MISSING if self.local is None else self.local.get(redis_key)
+        if value is not MISSING:
+            metrics.inc('tiltbot_cache_requests_total', prefix=self.redis_prefix, result='local')
+        else:
+            raw = self.redis.get(redis_key)
+            metrics.inc('tiltbot_cache_requests_total', prefix=self.redis_prefix,
+                        result='miss' if raw is None else 'hit')
+            value = None
+            if raw is not None:
+                value = self._deserialize(raw)
+                self._migrate(redis_key, raw, value)
+            if self.local is not None:
+                self.local.set(redis_key, value)
         if value is None:
             errormsg = f'Key {redis_key} not in redis'
             self.logger.debug(errormsg)
             raise KeyError(errormsg)
-        return self._deserialize(value)
+        return value
 
     def get(self, key, default=None):
         try:
@@ -39,16 +97,148 @@ class RiotData(LogMixin, SerializerMixin):
         except KeyError:
             return default
 
+    def get_many(self, keys, default=None) -> dict:
+        '''
+        Return dict of key -> value for all keys using single round trip.
+        Keys missing from redis map to default.
+        '''
+        values = {}
+        remaining = []
+        for key in set(keys):
+            value = MISSING if self.local is None else self.local.get(self.get_redis_key(key))
+            if value is MISSING:
+                remaining.append(key)
+            else:
+                values[key] = default if value is None else value
+        if not remaining:
+            return values
+        raw_values = self.redis.mget([self.get_redis_key(key) for key in remaining])
+        for key, raw in zip(remaining, raw_values):
+            value = None
+            if raw is not None:
+                value = self._deserialize(raw)
+                self._migrate(self.get_redis_key(key), raw, value)
+            if self.local is not None:
+                self.local.set(self.get_redis_key(key), value)
+            values[key] = default if value is None else value
+        return values
+
     def _upload_data(self, data):
+        pipe = self.redis.pipeline(transaction=False)
         for key, item in data.items():
             redis_key = self.get_redis_key(key)
-            self.redis.set(redis_key, self._serialize(item))
+            pipe.set(redis_key, self._serialize(item))
+        pipe.execute()
 
     def get_redis_key(self, key):
         return f"{self.redis_prefix}_{key}"
 
 class ChampionData(RiotData):
+    '''
+    Champion table. Every patch is written as a complete hash under its own
+    key and a pointer key is switched to it in the same transaction, so
+    readers see either the old or the new table, never a mix. Processes
+    keep the whole table in memory and reload it when the pointer moves.
+    '''
     redis_prefix = 'league_champs'
+    # previous tables stay readable for a while after a switch
+    old_version_ttl = 24 * 3600
+    # seconds between checks of the version pointer
+    check_interval = config.CHAMPION_CHECK_INTERVAL if config.LOCAL_CACHE_ENABLED else 0
+
+    # db -> (version, table, checked at)
+    _tables = {}
+    _tables_lock = threading.Lock()
+
+    @classmethod
+    def pointer_key(cls) -> str:
+        return f'{cls.redis_prefix}_version'
+
+    @classmethod
+    def table_key(cls, version: str) -> str:
+        return f'{cls.redis_prefix}_v_{version}'
+
+    @classmethod
+    def invalidate(cls, db=0) -> None:
+        cls._tables.pop(db, None)
+
+    @classmethod
+    def from_file(cls, filepath, force=True):
+        '''
+        Load data dragon champion.json. Without force the upload is skipped
+        when the version of the file is already current.
+        '''
+        instance = cls()
+        with open(filepath) as f:
+            data = json.loads(f.read())
+        version = str(data.get('version', 'unversioned'))
+        if force or instance.current_version() != version:
+            instance._upload_table(version, instance._process_file_data(data))
+            cls.invalidate()
+        return instance
+
+    @classmethod
+    def preload(cls, db=0) -> int:
+        return len(cls(db)._get_table())
+
+    def current_version(self):
+        version = self.redis.get(self.pointer_key())
+        return None if version is None else version.decode('utf-8')
+
+    def _upload_table(self, version: str, champs: dict) -> None:
+        table_key = self.table_key(version)
+        previous = self.current_version()
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(table_key)
+        if champs:
+            pipe.hmset(table_key, {key: self._serialize(item) for key, item in champs.items()})
+        pipe.set(self.pointer_key(), version)
+        if previous is not None and previous != version:
+            pipe.expire(self.table_key(previous), self.old_version_ttl)
+        pipe.execute()
+        self.logger.info('Champion data switched to version %s (%s champions)', version, len(champs))
+
+    def _get_table(self) -> dict:
+        '''
+        Return in memory table. Pointer is checked at most once per
+        config.CHAMPION_CHECK_INTERVAL and the hash is read only when it moved.
+        '''
+        cached = self._tables.get(self.db)
+        now = time.monotonic()
+        if cached is not None and now - cached[2] < self.check_interval:
+            return cached[1]
+        with self._tables_lock:
+            cached = self._tables.get(self.db)
+            if cached is not None and now - cached[2] < self.check_interval:
+                return cached[1]
+            version = self.current_version()
+            if cached is not None and cached[0] == version:
+                table = cached[1]
+            else:
+                table = self._load_table(version)
+            self._tables[self.db] = (version, table, now)
+        return table
+
+    def _load_table(self, version) -> dict:
+        if version is None:
+            self.logger.warning('No champion data in redis')
+            return {}
+        raw_table = self.redis.hgetall(self.table_key(version))
+        metrics.inc('tiltbot_champion_table_loads_total')
+        self.logger.info('Loaded champion data version %s', version)
+        return {key.decode('utf-8'): self._deserialize(raw) for key, raw in raw_table.items()}
+
+    def __getitem__(self, key):
+        try:
+            return self._get_table()[str(key)]
+        except KeyError:
+            errormsg = f'Champion {key} not in champion data'
+            self.logger.debug(errormsg)
+            raise KeyError(errormsg)
+
+    def get_many(self, keys, default=None) -> dict:
+        table = self._get_table()
+        return {key: table.get(str(key), default) for key in set(keys)}
 
     def _process_file_data(self, data):
         champs = {}
@@ -57,4 +247,49 @@ class ChampionData(RiotData):
                 'name': champ_data['name'],
                 'tags': champ_data['tags'],
             }
-        return champs
\ No newline at end of file
+        return champs
+
+
+class ChampionRefresher(LogMixin):
+    '''
+    Reload champion data when the local data dragon file changes
+    '''
+
+    def __init__(self, filepath=None, interval=None):
+        self.filepath = filepath or config.CHAMPION_FILE
+        self.interval = config.CHAMPION_REFRESH_INTERVAL if interval is None else interval
+        self._mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self) -> bool:
+        '''
+        Upload the file if it changed since last call. Returns True if it was loaded.
+        '''
+        try:
+            mtime = os.path.getmtime(self.filepath)
+        except OSError:
+            self.logger.warning('Champion file %s not found', self.filepath)
+            return False
+        if mtime == self._mtime:
+            return False
+        ChampionData.from_file(self.filepath, force=self._mtime is not None)
+        self._mtime = mtime
+        return True
+
+    def start(self) -> None:
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name='champion-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                self.logger.exception('Refreshing champion data failed')
@@ -0,0 +1,95 @@
+import json
+import zlib
+import base64
+import config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Serializer:
+    '''
+    Cache value format. Serialized values start with a single header byte
+    identifying the format so it can be changed without flushing redis.
+    '''
+    name = None
+    header = None
+
+    def dumps(self, item) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes):
+        raise NotImplementedError
+
+
+class Base64JsonSerializer(Serializer):
+    '''
+    Original format. Has no header byte, recognized by base64 alphabet.
+    '''
+    name = 'base64-json'
+    header = b''
+
+    def dumps(self, item) -> bytes:
+        return base64.b64encode(json.dumps(item).encode('utf-8'))
+
+    def loads(self, data: bytes):
+        return json.loads(base64.b64decode(data).decode('utf-8'))
+
+
+class ZlibJsonSerializer(Serializer):
+    name = 'zlib-json'
+    header = b'\x01'
+
+    def dumps(self, item) -> bytes:
+        return zlib.compress(json.dumps(item, separators=(',', ':')).encode('utf-8'), 6)
+
+    def loads(self, data: bytes):
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class ZlibMsgpackSerializer(Serializer):
+    '''
+    Needs msgpack. Unlike json, integer dict keys stay integers.
+    '''
+    name = 'zlib-msgpack'
+    header = b'\x02'
+
+    def dumps(self, item) -> bytes:
+        return zlib.compress(msgpack.packb(item, use_bin_type=True), 6)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(zlib.decompress(data), raw=False, strict_map_key=False)
+
+
+LEGACY = Base64JsonSerializer()
+SERIALIZERS = {serializer.name: serializer for serializer in [LEGACY, ZlibJsonSerializer()]}
+if msgpack is not None:
+    SERIALIZERS[ZlibMsgpackSerializer.name] = ZlibMsgpackSerializer()
+_BY_HEADER = {serializer.header: serializer for serializer in SERIALIZERS.values() if serializer.header}
+
+
+def get_serializer(name=None) -> Serializer:
+    name = name or config.CACHE_FORMAT
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f'Unknown or unavailable cache format {name}') from None
+
+def detect(data: bytes) -> Serializer:
+    return _BY_HEADER.get(data[:1], LEGACY)
+
+def dumps(item, serializer=None) -> bytes:
+    serializer = serializer or get_serializer()
+    return serializer.header + serializer.dumps(item)
+
+def loads(data: bytes):
+    serializer = detect(data)
+    return serializer.loads(data[len(serializer.header):])
+
+def is_outdated(data: bytes, serializer=None) -> bool:
+    '''
+    True if data is not stored in the current format and should be rewritten
+    '''
+    return detect(data) is not (serializer or get_serializer())
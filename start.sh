@@ -1,8 +1,7 @@
 #!/bin/bash
 DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null && pwd )"
 docker run -d \
-           -e FLASK_APP=tgbot.py \
-           -e FLASK_ENV=development \
+           --stop-timeout 35 \
            -p 127.0.0.1:5000:5000 \
            -v /var/run/redis/redis.sock:/tmp/redis.sock \
            -v $DIR/keys/:/keys \
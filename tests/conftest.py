@@ -0,0 +1,169 @@
+'''
+Fixtures shared by the tests. A throwaway redis-server is started before
+any tiltbot module is imported because config reads the socket path and
+key files from the environment at import time.
+'''
+import os
+import copy
+import shutil
+import tempfile
+import time
+import subprocess
+import pytest
+
+_tmpdir = None
+_redis_process = None
+
+
+def _redis_server() -> str:
+    path = shutil.which('redis-server')
+    if path is None:
+        try:
+            # redislite ships a redis-server binary
+            import redislite
+            path = redislite.__redis_executable__
+        except ImportError:
+            pass
+    return path
+
+
+def pytest_configure(config):
+    global _tmpdir, _redis_process
+    server = _redis_server()
+    if server is None:
+        raise pytest.UsageError('tests need redis-server on PATH or redislite installed')
+    _tmpdir = tempfile.mkdtemp(prefix='tiltbot-test-')
+    socket = os.path.join(_tmpdir, 'redis.sock')
+    _redis_process = subprocess.Popen(
+        [server, '--port', '0', '--unixsocket', socket, '--save', '', '--appendonly', 'no'],
+        stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        if os.path.exists(socket):
+            break
+        time.sleep(0.05)
+    keys = {'ritoapi.key': 'test', 'tgapi.key': 'test', 'hook.key': 'hook'}
+    for name, value in keys.items():
+        with open(os.path.join(_tmpdir, name), 'w') as f:
+            f.write(value)
+    os.environ.update({
+        'TILTBOT_REDIS_SOCKET': socket,
+        # nothing may reach the real services
+        'TILTBOT_RIOT_API_URL': 'http://127.0.0.1:9/{platform}',
+        'TILTBOT_TELEGRAM_API_URL': 'http://127.0.0.1:9',
+        'TILTBOT_RIOT_KEY_FILE': os.path.join(_tmpdir, 'ritoapi.key'),
+        'TILTBOT_TELEGRAM_KEY_FILE': os.path.join(_tmpdir, 'tgapi.key'),
+        'TILTBOT_HOOK_KEY_FILE': os.path.join(_tmpdir, 'hook.key'),
+        'TILTBOT_CHAMPION_FILE': os.path.join(_tmpdir, 'champion.json'),
+        'TILTBOT_CACHE_STATS_FLUSH_INTERVAL': '0',
+    })
+
+
+def pytest_unconfigure(config):
+    from utils import stop_event_loop_thread
+    stop_event_loop_thread(5)
+    if _redis_process is not None:
+        _redis_process.terminate()
+        _redis_process.wait()
+    if _tmpdir is not None:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def redis():
+    '''
+    Empty redis and process local state before every test
+    '''
+    import localcache
+    import ratelimit
+    from rediscache import get_redis
+    from riotdata import ChampionData
+    client = get_redis()
+    client.flushall()
+    localcache.invalidate_all()
+    ChampionData.invalidate()
+    ratelimit._limiters.clear()
+    return client
+
+
+@pytest.fixture
+def run():
+    '''
+    Run a coroutine on the process event loop like the bot does
+    '''
+    from utils import run_sync
+    return lambda coro: run_sync(coro, 10)
+
+
+@pytest.fixture
+def champions():
+    from riotdata import ChampionData
+    from benchmarks.exampledata import EXAMPLE_CHAMPIONS
+    ChampionData()._upload_table('1', {
+        str(champ_id): {'name': name, 'tags': tags} for champ_id, name, tags in EXAMPLE_CHAMPIONS
+    })
+    ChampionData.invalidate()
+
+
+class FakeRiot:
+    '''
+    Answers RiotApi.get from dicts instead of the network. Missing entries
+    answer 404 like riot does.
+    '''
+
+    def __init__(self):
+        self.summoners = {}
+        self.match_lists = {}
+        self.matches = {}
+        self.active_games = {}
+        self.calls = []
+
+    def add_summoner(self, name, account_id, game_ids=(), region='euw') -> dict:
+        '''
+        Add summoner playing in the given example games, newest first
+        '''
+        from benchmarks.exampledata import load_example_match
+        self.summoners[region, name] = {'name': name, 'accountId': account_id, 'id': f'id-{account_id}'}
+        entries = []
+        for game_id in game_ids:
+            match = self.matches.get((region, game_id))
+            if match is None:
+                match = self.matches[region, game_id] = load_example_match(game_id, seed=game_id)
+            player = match['participantIdentities'][len(entries) % 10]['player']
+            player['summonerName'] = name
+            player['currentAccountId'] = account_id
+            entries.append({'gameId': game_id, 'queue': 420, 'timestamp': match['gameCreation']})
+        self.match_lists[region, account_id] = {'matches': entries}
+        return self.summoners[region, name]
+
+    def count(self, api) -> int:
+        return sum(1 for call in self.calls if call[0] == api)
+
+    async def get(self, api, param):
+        from riotapi import RitoPlsError
+        name = api.__class__.__name__
+        self.calls.append((name, api.region, param))
+        tables = {
+            'SummonerApi': self.summoners,
+            'MatchListApi': self.match_lists,
+            'MatchApi': self.matches,
+            'SpectatorApi': self.active_games,
+        }
+        key = int(param) if name == 'MatchApi' else param
+        value = tables[name].get((api.region, key))
+        if value is None:
+            raise RitoPlsError(f'{name} has no {param}', 404)
+        if isinstance(value, Exception):
+            raise value
+        return copy.deepcopy(value)
+
+
+@pytest.fixture
+def riot(monkeypatch, champions):
+    import riotapi
+    fake = FakeRiot()
+
+    async def get(api, param):
+        return await fake.get(api, param)
+
+    monkeypatch.setattr(riotapi.RiotApi, 'get_async', get)
+    return fake
@@ -0,0 +1,173 @@
+import time
+import asyncio
+import pytest
+import config
+from analytics import GameAnalyzer, gather_last_results
+from riotapi import RitoPlsError
+
+
+def test_permanent_failures_are_cached_with_status(riot):
+    for _ in range(2):
+        with pytest.raises(RitoPlsError) as error:
+            GameAnalyzer('Nobody').get_last_result()
+        assert error.value.status_code == 404
+    assert riot.count('SummonerApi') == 1
+
+
+def test_temporary_failures_are_not_cached(riot):
+    riot.summoners['euw', 'Flaky'] = RitoPlsError('unavailable', 503)
+    for _ in range(2):
+        with pytest.raises(RitoPlsError):
+            GameAnalyzer('Flaky').get_last_result()
+    assert riot.count('SummonerApi') == 2
+
+
+def test_missing_match_is_cached_briefly(riot, redis):
+    riot.add_summoner('Player', 'acc', [1])
+    riot.add_summoner('Player', 'acc', [2, 1])
+    del riot.matches['euw', 2]
+    with pytest.raises(RitoPlsError):
+        GameAnalyzer('Player').get_last_result()
+    assert 0 < redis.ttl('matches_euw_2') <= config.NEGATIVE_TTL_MATCH <= 60
+
+
+def test_old_match_list_is_fetched_again_for_own_lookup(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    analyzer = GameAnalyzer('Player')
+    assert analyzer.get_game_ids() == [1]
+    assert analyzer.get_game_ids(fresh=True) == [1]
+    assert riot.count('MatchListApi') == 1
+    run(analyzer.analyzer.match_lists.set_many({'acc': {'fetched': time.time() - 3600, 'matches': []}}))
+    assert analyzer.get_game_ids() == []
+    assert analyzer.get_game_ids(fresh=True) == [1]
+    assert riot.count('MatchListApi') == 2
+
+
+def test_newer_game_invalidates_match_lists_of_participants(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    riot.add_summoner('Other', 'other', [2])
+    other = GameAnalyzer('Other')
+    assert other.get_game_ids() == [2]
+    # Player finished game 2 with Other, their cached list does not have it yet
+    match = riot.matches['euw', 2]
+    match['gameCreation'] = riot.matches['euw', 1]['gameCreation'] + 1
+    match['participantIdentities'][5]['player'].update(summonerName='Player', currentAccountId='acc')
+    GameAnalyzer('Player').get_game_ids()
+    assert list(run(other.analyzer.match_lists.peek_many(['acc']))) == ['acc']
+    GameAnalyzer('Player').get_match(2)
+    assert run(other.analyzer.match_lists.peek_many(['acc'])) == {}
+
+
+def test_result_is_cached_by_latest_game(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    first = GameAnalyzer('Player').get_last_result()
+    assert GameAnalyzer('Player').get_last_result() == first
+    assert riot.count('MatchApi') == 1
+    analyzer = GameAnalyzer('Player').analyzer
+    assert list(run(analyzer.results.peek_many([analyzer.result_key(1)]))) == [analyzer.result_key(1)]
+
+
+def test_new_game_is_analyzed(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    analyzer = GameAnalyzer('Player')
+    analyzer.get_last_result()
+    riot.add_summoner('Player', 'acc', [2, 1])
+    run(analyzer.analyzer.match_lists.invalidate('acc'))
+    analyzer.get_last_result()
+    assert [call[2] for call in riot.calls if call[0] == 'MatchApi'] == [1, 2]
+
+
+def test_unavailable_newest_game_is_not_replaced_by_older_one(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    riot.add_summoner('Player', 'acc', [2, 1])
+    match = riot.matches['euw', 2]
+    riot.matches['euw', 2] = RitoPlsError('unavailable', 503)
+    with pytest.raises(RitoPlsError):
+        GameAnalyzer('Player').get_last_result()
+    riot.matches['euw', 2] = match
+    result = GameAnalyzer('Player').get_last_result()
+    assert [call[2] for call in riot.calls if call[0] == 'MatchApi'] == [2, 2]
+    analyzer = GameAnalyzer('Player').analyzer
+    assert run(analyzer.results.peek_many([analyzer.result_key(2)])) == {analyzer.result_key(2): result}
+
+
+def test_rendered_reply(riot):
+    riot.add_summoner('Player', 'acc', [1])
+    reply = GameAnalyzer('Player').analyze_last_game()
+    assert 'Player' in reply
+    assert str(GameAnalyzer('Player').get_last_result()['temp']) in reply
+
+
+def test_history_scores_are_memoized(riot, run):
+    riot.add_summoner('Player', 'acc', [2, 1])
+    analyzer = GameAnalyzer('Player')
+    history = analyzer.analyze_history(5)
+    assert [result['gameId'] for result in history] == [2, 1]
+    riot.add_summoner('Player', 'acc', [3, 2, 1])
+    run(analyzer.analyzer.match_lists.invalidate('acc'))
+    history = analyzer.analyze_history(5)
+    assert [result['gameId'] for result in history] == [3, 2, 1]
+    assert sorted(call[2] for call in riot.calls if call[0] == 'MatchApi') == [1, 2, 3]
+
+
+def test_renamed_summoner_is_found_by_account(riot):
+    riot.add_summoner('Old Name', 'acc', [2, 1])
+    riot.summoners['euw', 'New Name'] = {'name': 'New Name', 'accountId': 'acc', 'id': 'id-acc'}
+    analyzer = GameAnalyzer('New Name')
+    assert [result['gameId'] for result in analyzer.analyze_history(5)] == [2, 1]
+    assert analyzer.get_last_result()['temp']
+
+
+def test_games_without_the_summoner_are_skipped(riot):
+    riot.add_summoner('Player', 'acc', [2, 1])
+    for identity in riot.matches['euw', 2]['participantIdentities']:
+        if identity['player']['currentAccountId'] == 'acc':
+            identity['player'].update(summonerName='Someone', currentAccountId='someone')
+    assert [result['gameId'] for result in GameAnalyzer('Player').analyze_history(5)] == [1]
+
+
+def slow_lookups(riot, run, names, concurrency=None):
+    '''
+    Look up last results of names with slow riot answers. Returns
+    (results, most riot requests in flight at once).
+    '''
+    in_flight = []
+    get = riot.get
+
+    async def slow_get(api, param):
+        in_flight.append(1)
+        await asyncio.sleep(0.05)
+        try:
+            return await get(api, param)
+        finally:
+            in_flight.pop()
+
+    riot.get = slow_get
+    peak = []
+
+    async def watch():
+        while len(peak) < 20:
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+
+    async def lookup():
+        return (await asyncio.gather(gather_last_results(names, concurrency=concurrency), watch()))[0]
+
+    return run(lookup()), max(peak)
+
+
+def test_last_results_are_looked_up_concurrently(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    riot.add_summoner('Other', 'other', [2])
+    results, peak = slow_lookups(riot, run, ['Player', 'Other', 'Nobody'])
+    assert [isinstance(result, RitoPlsError) for result in results] == [False, False, True]
+    assert peak == 3
+
+
+def test_concurrent_lookups_are_bounded(riot, run):
+    names = [f'Player {index}' for index in range(5)]
+    for index, name in enumerate(names):
+        riot.add_summoner(name, f'acc{index}', [index])
+    results, peak = slow_lookups(riot, run, names, concurrency=2)
+    assert not [result for result in results if isinstance(result, Exception)]
+    assert peak == 2
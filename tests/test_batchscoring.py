@@ -0,0 +1,52 @@
+import pytest
+from analytics import PlayerAnalyzer
+from batchscoring import MatchBatch, score_summoners
+from matchrecord import project_match, SUMMONER_NAME, ACCOUNT_ID
+from benchmarks.exampledata import load_example_match, EXAMPLE_CHAMPIONS
+
+
+@pytest.fixture
+def records():
+    return [project_match(load_example_match(game_id, seed=game_id)) for game_id in range(30)]
+
+
+@pytest.fixture
+def champion_table():
+    table = {champ_id: {'name': name, 'tags': tags} for champ_id, name, tags in EXAMPLE_CHAMPIONS}
+    # unknown champions are scored too
+    table.pop(EXAMPLE_CHAMPIONS[-1][0])
+    return table
+
+
+def test_batch_matches_scalar_scores(records, champion_table):
+    expected = [
+        (result['score'], result['temp'])
+        for result in (
+            PlayerAnalyzer(row[SUMMONER_NAME], record, champion_table).score()
+            for record in records for row in record['participants'])
+    ]
+    batch = MatchBatch(records, champion_table)
+    scores = batch.scores()
+    temps = batch.temperatures(scores)
+    assert list(zip(scores[batch.valid].tolist(), temps[batch.valid].tolist())) == expected
+
+
+def test_score_summoners(records, champion_table):
+    names = [record['participants'][3][SUMMONER_NAME] for record in records]
+    scores, temps = score_summoners(records, champion_table, names)
+    for record, name, score, temp in zip(records, names, scores, temps):
+        result = PlayerAnalyzer(name, record, champion_table).score()
+        assert (score, temp) == (result['score'], result['temp'])
+
+
+def test_renamed_summoner_is_found_by_account(records, champion_table):
+    account_ids = [record['participants'][3][ACCOUNT_ID] for record in records]
+    names = ['New Name'] * len(records)
+    scores, temps = score_summoners(records, champion_table, names, account_ids)
+    for record, account_id, score, temp in zip(records, account_ids, scores, temps):
+        result = PlayerAnalyzer('New Name', record, champion_table, account_id).score()
+        assert (score, temp) == (result['score'], result['temp'])
+
+def test_missing_summoner(records, champion_table):
+    with pytest.raises(ValueError):
+        score_summoners(records[:1], champion_table, ['Nobody'])
@@ -0,0 +1,42 @@
+import json
+from benchmarks.e2e import StubState, StubHandler, percentile, compare
+from benchmarks.exampledata import load_example_match
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 51
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_stub_rate_limit():
+    state = StubState()
+    state.reset(rate_limit=(2, 60))
+    assert [state.take_riot_call()[0] for _ in range(3)] == [True, True, False]
+    assert state.throttled == 1
+
+
+def test_stub_summoners_have_their_games():
+    games = StubHandler._game_ids('Bench Summoner 1')
+    assert games == sorted(games, reverse=True)
+    assert StubHandler._game_ids('Bench Summoner 1') == games
+
+
+def test_example_match_is_deterministic():
+    match = load_example_match(7, seed=7)
+    assert match['gameId'] == 7
+    assert len(match['participants']) == len(match['participantIdentities']) == 10
+    assert load_example_match(7, seed=7) == match
+
+
+def test_compare(tmp_path, capsys):
+    def write(name, commit, p50):
+        path = tmp_path / name
+        path.write_text(json.dumps({'commit': commit, 'scenarios': {'cold': {'p50_ms': p50}}}))
+        return str(path)
+
+    compare(write('old.json', 'aaa', 200), write('new.json', 'bbb', 100))
+    output = capsys.readouterr().out
+    assert 'aaa -> bbb' in output
+    assert '-50.0%' in output
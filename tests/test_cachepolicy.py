@@ -0,0 +1,135 @@
+import time
+import threading
+import pytest
+import config
+from cachepolicy import (
+    FOREVER_MS, USAGE_KEY, STATS_KEY, SET_SCRIPT, CacheStats, get_policy, trim_expired, adopt_existing, cache_report, render_report)
+from rediscache import RedisCache
+from tgapi import build_command_delegator
+from tgsender import get_outbox
+
+
+def make_cache(prefix='acct_', **kwargs):
+    async def get_value(key):
+        return f'value of {key}'
+
+    return RedisCache(prefix, get_value, **kwargs)
+
+
+def usage(redis, namespace='acct'):
+    return int(redis.hget(USAGE_KEY, namespace) or 0)
+
+
+def test_set_accounts_size_and_expiry(redis, run):
+    cache = make_cache(expire_time=60)
+    run(cache.set_many({'a': 'x' * 10}))
+    policy = cache.policy
+    size = len('acct_a') + len(redis.get('acct_a'))
+    assert int(redis.hget(policy.sizes_key, 'acct_a')) == size
+    assert usage(redis) == size
+    assert abs(redis.zscore(policy.index_key, 'acct_a') - (time.time() + 60) * 1000) < 5000
+    # overwriting accounts the difference only
+    run(cache.set_many({'a': 'x'}))
+    assert usage(redis) == len('acct_a') + len(redis.get('acct_a'))
+
+
+def test_keys_without_ttl_are_evicted_last(redis, run):
+    cache = make_cache()
+    run(cache.set_many({'a': 'x'}))
+    assert redis.ttl('acct_a') is None
+    assert redis.zscore(cache.policy.index_key, 'acct_a') >= FOREVER_MS
+
+
+def test_invalidate_frees_usage(redis, run):
+    cache = make_cache(expire_time=60)
+    run(cache.set_many({'a': 'x', 'b': 'y'}))
+    run(cache.invalidate('a'))
+    assert usage(redis) == len('acct_b') + len(redis.get('acct_b'))
+    assert redis.zrange(cache.policy.index_key, 0, -1) == [b'acct_b']
+
+
+def test_over_budget_evicts_keys_expiring_soonest(redis, run, monkeypatch):
+    cache = make_cache()
+    policy = cache.policy
+    for index in range(10):
+        keys, args = policy.set_call(f'acct_{index}', 'x' * 94, 60 + index)
+        redis.eval(SET_SCRIPT, len(keys), *(keys + args))
+    assert usage(redis) == 1000
+    monkeypatch.setattr(policy, 'max_bytes', 1000)
+    cache.expire_time = 100
+    run(cache.set_many({'new': 'x' * 92}))
+    assert usage(redis) <= policy.max_bytes * policy.low_watermark
+    assert not redis.exists('acct_0') and not redis.exists('acct_1')
+    assert redis.exists('acct_9') and redis.exists('acct_new')
+
+
+def test_trim_expired_drops_accounting(redis):
+    policy = get_policy('acct_')
+    keys, args = policy.set_call('acct_short', 'x', 0.05)
+    redis.eval(SET_SCRIPT, len(keys), *(keys + args))
+    keys, args = policy.set_call('acct_long', 'x', 60)
+    redis.eval(SET_SCRIPT, len(keys), *(keys + args))
+    time.sleep(0.1)
+    trim_expired(redis, ['acct'])
+    assert redis.zrange(policy.index_key, 0, -1) == [b'acct_long']
+    assert usage(redis) == len('acct_long') + 1
+
+
+def test_adopt_existing_keys(redis, monkeypatch):
+    policy = get_policy('acct_')
+    monkeypatch.setattr(policy, 'ttl', 60)
+    redis.set('acct_old', 'value')
+    redis.set('acct_expiring', 'value', ex=10)
+    redis.hset('acct_hash', 'field', 'value')
+    adopt_existing(redis, ['acct'])
+    assert 0 < redis.ttl('acct_old') <= 60
+    assert 0 < redis.ttl('acct_expiring') <= 10
+    assert usage(redis) == len('acct_old') + len('acct_expiring') + 2 * len('value')
+    # adopting again does not count twice
+    adopt_existing(redis, ['acct'])
+    assert usage(redis) == len('acct_old') + len('acct_expiring') + 2 * len('value')
+
+
+def test_cache_report(redis, run):
+    cache = make_cache(expire_time=60)
+    run(cache.get('a'))
+    run(cache.get('a'))
+    cache.stats.flush()
+    [row] = [row for row in cache_report(redis) if row['namespace'] == 'acct']
+    assert row['keys'] == 1 and row['bytes'] == usage(redis)
+    assert (row['hits'], row['misses'], row['hit_rate']) == (1, 1, 0.5)
+    rendered = render_report([row], {'used_memory_human': '1M', 'keyspace_hits': 3, 'keyspace_misses': 1})
+    assert rendered.splitlines()[1].split() == ['acct', '1', str(row['bytes']), '-', '-', '50']
+    assert 'redis: 1M used, 75% keyspace hits' in rendered
+
+
+def test_stats_are_flushed_off_the_recording_thread(redis):
+    threads = []
+
+    class RecordingRedis:
+        def pipeline(self, **kwargs):
+            threads.append(threading.current_thread().name)
+            return redis.pipeline(**kwargs)
+
+    stats = CacheStats(RecordingRedis(), flush_interval=0)
+    stats.record('acct', 'hit')
+    for _ in range(100):
+        if not stats._flushing:
+            break
+        time.sleep(0.01)
+    assert threads == ['cache-stats-flush']
+    assert redis.hgetall(STATS_KEY) == {b'acct:hit': b'1'}
+
+
+@pytest.mark.parametrize('admin', [True, False])
+def test_cache_command_is_for_admins(run, monkeypatch, admin):
+    monkeypatch.setattr(config, 'ADMIN_CHAT_IDS', {1} if admin else set())
+    run(make_cache(expire_time=60).get('a'))
+    build_command_delegator().delegate_update({'update_id': 1, 'message': {
+        'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 1}, 'text': '/cache'}})
+    replies = [message['text'] for message in get_outbox().peek(1, 10)]
+    if admin:
+        [reply] = replies
+        assert 'acct' in reply and 'redis:' in reply
+    else:
+        assert replies == []
@@ -0,0 +1,61 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from httpclient import HttpClient, get_async_session
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ports = []
+
+    def do_GET(self):
+        Handler.ports.append(self.client_address[1])
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.ports = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def test_session_per_host():
+    client = HttpClient()
+    assert client.session('https://a.example/x') is client.session('https://a.example/y')
+    assert client.session('https://a.example/x') is not client.session('https://b.example/x')
+
+
+def test_pool_size_per_host():
+    client = HttpClient(pool_size=3)
+    client.set_pool_size('b.example', 7)
+    assert client.session('https://a.example/').get_adapter('https://a.example/')._pool_maxsize == 3
+    assert client.session('https://b.example/').get_adapter('https://b.example/')._pool_maxsize == 7
+
+
+def test_connections_are_reused(server):
+    client = HttpClient()
+    for _ in range(3):
+        assert client.get(f'{server}/').text == 'ok'
+    client.close()
+    # every request came through the same connection
+    assert len(set(Handler.ports)) == 1
+
+
+def test_async_session_per_host(run):
+    async def sessions():
+        return (get_async_session('https://euw1.example/a'), get_async_session('https://euw1.example/b'),
+                get_async_session('https://kr.example/a'))
+
+    euw, euw_again, kr = run(sessions())
+    assert euw is euw_again
+    assert euw is not kr
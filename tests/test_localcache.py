@@ -0,0 +1,48 @@
+import time
+from localcache import LocalCache, MISSING
+from rediscache import RedisCache
+from riotdata import RiotData
+
+
+def test_least_recently_used_is_evicted():
+    cache = LocalCache('test', max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_values_expire():
+    cache = LocalCache('test', ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a', None) is None
+
+
+def test_redis_cache_serves_local_tier(run, redis):
+    async def get_value(key):
+        return key
+
+    cache = RedisCache('localtest_', get_value, local_ttl=60)
+    assert run(cache.get('a')) == 'a'
+    redis.delete('localtest_a')
+    assert cache.local.get('a') == 'a'
+    run(cache.invalidate('a'))
+    assert cache.local.get('a') is MISSING
+
+
+class LocalData(RiotData):
+    redis_prefix = 'local_data'
+    local_ttl = 60
+
+
+def test_riot_data_preload(redis):
+    LocalData()._upload_data({'a': 1, 'b': 2})
+    assert LocalData.preload() == 2
+    redis.flushall()
+    assert LocalData()['a'] == 1
+    LocalData.invalidate()
+    assert LocalData().get('a') is None
@@ -0,0 +1,50 @@
+import pytest
+import matchrecord as mr
+from analytics import GameAnalyzer
+from benchmarks.exampledata import load_example_match
+
+
+def test_project_match():
+    match = load_example_match(1)
+    record = mr.project_match(match)
+    assert record['v'] == mr.MATCH_RECORD_VERSION
+    assert record['gameId'] == 1
+    assert len(record['participants']) == 10
+    row = record['participants'][0]
+    assert len(row) == len(mr.PARTICIPANT_FIELDS)
+    assert row[mr.KILLS] == match['participants'][0]['stats']['kills']
+    assert mr.champion_ids(record) == {p['championId'] for p in match['participants']}
+
+
+def test_to_record():
+    match = load_example_match(1)
+    record = mr.project_match(match)
+    assert mr.to_record(record) is record
+    assert mr.to_record(match) == record
+    with pytest.raises(ValueError):
+        mr.to_record({'v': mr.MATCH_RECORD_VERSION + 1, 'gameId': 1})
+
+
+def test_only_projected_record_is_cached(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    analyzer = GameAnalyzer('Player')
+    analyzer.get_match(1)
+    assert run(analyzer.analyzer.matches.peek_many([1]))[1]['v'] == mr.MATCH_RECORD_VERSION
+
+
+def test_full_payload_is_replaced_by_record(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    analyzer = GameAnalyzer('Player').analyzer
+    run(analyzer.matches.set_many({1: riot.matches['euw', 1]}))
+    assert run(analyzer.get_match(1))['v'] == mr.MATCH_RECORD_VERSION
+    assert run(analyzer.matches.peek_many([1]))[1]['v'] == mr.MATCH_RECORD_VERSION
+    assert riot.count('MatchApi') == 0
+
+
+def test_unknown_version_is_fetched_again(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    analyzer = GameAnalyzer('Player').analyzer
+    run(analyzer.matches.set_many({1: {'v': mr.MATCH_RECORD_VERSION + 1, 'gameId': 1}}))
+    assert run(analyzer.get_match(1))['v'] == mr.MATCH_RECORD_VERSION
+    assert run(analyzer.matches.peek_many([1]))[1]['v'] == mr.MATCH_RECORD_VERSION
+    assert riot.count('MatchApi') == 1
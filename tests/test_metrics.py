@@ -0,0 +1,117 @@
+import os
+import asyncio
+import pstats
+import pytest
+import config
+from metrics import Metrics, metrics, sampled_coroutine_profile
+from rediscache import RedisCache
+
+
+def test_render():
+    registry = Metrics(buckets=(0.1, 1))
+    registry.inc('requests_total', result='hit')
+    registry.inc('requests_total', value=2, result='miss')
+    registry.observe('request_seconds', 0.5)
+    registry.register_collector(lambda: [('queue_length', {}, 3)])
+    worker = f'worker="{os.getpid()}"'
+    assert registry.render().splitlines() == [
+        '# TYPE requests_total counter',
+        f'requests_total{{result="hit",{worker}}} 1',
+        f'requests_total{{result="miss",{worker}}} 2',
+        '# TYPE request_seconds histogram',
+        f'request_seconds_bucket{{{worker},le="0.1"}} 0',
+        f'request_seconds_bucket{{{worker},le="1"}} 1',
+        f'request_seconds_bucket{{{worker},le="+Inf"}} 1',
+        f'request_seconds_count{{{worker}}} 1',
+        f'request_seconds_sum{{{worker}}} 0.5',
+        '# TYPE queue_length gauge',
+        f'queue_length{{{worker}}} 3',
+    ]
+
+
+def test_gauges_of_one_metric_are_grouped():
+    registry = Metrics()
+    registry.register_collector(lambda: [('keys', {'ns': 'a'}, 1), ('bytes', {'ns': 'a'}, 2), ('keys', {'ns': 'b'}, 3)])
+    lines = registry.render().splitlines()
+    assert lines.count('# TYPE keys gauge') == 1
+    assert lines.index('# TYPE keys gauge') == lines.index(f'keys{{ns="a",worker="{os.getpid()}"}} 1') - 1
+
+
+def test_failing_collector_does_not_break_render():
+    registry = Metrics()
+    registry.inc('ok_total')
+
+    def fail():
+        raise RuntimeError('broken')
+
+    registry.register_collector(fail)
+    assert 'ok_total' in registry.render()
+
+
+def test_disabled():
+    registry = Metrics(enabled=False)
+    registry.inc('requests_total')
+    with registry.timer('request_seconds'):
+        pass
+    assert registry.render() == '\n'
+
+
+def test_cache_reads_are_timed(run):
+    async def get_value(key):
+        return key
+
+    run(RedisCache('timed_', get_value).get('a'))
+    assert 'tiltbot_cache_get_seconds_count{prefix="timed_"' in metrics.render()
+
+
+def test_metrics_endpoint():
+    from tgbot import create_app
+    response = create_app(start_services=False).test_client().get('/tgbot/metrics')
+    assert response.status_code == 200
+    assert b'# TYPE tiltbot_update_queue_length gauge' in response.data
+
+
+def profiled_work():
+    return sum(range(1000))
+
+
+def other_work():
+    return sum(range(1000))
+
+
+def test_coroutine_profile_covers_only_the_coroutine(run, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'PROFILE_SAMPLE_RATE', 1)
+    monkeypatch.setattr(config, 'PROFILE_DIR', str(tmp_path))
+
+    async def lookup():
+        for _ in range(3):
+            profiled_work()
+            await asyncio.sleep(0.01)
+        return 'done'
+
+    async def other():
+        for _ in range(3):
+            other_work()
+            await asyncio.sleep(0.01)
+
+    async def both():
+        return await asyncio.gather(sampled_coroutine_profile('lookup', lookup()), other())
+
+    assert run(both())[0] == 'done'
+    [dump] = os.listdir(str(tmp_path))
+    assert dump.startswith('lookup-')
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / dump)).stats}
+    assert 'profiled_work' in functions and 'other_work' not in functions
+
+
+def test_coroutine_profile_passes_errors(run, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'PROFILE_SAMPLE_RATE', 1)
+    monkeypatch.setattr(config, 'PROFILE_DIR', str(tmp_path))
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        run(sampled_coroutine_profile('lookup', failing()))
+    assert len(os.listdir(str(tmp_path))) == 1
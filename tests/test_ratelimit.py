@@ -0,0 +1,55 @@
+import pytest
+from ratelimit import RateLimiter, RateLimitExceeded, parse_rate_header
+
+
+def test_parse_rate_header():
+    assert parse_rate_header('20:1,100:120') == [(20, 1), (100, 120)]
+    assert parse_rate_header('') == []
+    assert parse_rate_header(None) == []
+
+
+def test_bucket_runs_out_of_tokens(run):
+    # safety factor 0.9 leaves 2 of 3 requests
+    limiter = RateLimiter({'s': '3:10'})
+    assert run(limiter.try_acquire(['s'])) == 0
+    assert run(limiter.try_acquire(['s'])) == 0
+    wait = run(limiter.try_acquire(['s']))
+    assert 0 < wait <= 5
+
+
+def test_tokens_are_taken_from_all_scopes_or_none(run, redis):
+    limiter = RateLimiter({'app': '1:10', 'method': '5:10'})
+    assert run(limiter.try_acquire(['app', 'method'])) == 0
+    tokens = float(redis.hget(limiter._bucket_key('method', 10), 'tokens'))
+    assert run(limiter.try_acquire(['app', 'method'])) > 0
+    assert float(redis.hget(limiter._bucket_key('method', 10), 'tokens')) == tokens
+
+
+def test_buckets_are_shared_between_limiters(run):
+    first = RateLimiter({'s': '2:10'})
+    second = RateLimiter({'s': '2:10'})
+    assert run(first.try_acquire(['s'])) == 0
+    assert run(second.try_acquire(['s'])) > 0
+
+
+def test_update_learns_limits_and_usage(run):
+    limiter = RateLimiter()
+    run(limiter.update('s', '10:10', '9:10'))
+    assert run(RateLimiter().get_limits('s')) == [(10, 10)]
+    # riot counted 9 requests, our 90% budget is used up
+    assert run(limiter.try_acquire(['s'])) > 0
+
+
+def test_block_and_exponential_backoff(run):
+    limiter = RateLimiter({'s': '100:1'})
+    assert run(limiter.block('s', 2)) == 2
+    assert 1 < run(limiter.try_acquire(['s'])) <= 2
+    assert run(limiter.block('t')) == 1
+    assert run(limiter.block('t')) == 2
+
+
+def test_acquire_does_not_wait_past_max_wait(run):
+    limiter = RateLimiter({'s': '100:1'})
+    run(limiter.block('s', 5))
+    with pytest.raises(RateLimitExceeded):
+        run(limiter.acquire(['s'], 1))
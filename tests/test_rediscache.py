@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from rediscache import RedisCache, get_redis
+from riotdata import RiotData
+
+
+def make_cache(prefix='test_', values=None, **kwargs):
+    calls = []
+    values = values if values is not None else {}
+
+    async def get_value(key):
+        calls.append(key)
+        return values[key]
+
+    return RedisCache(prefix, get_value, **kwargs), calls
+
+
+def test_clients_share_connection_pool():
+    assert get_redis().connection_pool is get_redis().connection_pool
+    assert get_redis(1).connection_pool is not get_redis().connection_pool
+
+
+def test_get_caches_fetched_value(run):
+    cache, calls = make_cache(values={'a': {'x': 1}})
+    assert run(cache.get('a')) == {'x': 1}
+    assert run(cache.get('a')) == {'x': 1}
+    assert calls == ['a']
+
+
+def test_blocking_get_for_threads():
+    cache, calls = make_cache(values={'a': 1})
+    assert cache['a'] == 1
+    assert cache['a'] == 1
+    assert calls == ['a']
+
+
+def test_get_many_fetches_only_missing_keys(run):
+    cache, calls = make_cache(values={'a': 1, 'b': 2, 'c': 3})
+    run(cache.set_many({'a': 10}))
+    assert run(cache.get_many(['a', 'b', 'c'])) == {'a': 10, 'b': 2, 'c': 3}
+    assert sorted(calls) == ['b', 'c']
+
+
+def test_peek_many_does_not_fetch(run):
+    cache, calls = make_cache(values={'a': 1, 'b': 2})
+    run(cache.set_many({'a': 1}))
+    assert run(cache.peek_many(['a', 'b'])) == {'a': 1}
+    assert calls == []
+
+
+def test_riot_data_get_many_maps_missing_keys_to_default():
+    data = RiotData()
+    data._upload_data({'a': [1], 'b': [2]})
+    assert data.get_many(['a', 'b', 'c'], default='-') == {'a': [1], 'b': [2], 'c': '-'}
+    assert data['a'] == [1]
+
+
+def test_concurrent_misses_fetch_once(run):
+    calls = []
+
+    async def get_value(key):
+        calls.append(key)
+        await asyncio.sleep(0.1)
+        return key.upper()
+
+    cache = RedisCache('test_', get_value)
+
+    async def get_all():
+        return await asyncio.gather(*[cache.get('a') for _ in range(5)])
+
+    assert run(get_all()) == ['A'] * 5
+    assert calls == ['a']
+
+
+def test_waits_for_fetch_of_another_process(run, redis):
+    cache, calls = make_cache(values={'a': 'mine'})
+    redis.set('lock_test_a', 'other')
+
+    async def other_process():
+        await asyncio.sleep(0.1)
+        await cache.set_many({'a': 'theirs'})
+
+    async def get():
+        return (await asyncio.gather(cache.get('a'), other_process()))[0]
+
+    assert run(get()) == 'theirs'
+    assert calls == []
+
+
+def test_lock_is_released_after_failed_fetch(run, redis):
+    cache, calls = make_cache(values={})
+    with pytest.raises(KeyError):
+        run(cache.get('a'))
+    assert redis.get('lock_test_a') is None
@@ -0,0 +1,86 @@
+import json
+import pytest
+import config
+from riotapi import (
+    SummonerApi, MatchListApi, RitoPlsError, RateLimitedError, UnknownRegionError, check_region)
+
+
+def test_check_region():
+    assert check_region() == config.DEFAULT_REGION
+    assert check_region('KR') == 'kr'
+    with pytest.raises(UnknownRegionError):
+        check_region('mars')
+
+
+def test_regions_have_own_hosts_and_scopes():
+    euw, kr = SummonerApi('euw'), SummonerApi('kr')
+    assert 'euw1' in euw.api_url and 'kr' in kr.api_url
+    assert euw.app_scope != kr.app_scope
+    assert euw.method_scope != MatchListApi('euw').method_scope
+
+
+def test_rate_limit_of_one_region_does_not_block_another(run):
+    euw, kr = SummonerApi('euw'), SummonerApi('kr')
+    run(euw.rate_limiter.block(euw.app_scope, 5))
+    assert run(euw.rate_limiter.try_acquire([euw.app_scope])) > 0
+    assert run(kr.rate_limiter.try_acquire([kr.app_scope])) == 0
+
+
+def replay(monkeypatch, api, responses):
+    '''
+    Answer _request with given (status, headers, body) responses
+    '''
+    requests = []
+
+    async def request(main_param):
+        requests.append(main_param)
+        status, headers, body = responses.pop(0)
+        return status, headers, json.dumps(body).encode('utf-8')
+
+    monkeypatch.setattr(api, '_request', request)
+    return requests
+
+
+def test_429_blocks_scope_and_retries(run, monkeypatch):
+    api = SummonerApi('kr')
+    headers = {'X-Rate-Limit-Type': 'application', 'Retry-After': '3'}
+    requests = replay(monkeypatch, api, [(429, headers, {}), (200, {}, {'name': 'Player'})])
+    assert api.get('Player') == {'name': 'Player'}
+    assert requests == ['Player', 'Player']
+    assert run(api.rate_limiter.try_acquire([api.app_scope])) > 2
+    assert run(api.rate_limiter.try_acquire([SummonerApi('euw').app_scope])) == 0
+
+
+def test_gives_up_after_max_retries(run, monkeypatch):
+    api = SummonerApi('kr')
+    api.max_rate_limit_retries = 2
+    replay(monkeypatch, api, [(429, {'Retry-After': '0'}, {})] * 2)
+    with pytest.raises(RateLimitedError):
+        run(api.get_async('Player'))
+
+
+def test_errors_keep_status_code(run, monkeypatch):
+    api = SummonerApi('euw')
+    replay(monkeypatch, api, [(404, {}, {}), (503, {}, {})])
+    with pytest.raises(RitoPlsError) as not_found:
+        run(api.get_async('Nobody'))
+    with pytest.raises(RitoPlsError) as unavailable:
+        run(api.get_async('Nobody'))
+    assert not_found.value.status_code == 404 and not_found.value.permanent
+    assert unavailable.value.status_code == 503 and not unavailable.value.permanent
+
+
+def test_match_list_is_slimmed(run, monkeypatch):
+    api = MatchListApi('euw')
+    replay(monkeypatch, api, [(200, {}, {'matches': [
+        {'gameId': 1, 'queue': 420, 'timestamp': 5, 'champion': 1, 'lane': 'MID'}]})])
+    match_list = api.get_game_list('acc')
+    assert match_list['matches'] == [{'gameId': 1, 'queue': 420, 'timestamp': 5}]
+    assert 'fetched' in match_list
+
+
+def test_api_key_is_read_once(monkeypatch):
+    with open(config.RIOT_KEY_FILE) as f:
+        assert SummonerApi('euw').api_token == f.read().strip()
+    monkeypatch.setattr(config, 'RIOT_KEY_FILE', '/nonexistent/ritoapi.key')
+    assert SummonerApi('kr').api_token
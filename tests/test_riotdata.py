@@ -0,0 +1,67 @@
+import os
+import json
+import pytest
+from benchmarks.exampledata import example_champion_file
+from riotdata import ChampionData, ChampionRefresher
+
+
+@pytest.fixture
+def champion_file(tmp_path):
+    path = str(tmp_path / 'champion.json')
+
+    def write(version, names=None):
+        data = example_champion_file()
+        data['version'] = version
+        if names:
+            for champion in data['data'].values():
+                champion['name'] = names.get(champion['key'], champion['name'])
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        return path
+
+    return write
+
+
+def test_load_from_file(champion_file):
+    ChampionData.from_file(champion_file('1.0'))
+    champions = ChampionData()
+    assert champions.current_version() == '1.0'
+    assert champions[245]['name'] == 'Ekko'
+    assert champions.get_many([245, 1]) == {245: {'name': 'Ekko', 'tags': ['Assassin', 'Fighter']}, 1: None}
+
+
+def test_new_version_replaces_table(champion_file, redis, monkeypatch):
+    ChampionData.from_file(champion_file('1.0'))
+    assert ChampionData()[245]['name'] == 'Ekko'
+    monkeypatch.setattr(ChampionData, 'check_interval', 0)
+    ChampionData()._upload_table('2.0', {'245': {'name': 'Ekko 2', 'tags': []}})
+    assert ChampionData()[245]['name'] == 'Ekko 2'
+    assert 0 < redis.ttl(ChampionData.table_key('1.0')) <= ChampionData.old_version_ttl
+    # redis-py answers None for keys without ttl
+    assert redis.ttl(ChampionData.table_key('2.0')) is None
+
+
+def test_process_keeps_table_until_check_interval(champion_file):
+    ChampionData.from_file(champion_file('1.0'))
+    assert ChampionData()[245]['name'] == 'Ekko'
+    # another process switched the version
+    ChampionData()._upload_table('2.0', {'245': {'name': 'Ekko 2', 'tags': []}})
+    assert ChampionData()[245]['name'] == 'Ekko'
+
+
+def test_same_version_is_not_uploaded_again(champion_file, redis):
+    ChampionData.from_file(champion_file('1.0'))
+    redis.hdel(ChampionData.table_key('1.0'), '245')
+    ChampionData.from_file(champion_file('1.0'), force=False)
+    assert not redis.hexists(ChampionData.table_key('1.0'), '245')
+
+
+def test_refresher_reloads_changed_file(champion_file):
+    path = champion_file('1.0')
+    refresher = ChampionRefresher(path)
+    assert refresher.refresh()
+    assert not refresher.refresh()
+    champion_file('1.0', names={'245': 'Renamed Ekko'})
+    os.utime(path, (0, 0))
+    assert refresher.refresh()
+    assert ChampionData()[245]['name'] == 'Renamed Ekko'
@@ -0,0 +1,47 @@
+import pytest
+import serializers
+from cachepolicy import USAGE_KEY
+from rediscache import RedisCache
+from riotdata import RiotData
+
+ITEM = {'name': 'Śtarboy', 'games': [1, 2, 3], 'nested': {'win': True, 'score': 1.5}}
+
+
+@pytest.mark.parametrize('name', sorted(serializers.SERIALIZERS))
+def test_round_trip(name):
+    serializer = serializers.get_serializer(name)
+    data = serializers.dumps(ITEM, serializer)
+    assert serializers.detect(data) is serializer
+    assert serializers.loads(data) == ITEM
+
+
+def test_legacy_values_are_outdated():
+    legacy = serializers.dumps(ITEM, serializers.LEGACY)
+    assert serializers.is_outdated(legacy)
+    assert not serializers.is_outdated(serializers.dumps(ITEM))
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        serializers.get_serializer('pickle')
+
+
+def test_redis_cache_migrates_with_ttl_and_accounting(run, redis):
+    async def get_value(key):
+        raise AssertionError('cached value should be used')
+
+    cache = RedisCache('migrated_', get_value)
+    run(cache.set_many({'a': 'placeholder'}))
+    redis.set('migrated_a', serializers.dumps(ITEM, serializers.LEGACY), px=60000, xx=True)
+    assert run(cache.get('a')) == ITEM
+    raw = redis.get('migrated_a')
+    assert not serializers.is_outdated(raw)
+    assert 50000 < redis.pttl('migrated_a') <= 60000
+    assert int(redis.hget(USAGE_KEY, 'migrated')) == len('migrated_a') + len(raw)
+
+
+def test_riot_data_migrates_in_place(redis):
+    redis.set('riot_data_a', serializers.dumps(ITEM, serializers.LEGACY), ex=60)
+    assert RiotData()['a'] == ITEM
+    assert not serializers.is_outdated(redis.get('riot_data_a'))
+    assert redis.ttl('riot_data_a') > 50
@@ -0,0 +1,52 @@
+import os
+import json
+import time
+import runpy
+import asyncio
+import config
+from benchmarks.exampledata import example_champion_file
+from riotdata import ChampionData
+from tgsender import get_outbox
+from worker import BackgroundServices
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_gunicorn_config():
+    settings = runpy.run_path(os.path.join(ROOT, 'gunicorn.conf.py'))
+    assert settings['wsgi_app'] == 'tgbot:create_app(start_services=False)'
+    assert settings['preload_app']
+    assert settings['graceful_timeout'] > config.SHUTDOWN_TIMEOUT
+
+
+def test_champions_are_loaded_before_fork():
+    from tgbot import create_app
+    with open(config.CHAMPION_FILE, 'w') as f:
+        json.dump(example_champion_file(), f)
+    try:
+        create_app(start_services=False)
+    finally:
+        os.remove(config.CHAMPION_FILE)
+    assert ChampionData().current_version() == '8.13.1'
+    assert ChampionData._tables[0][1]
+
+
+def test_stop_drains_commands_in_progress(riot):
+    riot.add_summoner('Player', 'acc', [1])
+    get = riot.get
+
+    async def slow_get(api, param):
+        await asyncio.sleep(0.2)
+        return await get(api, param)
+
+    riot.get = slow_get
+    services = BackgroundServices(workers=1)
+    services.start()
+    services.pool.queue.enqueue({'update_id': 1, 'message': {
+        'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 7}, 'text': '/temp Player'}})
+    while services.pool.redis.llen(services.pool.queue.queue_key):
+        time.sleep(0.01)
+    services.stop(10)
+    assert services.pool.redis.llen(services.pool.processing_key) == 0
+    [reply] = get_outbox().peek(7, 10)
+    assert 'Player' in reply['text']
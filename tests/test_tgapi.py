@@ -0,0 +1,85 @@
+import pytest
+from chatsettings import ChatSettings
+from tgapi import build_command_delegator
+from tgsender import get_outbox
+
+UPDATE_IDS = iter(range(1, 10 ** 6))
+
+
+@pytest.fixture
+def command(riot):
+    '''
+    Send command text to the bot and return replies queued for the chat
+    '''
+    delegator = build_command_delegator()
+    outbox = get_outbox()
+
+    def command(text, chat_id=1):
+        update = {'update_id': next(UPDATE_IDS), 'message': {
+            'message_id': 1, 'from': {'id': 1}, 'chat': {'id': chat_id}, 'text': text}}
+        pending = delegator.delegate_update(update)
+        if pending is not None:
+            pending.result(10)
+        replies = [message['text'] for message in outbox.peek(chat_id, 100)]
+        outbox.redis.delete(f'{outbox.chat_prefix}{chat_id}')
+        return replies
+
+    return command
+
+
+def test_temp(riot, command):
+    riot.add_summoner('Player', 'acc', [1])
+    [reply] = command('/temp Player')
+    assert 'Player' in reply
+
+
+def test_temp_limits_names(riot, command):
+    names = ', '.join(f'Player {index}' for index in range(ChatSettings.max_roster_size + 1))
+    [reply] = command(f'/temp {names}')
+    assert 'at most' in reply
+    assert riot.calls == []
+
+def test_temp_failure(command):
+    [reply] = command('/temp Nobody')
+    assert 'something went wrong' in reply
+
+
+def test_temp_of_several_summoners(riot, command):
+    riot.add_summoner('Player', 'acc', [1])
+    riot.add_summoner('Other', 'other', [2])
+    [reply] = command('/temp Player, Other, Nobody')
+    assert 'Player' in reply and 'Other' in reply
+    assert 'Could not get games for Nobody' in reply
+    assert riot.count('SummonerApi') == 3
+
+
+def test_temp_of_roster(riot, command):
+    riot.add_summoner('Player', 'acc', [1])
+    riot.add_summoner('Other', 'other', [2])
+    assert command('/roster set Player, Other') == ['Roster: Player, Other']
+    [reply] = command('/temp')
+    assert 'Player' in reply and 'Other' in reply
+
+
+def test_temp_in_region(riot, command):
+    riot.add_summoner('Player', 'acc', [1], region='kr')
+    [reply] = command('/temp kr Player')
+    assert 'Player' in reply
+    assert {call[1] for call in riot.calls} == {'kr'}
+
+
+def test_chat_region(riot, command):
+    riot.add_summoner('Player', 'acc', [1], region='na')
+    assert command('/region') == ['Region: euw']
+    assert command('/region na') == ['Region: na']
+    assert 'Player' in command('/temp Player')[0]
+    assert 'Unknown region mars' in command('/region mars')[0]
+    assert command('/region', chat_id=2) == ['Region: euw']
+
+
+def test_regions_are_cached_separately(riot, command):
+    riot.add_summoner('Player', 'acc', [1], region='euw')
+    riot.add_summoner('Player', 'acc', [2], region='kr')
+    command('/temp Player')
+    command('/temp kr Player')
+    assert sorted((call[1], call[2]) for call in riot.calls if call[0] == 'MatchApi') == [('euw', 1), ('kr', 2)]
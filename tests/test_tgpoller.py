@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import Future
+from tgpoller import UpdatePoller
+
+
+def update(update_id, chat_id):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'from': {'id': 1}, 'chat': {'id': chat_id}, 'text': '/hello'}}
+
+
+def make_poller(handle_update, batches):
+    poller = UpdatePoller(handle_update, workers=4)
+    poller.get_updates = lambda offset: batches.pop(0) if batches else []
+    return poller
+
+
+def test_batch_is_handled_and_offset_committed():
+    handled = []
+    poller = make_poller(lambda item: handled.append(item['update_id']), [[update(3, 1), update(4, 2)]])
+    assert poller.poll_once() == 2
+    assert sorted(handled) == [3, 4]
+    assert poller.get_offset() == 5
+
+
+def test_updates_of_one_chat_keep_their_order():
+    handled = []
+    futures = []
+
+    def handle_update(item):
+        # earlier replies of the chat have to be queued already
+        handled.append((item['update_id'], all(future.done() for future in futures)))
+        future = Future()
+        threading.Timer(0.05, future.set_result, [None]).start()
+        futures.append(future)
+        return future
+
+    poller = make_poller(handle_update, [[update(2, 1), update(1, 1)]])
+    poller.poll_once()
+    assert handled == [(1, True), (2, True)]
+
+
+def test_seen_updates_are_skipped():
+    handled = []
+    poller = make_poller(lambda item: handled.append(item['update_id']), [[update(1, 1), update(2, 1)]])
+    # arrived through the webhook already
+    poller.queue.mark_seen(1)
+    poller.poll_once()
+    assert handled == [2]
+    assert poller.queue.is_seen(2)
+
+
+def test_only_one_poller_holds_the_lock():
+    first = make_poller(None, [])
+    second = make_poller(None, [])
+    assert first._hold_lock()
+    assert first._hold_lock()
+    assert not second._hold_lock()
+    first.stop()
+    assert second._hold_lock()
@@ -0,0 +1,94 @@
+import time
+import pytest
+from tgsender import Outbox, TelegramSender, coalesce, MAX_MESSAGE_LENGTH
+
+
+def message(text, parse_mode='Markdown'):
+    return {'text': text, 'parse_mode': parse_mode, 'queued_at': time.time()}
+
+
+@pytest.fixture
+def outbox():
+    return Outbox()
+
+
+def test_chat_is_leased_to_one_sender(outbox):
+    outbox.enqueue(1, 'a')
+    outbox.enqueue(1, 'b')
+    assert len(outbox) == 1
+    assert outbox.claim(30) == 1
+    assert outbox.claim(30) is None
+    assert [item['text'] for item in outbox.peek(1, 10)] == ['a', 'b']
+
+
+def test_finish_drops_handled_messages(outbox):
+    outbox.enqueue(1, 'a')
+    outbox.enqueue(1, 'b')
+    outbox.claim(30)
+    outbox.finish(1, 1, 0)
+    assert [item['text'] for item in outbox.peek(1, 10)] == ['b']
+    assert outbox.claim(30) == 1
+    outbox.finish(1, 1, 0)
+    assert len(outbox) == 0
+
+
+def test_chat_interval_delays_next_message(outbox):
+    outbox.enqueue(1, 'a')
+    outbox.claim(30)
+    outbox.finish(1, 1, 0, interval=10)
+    outbox.enqueue(1, 'b')
+    assert outbox.claim(30) is None
+    assert outbox.redis.zscore(outbox.schedule_key, 1) > time.time() + 9
+
+
+def test_coalesce():
+    assert coalesce([message('a'), message('b'), message('c', None)]) == ('a\n\nb', 'Markdown', 2)
+    assert coalesce([message('a' * MAX_MESSAGE_LENGTH), message('b')])[2] == 1
+
+
+def test_too_long_message_is_sent_as_plain_text():
+    text, parse_mode, count = coalesce([message('*' + 'a' * MAX_MESSAGE_LENGTH + '*')])
+    assert len(text) == MAX_MESSAGE_LENGTH
+    assert parse_mode is None and count == 1
+
+
+@pytest.fixture
+def sender(outbox, monkeypatch):
+    sender = TelegramSender(threads=0, outbox=outbox)
+    sender.answers = []
+    sender.posted = []
+
+    def post(chat_id, text, parse_mode):
+        sender.posted.append((chat_id, text))
+        return sender.answers.pop(0) if sender.answers else None
+
+    monkeypatch.setattr(sender, '_post', post)
+    return sender
+
+
+def test_burst_is_sent_as_one_message(sender, outbox):
+    outbox.enqueue(1, 'a')
+    outbox.enqueue(1, 'b')
+    assert sender.send_next()
+    assert sender.posted == [(1, 'a\n\nb')]
+    assert outbox.peek(1, 10) == []
+    assert not sender.send_next()
+
+
+def test_retry_after_keeps_messages(sender, outbox):
+    outbox.enqueue(1, 'a')
+    sender.answers = [5]
+    sender.send_next()
+    assert [item['text'] for item in outbox.peek(1, 10)] == ['a']
+    assert sender._attempts == {1: 1}
+    assert outbox.redis.zscore(outbox.schedule_key, 1) > time.time() + 4
+
+
+def test_messages_are_dropped_after_max_attempts(sender, outbox):
+    sender.max_attempts = 2
+    outbox.enqueue(1, 'a')
+    sender.answers = [0, 0]
+    sender.send_next()
+    sender.send_next()
+    assert outbox.peek(1, 10) == []
+    assert sender._attempts == {}
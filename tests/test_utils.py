@@ -0,0 +1,73 @@
+import os
+import time
+import asyncio
+import pytest
+import utils
+from riotapi import SummonerApi
+from utils import EventLoopThread, get_event_loop_thread, run_async, run_sync
+
+
+@pytest.fixture
+def loop_thread():
+    loop_thread = EventLoopThread()
+    yield loop_thread
+    if loop_thread._thread.is_alive():
+        loop_thread.stop(5)
+
+
+def test_run_and_submit(loop_thread):
+    async def double(value):
+        await asyncio.sleep(0)
+        return value * 2
+
+    assert loop_thread.run(double(2), 5) == 4
+    assert loop_thread.submit(double(3)).result(5) == 6
+
+
+def test_run_from_loop_thread_fails(loop_thread):
+    async def nested():
+        return loop_thread.run(asyncio.sleep(0))
+
+    with pytest.raises(RuntimeError):
+        loop_thread.run(nested(), 5)
+
+
+def test_stop_runs_hooks(loop_thread, monkeypatch):
+    closed = []
+
+    async def close():
+        closed.append(asyncio.get_event_loop() is loop_thread.loop)
+
+    async def broken():
+        raise ValueError('already closed')
+
+    monkeypatch.setattr(utils, '_stop_hooks', [broken, close])
+    loop_thread.stop(5)
+    assert closed == [True]
+    assert not loop_thread._thread.is_alive()
+
+
+def test_process_loop_is_shared_and_recreated_after_fork(monkeypatch):
+    loop_thread = get_event_loop_thread()
+    assert get_event_loop_thread() is loop_thread
+    # pretend we are a forked child
+    monkeypatch.setattr(loop_thread, 'pid', os.getpid() + 1)
+    child = get_event_loop_thread()
+    try:
+        assert child is not loop_thread
+        assert run_sync(asyncio.sleep(0, 'child'), 5) == 'child'
+    finally:
+        utils._event_loop = loop_thread
+        child.stop(5)
+
+
+def test_backoff_does_not_hold_the_loop(run):
+    euw, kr = SummonerApi('euw'), SummonerApi('kr')
+    run(euw.rate_limiter.block(euw.app_scope, 1))
+    waiting = run_async(euw.rate_limiter.acquire([euw.app_scope], 5))
+    started = time.monotonic()
+    for _ in range(10):
+        assert run(kr.rate_limiter.try_acquire([kr.app_scope])) == 0
+    assert time.monotonic() - started < 0.5
+    assert not waiting.done()
+    waiting.result(5)
@@ -0,0 +1,77 @@
+import logging
+from analytics import GameAnalyzer
+from chatsettings import ChatSettings
+from riotapi import RitoPlsError
+from watcher import LiveGameWatcher, watch_entry, split_watch_entry
+
+
+def test_watch_entries():
+    assert split_watch_entry(watch_entry('kr', 'Player')) == ('kr', 'Player')
+    assert split_watch_entry('Player') == ('euw', 'Player')
+
+
+def test_unknown_summoner_is_dropped(riot, redis):
+    watcher = LiveGameWatcher()
+    watcher.watch(1, 'euw:Nobody')
+    redis.set(f'{watcher.state_prefix}euw:Nobody', '{}')
+    assert watcher.tick() == 1
+    assert redis.zscore(watcher.schedule_key, 'euw:Nobody') is None
+    assert not redis.exists(f'{watcher.state_prefix}euw:Nobody')
+
+
+def test_idle_summoner_backs_off_quietly(riot, run, caplog):
+    riot.add_summoner('Player', 'acc', [1])
+    watcher = LiveGameWatcher()
+    watcher.watch(1, 'euw:Player')
+    with caplog.at_level(logging.DEBUG, logger='TiltBot'):
+        first = run(watcher.poll('euw:Player'))
+        second = run(watcher.poll('euw:Player'))
+    assert first == watcher.idle_interval
+    assert second == min(watcher.max_idle_interval, watcher.idle_interval * 2)
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+
+
+def test_ended_game_is_prefetched_and_pushed(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    sent = []
+    watcher = LiveGameWatcher(send_message=lambda chat_id, text: sent.append(chat_id))
+    watcher.watch(1, 'euw:Player')
+    watcher.watch(2, 'euw:Player')
+    ChatSettings(1).set_autopush(True)
+    riot.active_games['euw', 'id-acc'] = {'gameId': 2, 'gameLength': 600}
+    # polled again when a 15 minute game could end
+    assert run(watcher.poll('euw:Player')) == 300
+    del riot.active_games['euw', 'id-acc']
+    riot.add_summoner('Player', 'acc', [2, 1])
+    assert run(watcher.poll('euw:Player')) == watcher.idle_interval
+    assert sent == [1]
+    analyzer = GameAnalyzer('Player').analyzer
+    assert run(analyzer.results.peek_many([analyzer.result_key(2)]))
+
+
+def test_ended_game_stays_pending_while_match_is_unavailable(riot, run):
+    riot.add_summoner('Player', 'acc', [1])
+    sent = []
+    watcher = LiveGameWatcher(send_message=lambda chat_id, text: sent.append(text))
+    watcher.watch(1, 'euw:Player')
+    ChatSettings(1).set_autopush(True)
+    riot.active_games['euw', 'id-acc'] = {'gameId': 2, 'gameLength': 600}
+    run(watcher.poll('euw:Player'))
+    del riot.active_games['euw', 'id-acc']
+    riot.add_summoner('Player', 'acc', [2, 1])
+    match = riot.matches['euw', 2]
+    riot.matches['euw', 2] = RitoPlsError('unavailable', 503)
+    # the older game is not pushed in place of the ended one
+    assert run(watcher.poll('euw:Player')) == watcher.ingame_interval
+    assert sent == []
+    riot.matches['euw', 2] = match
+    assert run(watcher.poll('euw:Player')) == watcher.idle_interval
+    assert sent == [GameAnalyzer('Player').analyze_last_game()]
+
+
+def test_unwatched_summoner_is_not_polled(riot, run):
+    watcher = LiveGameWatcher()
+    watcher.watch(1, 'euw:Player')
+    watcher.unwatch(1, 'euw:Player')
+    assert run(watcher.poll('euw:Player')) is None
+    assert riot.calls == []
@@ -0,0 +1,64 @@
+import json
+import time
+from concurrent.futures import Future
+from workqueue import UpdateQueue, UpdateWorkerPool
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_duplicate_updates_are_queued_once():
+    queue = UpdateQueue()
+    assert queue.enqueue({'update_id': 1})
+    assert not queue.enqueue({'update_id': 1})
+    assert queue.enqueue({'update_id': 2})
+    assert len(queue) == 2
+
+
+def test_webhook_acknowledges_and_queues():
+    from tgbot import create_app
+    client = create_app(start_services=False).test_client()
+    for _ in range(2):
+        assert client.post('/tgbot/hook/', json={'update_id': 5, 'message': {}}).status_code == 200
+    assert len(UpdateQueue()) == 1
+
+
+def test_workers_handle_updates():
+    handled = []
+    pool = UpdateWorkerPool(handled.append, workers=2)
+    pool.queue.enqueue({'update_id': 1})
+    pool.queue.enqueue({'update_id': 2})
+    pool.start()
+    try:
+        wait_until(lambda: len(handled) == 2)
+    finally:
+        pool.stop(5)
+    assert sorted(update['update_id'] for update in handled) == [1, 2]
+    assert pool.redis.llen(pool.processing_key) == 0
+
+
+def test_update_stays_in_processing_list_until_its_command_is_done():
+    future = Future()
+    pool = UpdateWorkerPool(lambda update: future, workers=1)
+    pool.queue.enqueue({'update_id': 1})
+    pool.start()
+    try:
+        wait_until(lambda: future in pool._pending)
+        assert pool.redis.llen(pool.processing_key) == 1
+        future.set_result(None)
+        wait_until(lambda: pool.redis.llen(pool.processing_key) == 0)
+    finally:
+        pool.stop(5)
+
+
+def test_updates_of_dead_workers_are_requeued(redis):
+    queue = UpdateQueue()
+    redis.lpush(f'{queue.processing_prefix}dead', json.dumps({'update_id': 1}))
+    redis.lpush(f'{queue.processing_prefix}alive', json.dumps({'update_id': 2}))
+    redis.set(f'{queue.heartbeat_prefix}alive', 1)
+    assert queue.requeue_orphaned() == 1
+    assert len(queue) == 1
@@ -1,7 +1,17 @@
 import re
-import requests
-from utils import LogMixin
-from analytics import GameAnalyzer
+import time
+import asyncio
+from concurrent.futures import Future
+from metrics import metrics, sampled_profile, sampled_coroutine_profile
+from utils import LogMixin, run_async
+import config
+from analytics import AsyncGameAnalyzer, HistoryAnalyzer, PlayerAnalyzer, gather_last_results
+from cachepolicy import cache_report, render_report
+from chatsettings import ChatSettings
+from rediscache import get_redis
+from riotapi import check_region, UnknownRegionError
+from tgsender import get_outbox
+from watcher import LiveGameWatcher, watch_entry, split_watch_entry
 
 class IncomingTelegramCommand(LogMixin):
     def __init__(self, msg_id : int, sender_id : int, chat_id: int, command : str):
@@ -10,12 +20,22 @@ class IncomingTelegramCommand(LogMixin):
         self.chat_id = chat_id
         self.command = command
 
+    @staticmethod
+    def get_message(item : dict) -> dict:
+        if 'edited_message' in item:
+            return item['edited_message']
+        return item['message']
+
+    @classmethod
+    def chat_id_of(cls, item : dict):
+        try:
+            return cls.get_message(item)['chat']['id']
+        except KeyError:
+            return None
+
     @classmethod
     def from_tg_dict(cls, item : dict):
-        if 'edited_message' in item:
-            msg = item['edited_message']
-        else:
-            msg = item['message']
+        msg = cls.get_message(item)
         data = {
             'msg_id': msg['message_id'],
             'sender_id': msg['from']['id'],
@@ -31,9 +51,7 @@ class BaseCommandHandler(LogMixin):
     command = '/hello'
 
     def __init__(self):
-        with open('/keys/tgapi.key') as f:
-            token = f.read().strip()
-        self.send_message_url = f'https://api.telegram.org/bot{token}/sendMessage'
+        self.outbox = get_outbox()
 
     def match(self, message : IncomingTelegramCommand) -> bool:
         '''
@@ -46,35 +64,223 @@ class BaseCommandHandler(LogMixin):
         self._send_message(message.chat_id, 'Hello!')
 
     def _send_message(self, chat_id : int, message : str):
-        data = {
-            'chat_id': chat_id,
-            'text': message, 
-            'parse_mode': 'Markdown'
-        }
-        requests.post(self.send_message_url, json=data)
+        # delivered by tgsender.TelegramSender
+        self.outbox.enqueue(chat_id, message, parse_mode='Markdown')
+
+    def _respond_later(self, chat_id : int, lookup) -> Future:
+        '''
+        Run lookup coroutine on the process event loop and send the text it
+        returns. The calling worker thread is free again right away.
+        '''
+        return run_async(sampled_coroutine_profile(self.command.lstrip('/'), self._respond(chat_id, lookup)))
+
+    async def _respond(self, chat_id : int, lookup) -> None:
+        message = await lookup
+        # outbox uses the threaded redis client, keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._send_message, chat_id, message)
+
+
+def parse_names(names : str) -> list:
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+def parse_region(text : str, chat_id : int) -> tuple:
+    '''
+    Split optional leading region from command arguments. Without one the
+    chat's default region is used. Returns (region, rest of text).
+    '''
+    words = text.split(None, 1)
+    if len(words) == 2 and words[0].lower() in config.RIOT_REGIONS:
+        return words[0].lower(), words[1]
+    return ChatSettings(chat_id).get_region(), text
+
+def format_watch_entry(entry : str) -> str:
+    region, name = split_watch_entry(entry)
+    return f'{name} ({region})'
+
+async def wait_all(futures : list) -> None:
+    await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
 
 
 class TempHandler(BaseCommandHandler):
     command = '/temp'
-    pattern = re.compile(r'/temp(@\S+)?\s(?P<summoner_name>.*)$')
+    pattern = re.compile(r'/temp(@\S+)?(\s+(?P<summoner_names>.*))?$')
+    usage = 'usage: /temp [<region>] <summoner_name>[, <summoner_name>...] or /temp with a saved /roster'
+
+    def handle(self, message : IncomingTelegramCommand):
+        match = self.pattern.match(message.command)
+        region, text = parse_region(match.group('summoner_names') or '', message.chat_id) if match else (None, '')
+        names = parse_names(text)
+        if match and not names:
+            names = ChatSettings(message.chat_id).get_roster()
+        if not names:
+            err = f'Sorry. could not parse summoner name. {self.usage}'
+            return self._send_message(message.chat_id, err)
+        if len(names) > ChatSettings.max_roster_size:
+            err = f'Sorry. at most {ChatSettings.max_roster_size} summoners at a time. {self.usage}'
+            return self._send_message(message.chat_id, err)
+        if len(names) == 1:
+            return self._respond_later(message.chat_id, self._analyze_one(names[0], region))
+        return self._respond_later(message.chat_id, self._analyze_many(names, region))
+
+    async def _analyze_one(self, name : str, region=None) -> str:
+        try:
+            analyzer = AsyncGameAnalyzer(name, region)
+            return await analyzer.analyze_last_game()
+        except Exception as exc:
+            self.logger.error("Error: %s", exc)
+            return f'Requested game data with summoner name {name}. but something went wrong :/'
+
+    async def _analyze_many(self, names : list, region=None) -> str:
+        # a few lookups run concurrently, all of them share the riot rate limit of the region
+        results = await gather_last_results(names, region)
+        lines = []
+        failed = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                self.logger.error("Error with %s: %s", name, result)
+                failed.append(name)
+            else:
+                lines.append((result['temp'], PlayerAnalyzer.render_summary(name, result)))
+        lines.sort(key=lambda line: line[0], reverse=True)
+        bullet_str = ''.join(f'    - {line}\n' for _, line in lines)
+        if failed:
+            bullet_str += f"    - Could not get games for {', '.join(failed)}\n"
+        tag = "```"
+        return f'{tag}markdown\nLobby temperatures, hottest first:\n{bullet_str}{tag}'
+
+
+class RosterHandler(BaseCommandHandler):
+    command = '/roster'
+    pattern = re.compile(r'/roster(@\S+)?(\s+(?P<action>set|add|remove))?(\s+(?P<summoner_names>.*))?$')
+    usage = 'usage: /roster [set|add|remove <summoner_name>[, <summoner_name>...]]'
+
+    def handle(self, message : IncomingTelegramCommand):
+        match = self.pattern.match(message.command)
+        if not match:
+            return self._send_message(message.chat_id, f'Sorry. could not parse command. {self.usage}')
+        settings = ChatSettings(message.chat_id)
+        roster = settings.get_roster()
+        names = parse_names(match.group('summoner_names') or '')
+        action = match.group('action')
+        if action == 'set':
+            roster = settings.set_roster(names)
+        elif action == 'add':
+            roster = settings.set_roster(roster + names)
+        elif action == 'remove':
+            roster = settings.set_roster([name for name in roster if name not in names])
+        if not roster:
+            return self._send_message(message.chat_id, f'Roster is empty. {self.usage}')
+        return self._send_message(message.chat_id, 'Roster: {}'.format(', '.join(roster)))
+
+
+class TiltHandler(BaseCommandHandler):
+    command = '/tilt'
+    pattern = re.compile(r'/tilt(@\S+)?\s(?P<summoner_name>.*?)(\s+(?P<count>\d+))?$')
 
     def handle(self, message : IncomingTelegramCommand):
         match = self.pattern.match(message.command)
         if not match:
-            err = 'Sorry. could not parse summoner name. usage: /temp <summoner_name>'
+            err = 'Sorry. could not parse summoner name. usage: /tilt [<region>] <summoner_name> [games]'
             return self._send_message(message.chat_id, err)
-        name = match.group('summoner_name')
-        analyzer = GameAnalyzer(name)
+        region, name = parse_region(match.group('summoner_name'), message.chat_id)
+        count = int(match.group('count') or config.TILT_HISTORY_DEFAULT)
+        count = max(1, min(count, config.TILT_HISTORY_MAX))
+        return self._respond_later(message.chat_id, self._analyze_history(name, region, count))
+
+    async def _analyze_history(self, name : str, region, count : int) -> str:
         try:
-            msg = analyzer.analyze_last_game()
+            analyzer = AsyncGameAnalyzer(name, region)
+            return HistoryAnalyzer(name, await analyzer.analyze_history(count)).render()
         except Exception as exc:
-            msg = f'Requested game data with summoner name {name}. but something went wrong :/'
             self.logger.error("Error: %s", exc)
-        return self._send_message(message.chat_id, msg)
+            return f'Requested game history with summoner name {name}. but something went wrong :/'
 
+class WatchHandler(BaseCommandHandler):
+    command = '/watch'
+    pattern = re.compile(r'/watch(@\S+)?(\s+push\s+(?P<push>on|off))?(\s+(?P<summoner_names>.*))?$')
+    usage = ('usage: /watch [[<region>] <summoner_name>[, <summoner_name>...]], /watch push on|off '
+             'or /unwatch [<region>] <summoner_name>')
+
+    def __init__(self):
+        super().__init__()
+        self.watcher = LiveGameWatcher()
+
+    def handle(self, message : IncomingTelegramCommand):
+        match = self.pattern.match(message.command)
+        if not match:
+            return self._send_message(message.chat_id, f'Sorry. could not parse command. {self.usage}')
+        settings = ChatSettings(message.chat_id)
+        if match.group('push'):
+            settings.set_autopush(match.group('push') == 'on')
+        region, text = parse_region(match.group('summoner_names') or '', message.chat_id)
+        entries = [watch_entry(region, name) for name in parse_names(text)]
+        watchlist = settings.get_watchlist()
+        if entries:
+            watchlist = settings.set_watchlist(watchlist + entries)
+            for entry in watchlist:
+                self.watcher.watch(message.chat_id, entry)
+        push = 'on' if settings.get_autopush() else 'off'
+        if not watchlist:
+            return self._send_message(message.chat_id, f'Not watching anyone. {self.usage}')
+        return self._send_message(
+            message.chat_id, 'Watching: {} (push {})'.format(', '.join(map(format_watch_entry, watchlist)), push))
 
 
-class CommandDelegator:
+class UnwatchHandler(WatchHandler):
+    command = '/unwatch'
+    pattern = re.compile(r'/unwatch(@\S+)?\s+(?P<summoner_names>.*)$')
+
+    def handle(self, message : IncomingTelegramCommand):
+        match = self.pattern.match(message.command)
+        if not match:
+            return self._send_message(message.chat_id, f'Sorry. could not parse command. {self.usage}')
+        settings = ChatSettings(message.chat_id)
+        region, text = parse_region(match.group('summoner_names'), message.chat_id)
+        targets = {(region, name) for name in parse_names(text)}
+        watchlist = []
+        for entry in settings.get_watchlist():
+            if split_watch_entry(entry) in targets:
+                self.watcher.unwatch(message.chat_id, entry)
+            else:
+                watchlist.append(entry)
+        watchlist = settings.set_watchlist(watchlist)
+        return self._send_message(
+            message.chat_id, 'Watching: {}'.format(', '.join(map(format_watch_entry, watchlist)) or 'no one'))
+
+
+class RegionHandler(BaseCommandHandler):
+    command = '/region'
+    pattern = re.compile(r'/region(@\S+)?(\s+(?P<region>\S+))?\s*$')
+
+    def handle(self, message : IncomingTelegramCommand):
+        match = self.pattern.match(message.command)
+        usage = 'usage: /region [{}]'.format('|'.join(config.RIOT_REGIONS))
+        if not match:
+            return self._send_message(message.chat_id, f'Sorry. could not parse command. {usage}')
+        settings = ChatSettings(message.chat_id)
+        if match.group('region'):
+            try:
+                settings.set_region(check_region(match.group('region')))
+            except UnknownRegionError as exc:
+                return self._send_message(message.chat_id, f'{exc}. {usage}')
+        return self._send_message(message.chat_id, f'Region: {settings.get_region()}')
+
+
+class CacheHandler(BaseCommandHandler):
+    command = '/cache'
+
+    def handle(self, message : IncomingTelegramCommand):
+        # only for chats in config.ADMIN_CHAT_IDS, others get no answer
+        if message.chat_id not in config.ADMIN_CHAT_IDS:
+            self.logger.warning('Chat %s is not allowed to use %s', message.chat_id, self.command)
+            return None
+        redis = get_redis()
+        report = render_report(cache_report(redis), redis.info())
+        tag = "```"
+        return self._send_message(message.chat_id, f'{tag}\n{report}\n{tag}')
+
+
+class CommandDelegator(LogMixin):
     def __init__(self):
         self.handlers = {}
     
@@ -85,7 +291,49 @@ class CommandDelegator:
         if handler_id in self.handlers:
             del self.handlers[handler_id]
 
-    def delegate_command(self, message: IncomingTelegramCommand):
+    def delegate_command(self, message: IncomingTelegramCommand) -> list:
+        '''
+        Pass message to matching handlers. Returns futures of the ones still
+        looking up their reply on the event loop.
+        '''
+        pending = []
         for _, handler in self.handlers.items():
             if handler.match(message):
-                handler.handle(message)
\ No newline at end of file
+                result = handler.handle(message)
+                if isinstance(result, Future):
+                    pending.append(result)
+        return pending
+
+    def delegate_update(self, update: dict):
+        '''
+        Handle update. Returns None when it is done or a future finishing
+        once replies looked up on the event loop are queued.
+        '''
+        try:
+            cmd = IncomingTelegramCommand.from_tg_dict(update)
+        except KeyError as exc:
+            self.logger.error('Command parsing failed due to missing key %s. Message %s', exc, update)
+            return None
+        started = time.perf_counter()
+        # lookups handed to the event loop are profiled on their own, see _respond_later
+        with sampled_profile('update'):
+            pending = self.delegate_command(cmd)
+        if not pending:
+            metrics.observe('tiltbot_update_seconds', time.perf_counter() - started)
+            return None
+        done = pending[0] if len(pending) == 1 else run_async(wait_all(pending))
+        done.add_done_callback(lambda _: metrics.observe('tiltbot_update_seconds', time.perf_counter() - started))
+        return done
+
+
+def build_command_delegator() -> CommandDelegator:
+    command_delegator = CommandDelegator()
+    command_delegator.register_handler("HelloHandler", BaseCommandHandler())
+    command_delegator.register_handler("Temp", TempHandler())
+    command_delegator.register_handler("Tilt", TiltHandler())
+    command_delegator.register_handler("Roster", RosterHandler())
+    command_delegator.register_handler("Watch", WatchHandler())
+    command_delegator.register_handler("Unwatch", UnwatchHandler())
+    command_delegator.register_handler("Region", RegionHandler())
+    command_delegator.register_handler("Cache", CacheHandler())
+    return command_delegator
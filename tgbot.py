@@ -1,34 +1,75 @@
 import logging
-import json
 from flask import Flask, request
-from tgapi import IncomingTelegramCommand, CommandDelegator
-from tgapi import BaseCommandHandler, TempHandler
-from analytics import GameAnalyzer
-app = Flask(__name__)
-
-command_delegator = CommandDelegator()
-command_delegator.register_handler("HelloHandler", BaseCommandHandler())
-command_delegator.register_handler("Temp", TempHandler())
+import config
+from cachepolicy import namespace_usage
+from localcache import local_cache_stats
+from metrics import metrics
+from rediscache import get_redis
+from riotdata import ChampionData, ChampionRefresher
+from tgsender import get_outbox
+from worker import BackgroundServices
+from workqueue import UpdateQueue
+
 FORMAT = '%(asctime)-15s %(filename)15s:%(lineno)3d %(levelname)-8s %(message)s'
 logging.basicConfig(format=FORMAT)
 logger = logging.getLogger('TiltBot')
 logger.setLevel(logging.DEBUG)
 
-with open("keys/hook.key") as f:
-    hook = f.read().strip()
 
-@app.route('/tgbot/')
-def main():
-    return '<h1>Blip!</h1>'
+def create_app(start_services=None) -> Flask:
+    '''
+    Build the webhook app. Background services run in this process when
+    start_services is true, default from config.INPROCESS_WORKERS. With
+    gunicorn they are started after fork instead, see gunicorn.conf.py.
+    '''
+    app = Flask(__name__)
+    update_queue = UpdateQueue()
+
+    with open(config.HOOK_KEY_FILE) as f:
+        hook = f.read().strip()
+
+    # done once before workers fork so they share the warm copy
+    ChampionRefresher().refresh()
+    preloaded = ChampionData.preload()
+    logger.info('Preloaded %s champions', preloaded)
+
+    @app.route('/tgbot/')
+    def main():
+        return '<h1>Blip!</h1>'
+
+    @app.route('/tgbot/metrics')
+    def metrics_endpoint():
+        return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+    def collect_gauges():
+        gauges = [
+            ('tiltbot_update_queue_length', {}, len(update_queue)),
+            ('tiltbot_telegram_outbox_chats', {}, len(get_outbox())),
+        ]
+        for namespace, stats in local_cache_stats().items():
+            for stat, value in stats.items():
+                gauges.append((f'tiltbot_local_cache_{stat}', {'namespace': namespace}, value))
+        for namespace, (keys, size) in namespace_usage(get_redis()).items():
+            gauges.append(('tiltbot_cache_keys', {'namespace': namespace}, keys))
+            gauges.append(('tiltbot_cache_bytes', {'namespace': namespace}, size))
+        return gauges
+
+    metrics.register_collector(collect_gauges)
 
-@app.route('/tgbot/{}/'.format(hook), methods=['POST'])
-def botmain():
-    raw_data = request.get_json()
-    try:
-        cmd = IncomingTelegramCommand.from_tg_dict(raw_data)
-    except KeyError as exc:
-        logger.error('Command parsing failed due to missing key %s. Message %s', exc, raw_data)
+    @app.route('/tgbot/{}/'.format(hook), methods=['POST'])
+    def botmain():
+        raw_data = request.get_json()
+        # acknowledge right away. workers handle the update
+        queued = update_queue.enqueue(raw_data)
+        metrics.inc('tiltbot_webhook_updates_total', result='queued' if queued else 'duplicate')
         return ""
-    command_delegator.delegate_command(cmd)
-    return ""
 
+    if start_services is None:
+        start_services = config.INPROCESS_WORKERS
+    services = None
+    if start_services:
+        # without separate worker.py processes drain the queue here
+        services = BackgroundServices(queue=update_queue)
+        services.start()
+    app.extensions['tiltbot_services'] = services
+    return app
@@ -0,0 +1,159 @@
+import uuid
+import threading
+from collections import OrderedDict
+import requests
+import config
+from httpclient import http_client
+from metrics import metrics
+from rediscache import get_redis, RELEASE_LOCK_SCRIPT
+from tgapi import IncomingTelegramCommand
+from utils import LogMixin, concurrent_map
+from workqueue import UpdateQueue
+
+
+# extend lock only if we still own it
+EXTEND_LOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+
+class UpdatePoller(LogMixin):
+    '''
+    Alternative to the webhook. Long polls telegram getUpdates and hands
+    each batch to handle_update, chats concurrently and updates of one
+    chat in order. Offset is committed to redis after the batch so a
+    restarted or another poller continues where this one stopped.
+
+    Telegram allows one getUpdates consumer per bot, so pollers of all
+    processes compete for a lock and only the holder polls.
+    '''
+    offset_key = 'tg_poll_offset'
+    lock_key = 'tg_poll_lock'
+    # seconds to wait before polling again after an error
+    error_wait = 5
+
+    def __init__(self, handle_update, workers=None, queue=None, db=0):
+        with open(config.TELEGRAM_KEY_FILE) as f:
+            token = f.read().strip()
+        self.get_updates_url = f'{config.TELEGRAM_API_URL}/bot{token}/getUpdates'
+        self.handle_update = handle_update
+        self.workers = workers if workers is not None else config.WORKERS
+        # shares dedup with the webhook queue
+        self.queue = queue or UpdateQueue(db)
+        self.redis = get_redis(db)
+        self.poll_timeout = config.POLL_TIMEOUT
+        self.limit = config.POLL_LIMIT
+        self.lock_timeout = self.poll_timeout + 60
+        self.token = uuid.uuid4().hex
+        self._extend_lock = self.redis.register_script(EXTEND_LOCK_SCRIPT)
+        self._release_lock = self.redis.register_script(RELEASE_LOCK_SCRIPT)
+        self._stop = threading.Event()
+        self._batch_lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='update-poller', daemon=True)
+        self._thread.start()
+        self.logger.info('Started getUpdates poller')
+
+    def stop(self, timeout=None) -> None:
+        '''
+        Wait for the batch in progress. Updates of a long poll still
+        running are not committed and go to the next poller.
+        '''
+        self._stop.set()
+        if self._batch_lock.acquire(timeout=-1 if timeout is None else timeout):
+            self._batch_lock.release()
+        self._release_lock(keys=[self.lock_key], args=[self.token])
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if not self._hold_lock():
+                    self._stop.wait(self.error_wait)
+                    continue
+                self.poll_once()
+            except Exception:
+                self.logger.exception('Polling updates failed')
+                self._stop.wait(self.error_wait)
+
+    def _hold_lock(self) -> bool:
+        lock_ms = self.lock_timeout * 1000
+        if self._extend_lock(keys=[self.lock_key], args=[self.token, lock_ms]):
+            return True
+        return bool(self.redis.set(self.lock_key, self.token, px=lock_ms, nx=True))
+
+    def get_offset(self) -> int:
+        offset = self.redis.get(self.offset_key)
+        return 0 if offset is None else int(offset)
+
+    def poll_once(self) -> int:
+        '''
+        Fetch and process one batch. Returns number of updates fetched.
+        '''
+        offset = self.get_offset()
+        updates = self.get_updates(offset)
+        with self._batch_lock:
+            if not updates or self._stop.is_set():
+                return 0
+            # lock may be close to expiring after a long poll
+            self._hold_lock()
+            self.process(updates)
+            next_offset = max(update['update_id'] for update in updates) + 1
+            self.redis.set(self.offset_key, next_offset)
+        return len(updates)
+
+    def get_updates(self, offset: int) -> list:
+        data = {
+            'offset': offset,
+            'limit': self.limit,
+            'timeout': self.poll_timeout,
+            'allowed_updates': ['message', 'edited_message'],
+        }
+        # read timeout has to outlast the long poll
+        timeout = (config.HTTP_CONNECT_TIMEOUT, self.poll_timeout + config.HTTP_READ_TIMEOUT)
+        try:
+            resp = http_client.post(self.get_updates_url, json=data, timeout=timeout)
+        except requests.RequestException as exc:
+            self.logger.warning('getUpdates failed: %s', exc)
+            self._stop.wait(self.error_wait)
+            return []
+        if resp.status_code == 409:
+            self.logger.error('getUpdates conflicts with a webhook or another consumer: %s', resp.text)
+            self._stop.wait(self.poll_timeout)
+            return []
+        if resp.status_code != 200:
+            self.logger.error('getUpdates returned %s: %s', resp.status_code, resp.text)
+            self._stop.wait(self.error_wait)
+            return []
+        updates = resp.json().get('result', [])
+        metrics.inc('tiltbot_poll_updates_total', value=len(updates))
+        return updates
+
+    def process(self, updates: list) -> None:
+        '''
+        Handle updates of different chats concurrently, of one chat in order
+        '''
+        by_chat = OrderedDict()
+        for update in sorted(updates, key=lambda update: update['update_id']):
+            by_chat.setdefault(IncomingTelegramCommand.chat_id_of(update), []).append(update)
+        with metrics.timer('tiltbot_poll_batch_seconds'):
+            concurrent_map(self._process_chat, by_chat.values(), self.workers)
+
+    def _process_chat(self, updates: list) -> None:
+        for update in updates:
+            update_id = update['update_id']
+            # handled before a crash or delivered through the webhook too
+            if self.queue.is_seen(update_id):
+                continue
+            try:
+                pending = self.handle_update(update)
+                # replies of one chat keep their order
+                if pending is not None:
+                    pending.result()
+            except Exception:
+                self.logger.exception('Handling update %s failed', update_id)
+            self.queue.mark_seen(update_id)
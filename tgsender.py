@@ -0,0 +1,278 @@
+import json
+import time
+import threading
+import requests
+import config
+from httpclient import http_client
+from metrics import metrics
+from ratelimit import get_rate_limiter, RateLimitExceeded
+from rediscache import get_redis
+from utils import LogMixin, run_sync
+
+
+# telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+# Append message to chat outbox and schedule chat unless it already is.
+# A chat that sent recently is scheduled when its interval has passed.
+# KEYS: chat outbox, schedule, chat interval key. ARGV: message, chat_id, now
+ENQUEUE_SCRIPT = '''
+redis.call('RPUSH', KEYS[1], ARGV[1])
+if not redis.call('ZSCORE', KEYS[2], ARGV[2]) then
+    local wait = math.max(0, redis.call('PTTL', KEYS[3]))
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[3]) + wait / 1000, ARGV[2])
+end
+return redis.call('LLEN', KEYS[1])
+'''
+
+# Lease the first due chat to caller by moving its score past the lease.
+# Expired leases of crashed senders become due again by themselves.
+# KEYS: schedule. ARGV: now, lease_until
+CLAIM_SCRIPT = '''
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+if #due == 0 then return false end
+redis.call('ZADD', KEYS[1], ARGV[2], due[1])
+return due[1]
+'''
+
+# Drop handled messages and reschedule chat if it has more.
+# KEYS: chat outbox, schedule, chat interval key
+# ARGV: chat_id, handled count, next_due, interval_ms
+FINISH_SCRIPT = '''
+if tonumber(ARGV[2]) > 0 then
+    redis.call('LTRIM', KEYS[1], ARGV[2], -1)
+end
+if tonumber(ARGV[4]) > 0 then
+    redis.call('SET', KEYS[3], 1, 'PX', ARGV[4])
+end
+if redis.call('LLEN', KEYS[1]) > 0 then
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+else
+    redis.call('ZREM', KEYS[2], ARGV[1])
+end
+return 0
+'''
+
+
+class Outbox(LogMixin):
+    '''
+    Redis backed queue of outgoing telegram messages. Every chat has its
+    own list so messages to one chat keep their order, and chats are
+    scheduled in a sorted set so senders in any process respect the per
+    chat interval.
+    '''
+    schedule_key = 'tg_outbox_schedule'
+    chat_prefix = 'tg_outbox_'
+    interval_prefix = 'tg_outbox_interval_'
+
+    def __init__(self, db=0):
+        self.redis = get_redis(db)
+        self._enqueue = self.redis.register_script(ENQUEUE_SCRIPT)
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+        self._finish = self.redis.register_script(FINISH_SCRIPT)
+        # wakes senders of this process right away instead of next poll
+        self.wakeup = threading.Event()
+
+    def _keys(self, chat_id) -> list:
+        return [f'{self.chat_prefix}{chat_id}', self.schedule_key, f'{self.interval_prefix}{chat_id}']
+
+    def enqueue(self, chat_id: int, text: str, parse_mode='Markdown') -> int:
+        '''
+        Queue message for delivery. Returns number of messages waiting for the chat.
+        '''
+        message = json.dumps({'text': text, 'parse_mode': parse_mode, 'queued_at': time.time()})
+        waiting = self._enqueue(keys=self._keys(chat_id), args=[message, chat_id, time.time()])
+        metrics.inc('tiltbot_telegram_messages_total', result='queued')
+        self.wakeup.set()
+        return waiting
+
+    def claim(self, lease: float):
+        '''
+        Lease a chat with due messages. Returns chat_id or None.
+        '''
+        now = time.time()
+        chat_id = self._claim(keys=[self.schedule_key], args=[now, now + lease])
+        return None if chat_id is None else int(chat_id)
+
+    def peek(self, chat_id: int, count: int) -> list:
+        return [json.loads(item.decode('utf-8')) for item in self.redis.lrange(f'{self.chat_prefix}{chat_id}', 0, count - 1)]
+
+    def finish(self, chat_id: int, handled: int, delay: float, interval=0) -> None:
+        '''
+        Remove handled messages of leased chat. Remaining ones are due after delay seconds.
+        '''
+        self._finish(keys=self._keys(chat_id), args=[chat_id, handled, time.time() + delay, int(interval * 1000)])
+
+    def __len__(self):
+        return self.redis.zcard(self.schedule_key)
+
+
+_outbox = None
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+    return _outbox
+
+
+def coalesce(messages: list) -> tuple:
+    '''
+    Join leading messages with same parse mode into one telegram message.
+    Returns (text, parse_mode, count of joined messages). A message over
+    the length limit is cut and sent as plain text.
+    '''
+    text = messages[0]['text']
+    parse_mode = messages[0]['parse_mode']
+    count = 1
+    for message in messages[1:]:
+        joined = f'{text}\n\n{message["text"]}'
+        if message['parse_mode'] != parse_mode or len(joined) > MAX_MESSAGE_LENGTH:
+            break
+        text = joined
+        count += 1
+    if len(text) > MAX_MESSAGE_LENGTH:
+        # a cut entity would fail to parse and the message would never be delivered
+        return text[:MAX_MESSAGE_LENGTH], None, count
+    return text, parse_mode, count
+
+
+class TelegramSender(LogMixin):
+    '''
+    Threads delivering Outbox messages. Global message rate is shared
+    between processes through RateLimiter, per chat rate through the
+    outbox schedule. Bursts to one chat are sent as one message and
+    telegram's retry_after is honored.
+    '''
+    scope = 'telegram'
+    # seconds a chat stays leased to one sender
+    lease = 30
+    max_coalesce = 10
+
+    def __init__(self, threads=None, outbox=None):
+        with open(config.TELEGRAM_KEY_FILE) as f:
+            token = f.read().strip()
+        self.send_message_url = f'{config.TELEGRAM_API_URL}/bot{token}/sendMessage'
+        self.threads = config.TELEGRAM_SENDERS if threads is None else threads
+        self.outbox = outbox or get_outbox()
+        self.limiter = get_rate_limiter(self.scope, {self.scope: config.TELEGRAM_RATE_LIMIT})
+        self.max_attempts = config.TELEGRAM_MAX_ATTEMPTS
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        self._threads = [
+            threading.Thread(target=self._run, name=f'telegram-sender-{i}', daemon=True)
+            for i in range(self.threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.logger.info('Started %s telegram senders', self.threads)
+
+    def stop(self, timeout=None) -> None:
+        '''
+        Stop once no chat has due messages. Messages that are not due yet
+        stay in redis for the next sender.
+        '''
+        self._stop.set()
+        self.outbox.wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            self.outbox.wakeup.clear()
+            try:
+                sent = self.send_next()
+            except Exception:
+                self.logger.exception('Sending telegram messages failed')
+                sent = False
+            if not sent:
+                if self._stop.is_set():
+                    return
+                self.outbox.wakeup.wait(config.TELEGRAM_POLL_INTERVAL)
+
+    @staticmethod
+    def chat_interval(chat_id: int) -> float:
+        # group chats have negative ids and a stricter limit
+        return config.TELEGRAM_GROUP_INTERVAL if chat_id < 0 else config.TELEGRAM_CHAT_INTERVAL
+
+    def send_next(self) -> bool:
+        '''
+        Deliver waiting messages of one due chat. Returns False if no chat was due.
+        '''
+        chat_id = self.outbox.claim(self.lease)
+        if chat_id is None:
+            return False
+        messages = self.outbox.peek(chat_id, self.max_coalesce)
+        if not messages:
+            self.outbox.finish(chat_id, 0, 0)
+            return True
+        text, parse_mode, count = coalesce(messages)
+        try:
+            run_sync(self.limiter.acquire([self.scope], self.lease / 2))
+        except RateLimitExceeded:
+            self.outbox.finish(chat_id, 0, 1)
+            return True
+        retry_after = self._post(chat_id, text, parse_mode)
+        if retry_after is None:
+            with self._lock:
+                self._attempts.pop(chat_id, None)
+            now = time.time()
+            for message in messages[:count]:
+                metrics.observe('tiltbot_telegram_delivery_delay_seconds', now - message['queued_at'])
+            metrics.inc('tiltbot_telegram_messages_total', value=count, result='sent')
+            if count > 1:
+                metrics.inc('tiltbot_telegram_messages_total', value=count - 1, result='coalesced')
+            interval = self.chat_interval(chat_id)
+            self.outbox.finish(chat_id, count, interval, interval)
+            return True
+        with self._lock:
+            attempts = self._attempts.get(chat_id, 0) + 1
+            dropped = retry_after < 0 or attempts >= self.max_attempts
+            if dropped:
+                self._attempts.pop(chat_id, None)
+            else:
+                self._attempts[chat_id] = attempts
+        if dropped:
+            self.logger.error('Dropping %s messages to chat %s', count, chat_id)
+            metrics.inc('tiltbot_telegram_messages_total', value=count, result='dropped')
+            self.outbox.finish(chat_id, count, self.chat_interval(chat_id))
+        else:
+            metrics.inc('tiltbot_telegram_messages_total', value=count, result='retried')
+            self.outbox.finish(chat_id, 0, retry_after)
+        return True
+
+    def _post(self, chat_id: int, text: str, parse_mode: str):
+        '''
+        Send one message. Returns None when delivered, seconds to wait
+        before retrying or -1 if retrying will not help.
+        '''
+        data = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            data['parse_mode'] = parse_mode
+        with self._lock:
+            attempt = self._attempts.get(chat_id, 0)
+        try:
+            with metrics.timer('tiltbot_telegram_send_seconds'):
+                resp = http_client.post(self.send_message_url, json=data)
+        except requests.RequestException as exc:
+            metrics.inc('tiltbot_telegram_responses_total', status='error')
+            self.logger.warning('Sending message to chat %s failed: %s', chat_id, exc)
+            return 2 ** attempt
+        metrics.inc('tiltbot_telegram_responses_total', status=resp.status_code)
+        if resp.status_code == 200:
+            return None
+        if resp.status_code == 429:
+            try:
+                retry_after = resp.json()['parameters']['retry_after']
+            except (ValueError, KeyError, TypeError):
+                retry_after = 2 ** attempt
+            self.logger.warning('Telegram asked to wait %s seconds before sending to chat %s', retry_after, chat_id)
+            return retry_after
+        if resp.status_code >= 500:
+            return 2 ** attempt
+        self.logger.error('Telegram refused message to chat %s: %s %s', chat_id, resp.status_code, resp.text)
+        return -1
@@ -1,5 +1,9 @@
+import os
 import json
+import asyncio
 import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 def pretty_print(item) -> None:
     print(json.dumps(item, indent=4))
@@ -15,8 +19,27 @@ def map_key(container : dict, target_key: str, func) -> None:
             for item in container[key]:
                 map_key(item, target_key, func)
 
+def concurrent_map(func, items, max_workers=4) -> list:
+    '''
+    Call func for every item in a bounded thread pool. Returns results in
+    item order. Exceptions are returned in place of results, not raised.
+    '''
+    def call(item):
+        try:
+            return func(item)
+        except Exception as exc:
+            return exc
+
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
 
 class LogMixin:
+    __slots__ = ()
+
     @property
     def logger(self) -> logging.Logger:
        return self.getLogger()
@@ -24,3 +47,73 @@ class LogMixin:
     @staticmethod
     def getLogger() -> logging.Logger:
         return logging.getLogger('TiltBot')
+
+
+class EventLoopThread(LogMixin):
+    '''
+    Event loop of the process in a background thread. Riot lookups run
+    on it as coroutines, threaded code submits them with run_async or
+    waits for them with run_sync.
+    '''
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='event-loop', daemon=True)
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError('run_sync called from the event loop, await the coroutine instead')
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout=None) -> None:
+        for close in _stop_hooks:
+            try:
+                self.run(close(), timeout)
+            except Exception:
+                self.logger.exception('Closing %s failed', close.__qualname__)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+_stop_hooks = []
+
+def get_event_loop_thread() -> EventLoopThread:
+    global _event_loop
+    with _event_loop_lock:
+        # a loop thread does not survive fork, children start their own
+        if _event_loop is None or _event_loop.pid != os.getpid():
+            _event_loop = EventLoopThread()
+        return _event_loop
+
+def stop_event_loop_thread(timeout=None) -> None:
+    global _event_loop
+    with _event_loop_lock:
+        loop_thread, _event_loop = _event_loop, None
+    if loop_thread is not None and loop_thread.pid == os.getpid():
+        loop_thread.stop(timeout)
+
+def on_event_loop_stop(close) -> None:
+    '''
+    Register coroutine function closing connections of the running loop
+    '''
+    _stop_hooks.append(close)
+
+def run_async(coro) -> Future:
+    '''
+    Schedule coroutine on the process event loop and return its concurrent.futures.Future
+    '''
+    return get_event_loop_thread().submit(coro)
+
+def run_sync(coro, timeout=None):
+    '''
+    Run coroutine on the process event loop and block until it is done
+    '''
+    return get_event_loop_thread().run(coro, timeout)
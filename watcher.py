@@ -0,0 +1,205 @@
+import json
+import time
+import random
+import asyncio
+import threading
+import config
+from analytics import AsyncGameAnalyzer, PlayerAnalyzer
+from chatsettings import ChatSettings
+from rediscache import get_redis, get_async_redis
+from riotapi import SpectatorApi, RitoPlsError, RateLimitedError
+from utils import LogMixin, run_sync
+
+
+def watch_entry(region: str, summoner_name: str) -> str:
+    return f'{region}:{summoner_name}'
+
+def split_watch_entry(entry: str) -> tuple:
+    '''
+    Return (region, summoner_name). Entries from before regions use the default region.
+    '''
+    region, sep, summoner_name = entry.partition(':')
+    if not sep:
+        return config.DEFAULT_REGION, entry
+    return region, summoner_name
+
+
+class LiveGameWatcher(LogMixin):
+    '''
+    Polls spectator api for watched summoners. When a watched summoner's
+    game ends the match is fetched and analyzed right away so the next
+    /temp is served from cache. Optionally pushes the result to chats.
+
+    Poll times live in a redis sorted set so several processes can run
+    the watcher without polling the same summoner twice. Summoners are
+    watched as region:name entries, see watch_entry. A batch is polled
+    concurrently on the process event loop.
+    '''
+    schedule_key = 'watch_schedule'
+    chats_prefix = 'watch_chats_'
+    state_prefix = 'watch_state_'
+    # give up waiting for match data this many polls after the game ended
+    max_pending_polls = 10
+
+    def __init__(self, send_message=None, db=0):
+        self.db = db
+        self.redis = get_redis(db)
+        self.send_message = send_message
+        self.batch_size = config.WATCH_BATCH_SIZE
+        self.idle_interval = config.WATCH_IDLE_INTERVAL
+        self.max_idle_interval = config.WATCH_MAX_IDLE_INTERVAL
+        self.ingame_interval = config.WATCH_INGAME_INTERVAL
+        self.spectator_apis = {region: SpectatorApi(region) for region in config.RIOT_REGIONS}
+        for spectator_api in self.spectator_apis.values():
+            # background polling never waits for rate limit, it just tries later
+            spectator_api.max_wait = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # watch list management
+
+    def watch(self, chat_id: int, entry: str) -> None:
+        self.redis.sadd(f'{self.chats_prefix}{entry}', chat_id)
+        if self.redis.zscore(self.schedule_key, entry) is None:
+            self.redis.zadd(self.schedule_key, entry, time.time())
+
+    def unwatch(self, chat_id: int, entry: str) -> None:
+        self.redis.srem(f'{self.chats_prefix}{entry}', chat_id)
+
+    def chats(self, entry: str) -> list:
+        return [int(chat_id) for chat_id in self.redis.smembers(f'{self.chats_prefix}{entry}')]
+
+    # polling
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='live-game-watcher', daemon=True)
+        self._thread.start()
+        self.logger.info('Started live game watcher')
+
+    def stop(self, timeout=None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.wait(1):
+            try:
+                self.tick()
+            except Exception:
+                self.logger.exception('Live game watcher tick failed')
+
+    def tick(self) -> int:
+        '''
+        Poll one batch of summoners that are due. Returns batch size.
+        '''
+        due = self.redis.zrangebyscore(self.schedule_key, 0, time.time(), start=0, num=self.batch_size)
+        # zrem succeeds for only one process so each summoner is claimed once
+        claimed = [name.decode('utf-8') for name in due if self.redis.zrem(self.schedule_key, name)]
+        if not claimed:
+            return 0
+        for name, result in zip(claimed, run_sync(self.poll_many(claimed))):
+            if isinstance(result, Exception):
+                self.logger.error('Polling %s failed: %s', name, result)
+                result = self.idle_interval
+            if result is not None:
+                self.redis.zadd(self.schedule_key, name, time.time() + self._jitter(result))
+        return len(claimed)
+
+    @staticmethod
+    def _jitter(interval: float) -> float:
+        return interval * random.uniform(0.8, 1.2)
+
+    async def poll_many(self, entries: list) -> list:
+        '''
+        Poll entries concurrently. Failed polls are returned as exceptions.
+        '''
+        return await asyncio.gather(*map(self.poll, entries), return_exceptions=True)
+
+    async def poll(self, entry: str):
+        '''
+        Check summoner once. Returns seconds until next poll or None to stop watching.
+        '''
+        redis = await get_async_redis(self.db)
+        state_key = f'{self.state_prefix}{entry}'
+        region, summoner_name = split_watch_entry(entry)
+        if not await redis.scard(f'{self.chats_prefix}{entry}') or region not in self.spectator_apis:
+            await redis.delete(state_key)
+            return None
+        raw_state = await redis.get(state_key)
+        state = json.loads(raw_state.decode('utf-8')) if raw_state else {}
+
+        analyzer = AsyncGameAnalyzer(summoner_name, region)
+        try:
+            summoner = await analyzer.summoners.get(summoner_name)
+        except RateLimitedError:
+            return self.ingame_interval
+        except RitoPlsError as exc:
+            if exc.status_code != 404:
+                raise
+            self.logger.warning('Summoner %s not found. no longer watching it', entry)
+            await redis.delete(state_key)
+            return None
+        try:
+            game = await self.spectator_apis[region].get_async(summoner['id'])
+        except RateLimitedError:
+            return self.ingame_interval
+        except RitoPlsError as exc:
+            # 404 means not in game
+            if exc.status_code != 404:
+                raise
+            game = None
+
+        if game is not None:
+            if game['gameId'] != state.get('gameId'):
+                # new game started. an unfinished previous one has ended too
+                if state.get('gameId'):
+                    await self._game_ended(entry, analyzer, summoner, state)
+                state = {'gameId': game['gameId']}
+            # check rarely early in the game, often when it could end
+            next_poll = max(self.ingame_interval, 15 * 60 - game.get('gameLength', 0))
+        elif state.get('gameId'):
+            state = await self._game_ended(entry, analyzer, summoner, state)
+            next_poll = self.ingame_interval if state.get('gameId') else self.idle_interval
+        else:
+            # back off while summoner is not playing
+            idle_polls = state.get('idle_polls', 0) + 1
+            state = {'idle_polls': idle_polls}
+            next_poll = min(self.max_idle_interval, self.idle_interval * 2 ** min(idle_polls - 1, 8))
+
+        await redis.set(state_key, json.dumps(state), expire=self.max_idle_interval * 4)
+        return next_poll
+
+    async def _game_ended(self, entry: str, analyzer: AsyncGameAnalyzer, summoner: dict, state: dict) -> dict:
+        '''
+        Warm caches for ended game. Returns new state, keeping the game
+        pending while riot does not have the match data yet.
+        '''
+        game_id = state['gameId']
+        await analyzer.match_lists.invalidate(summoner['accountId'])
+        result = None
+        if game_id in await analyzer.get_game_ids():
+            self.logger.info('Game %s of %s ended. prefetching', game_id, analyzer.summoner_name)
+            try:
+                result = await analyzer.get_result(game_id)
+            except RateLimitedError:
+                raise
+            except RitoPlsError as exc:
+                # listed games can answer 404 or 503 for a while after they end
+                self.logger.debug('Match %s of %s not served yet: %s', game_id, analyzer.summoner_name, exc)
+        if result is None:
+            pending = state.get('pending', 0) + 1
+            if pending < self.max_pending_polls:
+                self.logger.debug('Match %s of %s not available yet', game_id, analyzer.summoner_name)
+                return dict(state, pending=pending)
+            self.logger.warning('Gave up waiting for match %s of %s', game_id, analyzer.summoner_name)
+            return {}
+        if self.send_message is not None:
+            # chat settings and outbox use the threaded redis client
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._push, entry, PlayerAnalyzer.render(analyzer.summoner_name, result))
+        return {}
+
+    def _push(self, entry: str, message: str) -> None:
+        for chat_id in self.chats(entry):
+            if ChatSettings(chat_id).get_autopush():
+                self.send_message(chat_id, message)
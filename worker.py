@@ -0,0 +1,88 @@
+import sys
+import time
+import signal
+import threading
+import logging
+import config
+from rediscache import get_cache_stats
+from riotdata import ChampionRefresher
+from tgapi import build_command_delegator, BaseCommandHandler
+from tgpoller import UpdatePoller
+from tgsender import TelegramSender
+from utils import LogMixin, stop_event_loop_thread
+from watcher import LiveGameWatcher
+from workqueue import UpdateWorkerPool
+
+FORMAT = '%(asctime)-15s %(filename)15s:%(lineno)3d %(levelname)-8s %(message)s'
+
+
+class BackgroundServices(LogMixin):
+    '''
+    Update worker pool, getUpdates poller in polling mode, telegram
+    sender, champion data refresher and optional live game watcher of
+    one process
+    '''
+
+    def __init__(self, workers=None, queue=None):
+        delegator = build_command_delegator()
+        self.pool = UpdateWorkerPool(delegator.delegate_update, workers, queue=queue)
+        self.poller = None
+        if config.UPDATE_MODE == 'polling':
+            self.poller = UpdatePoller(delegator.delegate_update, workers, queue=self.pool.queue)
+        self.sender = TelegramSender()
+        self.refresher = None
+        if config.CHAMPION_REFRESH_INTERVAL:
+            self.refresher = ChampionRefresher()
+        self.watcher = None
+        if config.WATCHER_ENABLED:
+            self.watcher = LiveGameWatcher(BaseCommandHandler()._send_message)
+
+    def start(self) -> None:
+        if self.refresher is not None:
+            self.refresher.start()
+        self.sender.start()
+        self.pool.start()
+        if self.poller is not None:
+            self.poller.start()
+        if self.watcher is not None:
+            self.watcher.start()
+
+    def stop(self, timeout=None) -> None:
+        '''
+        Stop taking new work and wait for commands in progress to finish
+        '''
+        deadline = time.monotonic() + (config.SHUTDOWN_TIMEOUT if timeout is None else timeout)
+        self.logger.info('Draining background services')
+        if self.watcher is not None:
+            self.watcher.stop(max(0, deadline - time.monotonic()))
+        if self.poller is not None:
+            self.poller.stop(max(0, deadline - time.monotonic()))
+        self.pool.stop(max(0, deadline - time.monotonic()))
+        # replies of drained commands are in the outbox and go out now
+        self.sender.stop(max(0, deadline - time.monotonic()))
+        if self.refresher is not None:
+            self.refresher.stop(max(0, deadline - time.monotonic()))
+        stop_event_loop_thread(max(0, deadline - time.monotonic()))
+        get_cache_stats().flush()
+
+
+def main(workers=None):
+    logging.basicConfig(format=FORMAT)
+    logger = logging.getLogger('TiltBot')
+    logger.setLevel(logging.DEBUG)
+    services = BackgroundServices(workers)
+    services.start()
+    stopping = threading.Event()
+    # docker stop sends SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    logger.info('Stopping workers')
+    services.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
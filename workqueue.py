@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from collections import deque
+from concurrent.futures import wait
+import config
+from rediscache import get_redis
+from utils import LogMixin
+
+
+class UpdateQueue(LogMixin):
+    '''
+    Durable redis backed queue of telegram updates. Updates are
+    deduplicated by update_id so resent webhooks are processed once.
+    '''
+    queue_key = 'tg_updates'
+    processing_prefix = 'tg_updates_processing_'
+    heartbeat_prefix = 'tg_updates_heartbeat_'
+    seen_prefix = 'tg_update_seen_'
+
+    def __init__(self, db=0, dedup_ttl=None):
+        self.redis = get_redis(db)
+        self.dedup_ttl = dedup_ttl or config.UPDATE_DEDUP_TTL
+
+    def enqueue(self, update: dict) -> bool:
+        '''
+        Add update to queue. Returns False if update was already seen.
+        '''
+        update_id = update.get('update_id')
+        if update_id is not None and not self.mark_seen(update_id):
+            self.logger.info('Skipping duplicate update %s', update_id)
+            return False
+        self.redis.lpush(self.queue_key, json.dumps(update))
+        return True
+
+    def mark_seen(self, update_id: int) -> bool:
+        '''
+        Remember update. Returns False if it was seen before.
+        '''
+        return bool(self.redis.set(f'{self.seen_prefix}{update_id}', 1, ex=self.dedup_ttl, nx=True))
+
+    def is_seen(self, update_id: int) -> bool:
+        return bool(self.redis.exists(f'{self.seen_prefix}{update_id}'))
+
+    def __len__(self):
+        return self.redis.llen(self.queue_key)
+
+    def requeue_orphaned(self) -> int:
+        '''
+        Move updates left in processing lists of dead workers back to queue
+        '''
+        moved = 0
+        for key in self.redis.scan_iter(f'{self.processing_prefix}*'):
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            pool_id = key[len(self.processing_prefix):]
+            if self.redis.exists(f'{self.heartbeat_prefix}{pool_id}'):
+                continue
+            while self.redis.rpoplpush(key, self.queue_key) is not None:
+                moved += 1
+        if moved:
+            self.logger.warning('Requeued %s updates of dead workers', moved)
+        return moved
+
+
+class UpdateWorkerPool(LogMixin):
+    '''
+    Pool of threads draining UpdateQueue. Update is kept in a per pool
+    processing list until handled so it survives a crash of the process.
+
+    handle_update may return a future for commands whose replies are
+    looked up on the event loop. The thread takes the next update right
+    away and the update leaves the processing list when the future is
+    done. At most config.MAX_PENDING_COMMANDS futures are pending.
+    '''
+    heartbeat_interval = 10
+    poll_timeout = 1
+
+    def __init__(self, handle_update, workers=None, queue=None):
+        self.handle_update = handle_update
+        self.workers = workers if workers is not None else config.WORKERS
+        self.queue = queue or UpdateQueue()
+        self.redis = self.queue.redis
+        self.pool_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.processing_key = f'{self.queue.processing_prefix}{self.pool_id}'
+        self.heartbeat_key = f'{self.queue.heartbeat_prefix}{self.pool_id}'
+        self._stop = threading.Event()
+        self._threads = []
+        self._slots = threading.BoundedSemaphore(config.MAX_PENDING_COMMANDS)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # items of finished futures, removed from the processing list by worker threads
+        self._finished = deque()
+
+    def start(self) -> None:
+        self._beat()
+        self.queue.requeue_orphaned()
+        self._threads = [threading.Thread(target=self._heartbeat, name='update-heartbeat', daemon=True)]
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f'update-worker-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        self.logger.info('Started %s update workers (%s)', self.workers, self.pool_id)
+
+    def stop(self, timeout=None) -> None:
+        '''
+        Stop taking new updates and wait for the ones in progress
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._pending_lock:
+            pending = list(self._pending)
+        if pending:
+            self.logger.info('Waiting for %s commands in progress', len(pending))
+            wait(pending, None if deadline is None else max(0, deadline - time.monotonic()))
+        self._remove_finished()
+        self.redis.delete(self.heartbeat_key)
+
+    def _beat(self) -> None:
+        self.redis.set(self.heartbeat_key, 1, ex=self.heartbeat_interval * 3)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self._beat()
+            except Exception as exc:
+                self.logger.error('Worker heartbeat failed: %s', exc)
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            self._remove_finished()
+            # no new updates while the event loop is full of commands
+            if not self._slots.acquire(timeout=self.poll_timeout):
+                continue
+            try:
+                item = self.redis.brpoplpush(self.queue.queue_key, self.processing_key, self.poll_timeout)
+            except Exception as exc:
+                self._slots.release()
+                self.logger.error('Reading update queue failed: %s', exc)
+                self._stop.wait(self.poll_timeout)
+                continue
+            if item is None:
+                self._slots.release()
+                continue
+            self._handle(item)
+
+    def _handle(self, item: bytes) -> None:
+        try:
+            pending = self.handle_update(json.loads(item.decode('utf-8')))
+        except Exception:
+            self.logger.exception('Handling update failed')
+            pending = None
+        if pending is None:
+            self._slots.release()
+            self.redis.lrem(self.processing_key, item, 1)
+            return
+        with self._pending_lock:
+            self._pending.add(pending)
+        pending.add_done_callback(lambda future: self._done(future, item))
+
+    def _done(self, future, item: bytes) -> None:
+        # runs on the event loop thread, redis is left to the worker threads
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error('Handling update failed', exc_info=future.exception())
+        with self._pending_lock:
+            self._pending.discard(future)
+        self._finished.append(item)
+        self._slots.release()
+
+    def _remove_finished(self) -> None:
+        while True:
+            try:
+                item = self._finished.popleft()
+            except IndexError:
+                return
+            self.redis.lrem(self.processing_key, item, 1)